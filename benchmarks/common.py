@@ -0,0 +1,110 @@
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+# бенчмарк работает на отдельной базе, bd.sqlite не трогаем
+os.environ.setdefault(
+    'EXCHANGE_DB_URL',
+    'sqlite:///{0}'.format(os.path.join(tempfile.mkdtemp(), 'bench.sqlite')),
+)
+
+import sqlalchemy as sa  # noqa: E402 isort:skip
+from exchange.db import Base, get_engine  # noqa: E402 isort:skip
+
+
+class QueryCounter:
+    # считает SQL-запросы отдельно в каждом потоке
+    def __init__(self) -> None:
+        self._local = threading.local()
+        sa.event.listen(get_engine(), 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *_: Any) -> None:
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self) -> int:
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+queries = QueryCounter()
+
+
+def reset_db() -> None:
+    Base.metadata.drop_all(get_engine())
+    Base.metadata.create_all(get_engine())
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def summarize(latencies: List[float], query_counts: List[int]) -> Dict[str, Any]:
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'queries_per_op': statistics.mean(query_counts) if query_counts else 0,
+    }
+
+
+def measure(function: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    latencies, query_counts = [], []
+    for _ in range(iterations):
+        queries.take()
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+        query_counts.append(queries.take())
+    return summarize(latencies, query_counts)
+
+
+def git_commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save(path: str, kind: str, params: Dict[str, Any], results: Dict[str, Any]) -> None:
+    report = {
+        'kind': kind,
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as target:
+        json.dump(report, target, indent=2, sort_keys=True)
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    print(
+        '{0:<28} {1:>8} {2:>10} {3:>10} {4:>10} {5:>8}'.format(
+            'name', 'count', 'p50 ms', 'p99 ms', 'ops/s', 'queries'
+        )
+    )
+    for name, result in results.items():
+        print(
+            '{0:<28} {1:>8} {2:>10.3f} {3:>10.3f} {4:>10.1f} {5:>8.1f}'.format(
+                name,
+                result['count'],
+                result['p50_ms'],
+                result['p99_ms'],
+                result.get('throughput', 1000 / result['mean_ms']),
+                result['queries_per_op'],
+            )
+        )
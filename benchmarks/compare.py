@@ -0,0 +1,34 @@
+import argparse
+import json
+
+METRICS = ('p50_ms', 'p99_ms', 'queries_per_op')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+    with open(args.before) as source:
+        before = json.load(source)
+    with open(args.after) as source:
+        after = json.load(source)
+
+    print('{0} -> {1}'.format(before['commit'][:8], after['commit'][:8]))
+    for name, result in after['results'].items():
+        old = before['results'].get(name)
+        if old is None:
+            continue
+        changes = []
+        for metric in METRICS:
+            if old[metric]:
+                changes.append(
+                    '{0} {1:+.1f}%'.format(
+                        metric, (result[metric] / old[metric] - 1) * 100
+                    )
+                )
+        print('{0:<28} {1}'.format(name, ', '.join(changes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.common import queries, print_table, reset_db, save, summarize
+from exchange.app import server
+from exchange.rates import create_market
+
+API = '/market/api/v1.0'
+
+
+def setup(users: int, currencies: int) -> List[str]:
+    reset_db()
+    create_market()
+    client = server.test_client()
+    for number in range(max(0, currencies - 5)):
+        client.post(
+            API + '/add',
+            data=json.dumps(
+                {'name': 'coin{0}'.format(number), 'sold_price': 2, 'buy_price': 1}
+            ),
+            content_type='application/json',
+        )
+    client.post(
+        API + '/registration/bulk',
+        data=json.dumps({'names': ['user{0}'.format(i) for i in range(users)]}),
+        content_type='application/json',
+    )
+    rates = json.loads(client.get(API + '/get_exchange_rate_all').get_data())
+    return list(rates['EXCHANGE RATE'])
+
+
+def make_request(
+    client: Any, rng: random.Random, mix: Dict[str, float], users: int, names: List[str]
+) -> Tuple[str, Any]:
+    user = rng.randint(1, users)
+    kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+    if kind == 'read':
+        route = rng.choice(['get_exchange_rate_all', 'get_portfolio', 'get_ye'])
+        if route == 'get_exchange_rate_all':
+            return route, lambda: client.get(API + '/get_exchange_rate_all')
+        return route, lambda: client.get('{0}/{1}/{2}'.format(API, user, route))
+    body = json.dumps({'name': rng.choice(names), 'count': '0.01'})
+    return kind, lambda: client.post(
+        '{0}/{1}/{2}'.format(API, user, kind),
+        data=body,
+        content_type='application/json',
+    )
+
+
+def worker(
+    seed: int,
+    deadline: float,
+    mix: Dict[str, float],
+    users: int,
+    names: List[str],
+    samples: Dict[str, List[Tuple[float, int]]],
+    lock: threading.Lock,
+) -> None:
+    rng = random.Random(seed)
+    client = server.test_client()
+    local: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+    while time.perf_counter() < deadline:
+        route, call = make_request(client, rng, mix, users, names)
+        queries.take()
+        start = time.perf_counter()
+        call()
+        local[route].append((time.perf_counter() - start, queries.take()))
+    with lock:
+        for route, values in local.items():
+            samples[route].extend(values)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local load generator for the API')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--currencies', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--buy', type=float, default=0.1)
+    parser.add_argument('--sold', type=float, default=0.1)
+    parser.add_argument('--read', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_load.json')
+    args = parser.parse_args()
+
+    names = setup(args.users, args.currencies)
+    mix = {'buy': args.buy, 'sold': args.sold, 'read': args.read}
+    samples: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(args.seed + i, deadline, mix, args.users, names, samples, lock),
+        )
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for route, values in sorted(samples.items()):
+        result = summarize(
+            [value[0] for value in values], [value[1] for value in values]
+        )
+        result['throughput'] = len(values) / args.duration
+        results[route] = result
+    print_table(results)
+    save(args.output, 'load', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
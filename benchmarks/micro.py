@@ -0,0 +1,52 @@
+import argparse
+from decimal import Decimal
+from typing import Any
+
+from benchmarks.common import measure, print_table, reset_db, save
+from exchange.accounts import create_portfolio
+from exchange.db import User, create_session
+from exchange.rates import create_market, prepare_transaction
+from exchange.ticker import RateTicker, UniformModel
+from exchange.trade import TradeRequest, execute_trade
+
+
+def register(session: Any, name: str) -> None:
+    user = User(name)
+    session.add(user)
+    session.flush()
+    create_portfolio(session, [user.id])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Micro benchmarks of the hot paths')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--output', default='bench_micro.json')
+    args = parser.parse_args()
+
+    reset_db()
+    create_market()
+    with create_session() as session:
+        register(session, 'bench')
+    ticker = RateTicker(UniformModel(0.99, 1.01))
+
+    def portfolio() -> None:
+        with create_session() as session:
+            register(session, 'user')
+
+    def trade() -> None:
+        execute_trade(TradeRequest(1, 'btc', Decimal('0.001'), Decimal('0.01'), 'buy'))
+
+    results = {
+        'prepare_transaction': measure(
+            lambda: prepare_transaction('btc', '1', 'buy'), args.iterations
+        ),
+        'create_portfolio': measure(portfolio, args.iterations),
+        'execute_trade': measure(trade, args.iterations),
+        'change_exchange_rate': measure(ticker.tick, max(1, args.iterations // 10)),
+    }
+    print_table(results)
+    save(args.output, 'micro', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
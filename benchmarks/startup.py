@@ -0,0 +1,53 @@
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict, List
+
+from benchmarks.common import print_table, save, summarize
+
+# каждый запуск - новый процесс: импорт модулей не кэшируется между замерами
+PROBE = '''
+import json, time
+start = time.perf_counter()
+from exchange.app import create_app
+from exchange.db import init_db
+from exchange.rates import create_market
+from exchange.storage import StorageConfig
+imported = time.perf_counter()
+app = create_app(StorageConfig(url='sqlite://'))
+created = time.perf_counter()
+init_db()
+create_market()
+seeded = time.perf_counter()
+with app.test_client() as client:
+    assert client.get('/market/api/v1.0/get_exchange_rate_all').status_code == 200
+answered = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'init_db+create_market': seeded - created,
+    'first_request': answered - seeded,
+    'ready': answered - start,
+}))
+'''
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Import and startup time of the app')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--output', default='bench_startup.json')
+    args = parser.parse_args()
+
+    timings: Dict[str, List[float]] = {}
+    for _ in range(args.iterations):
+        output = subprocess.check_output([sys.executable, '-c', PROBE])
+        for name, value in json.loads(output).items():
+            timings.setdefault(name, []).append(value)
+    results = {name: summarize(values, []) for name, values in timings.items()}
+    print_table(results)
+    save(args.output, 'startup', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import os
+from collections import OrderedDict, deque
+from decimal import Decimal
+from threading import Lock
+from typing import Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+from exchange.db import (
+    START_YE,
+    ExchangeRate,
+    FixedDecimal,
+    Session,
+    User,
+    UserCurrency,
+    create_session,
+    table_of,
+)
+from exchange.ledger import open_accounts
+from flask import Blueprint, jsonify, request
+
+MAX_USERS = 10000
+# sqlite ограничивает число параметров в одном запросе
+CHUNK_SIZE = 500
+DEFAULT_CAPACITY = 100000
+RECENT_SIZE = 1024
+# ключ session.info: пользователи, чьи балансы меняет транзакция
+CHANGED = 'changed_accounts'
+
+accounts = Blueprint('accounts', __name__)
+
+PORTFOLIO_COLUMNS = ['user_id', 'name_currency', 'count_currency']
+
+
+class Account(NamedTuple):
+    ye: Decimal
+    portfolio: Dict[str, Decimal]
+
+
+class HotAccounts:
+    # недавно прочитанные счета: повторное чтение не идёт в базу. Сделки
+    # сбрасывают счёт после коммита, а чтение, начатое до сброса, не кладёт
+    # в кэш балансы, прочитанные до сделки
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.epoch = 0
+        self._lock = Lock()
+        self._accounts: 'OrderedDict[int, Account]' = OrderedDict()
+        # (номер сброса, пользователь); None - сброшены все счета
+        self._recent: Deque[Tuple[int, Optional[int]]] = deque(maxlen=RECENT_SIZE)
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def clear(self) -> None:
+        self.invalidate(None)
+
+    def get_many(self, user_ids: List[int]) -> Dict[int, Account]:
+        found = {}
+        with self._lock:
+            for user_id in user_ids:
+                account = self._accounts.get(user_id)
+                if account is not None:
+                    self._accounts.move_to_end(user_id)
+                    found[user_id] = account
+        return found
+
+    def fill(self, loaded: Dict[int, Account], epoch: int) -> None:
+        # epoch - номер сброса, снятый до чтения из базы
+        with self._lock:
+            recent = [user for number, user in self._recent if number > epoch]
+            if len(recent) < self.epoch - epoch or None in recent:
+                # сбросов было больше, чем помнит очередь, или сброшено всё
+                return
+            stale = set(recent)
+            for user_id, account in loaded.items():
+                if user_id not in stale:
+                    self._accounts[user_id] = account
+                    self._accounts.move_to_end(user_id)
+            while len(self._accounts) > self.capacity:
+                self._accounts.popitem(last=False)
+
+    def invalidate(self, user_ids: Optional[Iterable[int]]) -> None:
+        with self._lock:
+            if user_ids is None:
+                self._accounts.clear()
+                self.epoch += 1
+                self._recent.append((self.epoch, None))
+                return
+            for user_id in user_ids:
+                self._accounts.pop(user_id, None)
+                self.epoch += 1
+                self._recent.append((self.epoch, user_id))
+
+
+hot_accounts = HotAccounts(
+    int(os.environ.get('EXCHANGE_ACCOUNT_CACHE_SIZE', DEFAULT_CAPACITY))
+)
+
+
+def mark_changed(session: Any, user_ids: Optional[Iterable[int]] = None) -> None:
+    # без user_ids транзакция меняет счета всех пользователей
+    changed = session.info.get(CHANGED, set())
+    if user_ids is None or changed is None:
+        session.info[CHANGED] = None
+    else:
+        session.info[CHANGED] = changed | set(user_ids)
+
+
+@sa.event.listens_for(Session, 'after_transaction_end')
+def forget_changed(session: Any, transaction: Any) -> None:
+    # только по внешней транзакции: savepoint ещё не означает коммит
+    if transaction.parent is None and CHANGED in session.info:
+        hot_accounts.invalidate(session.info.pop(CHANGED))
+
+
+def read_accounts(session: Any, user_ids: List[int]) -> Dict[int, Account]:
+    # балансы и портфели одним проходом IN-запросов
+    loaded: Dict[int, Account] = {}
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        rows = session.execute(
+            sa.select(
+                [
+                    User.id,
+                    User.ye,
+                    UserCurrency.name_currency,
+                    UserCurrency.count_currency,
+                ]
+            )
+            .select_from(
+                sa.outerjoin(User, UserCurrency, User.id == UserCurrency.user_id)
+            )
+            .where(User.id.in_(user_ids[start : start + CHUNK_SIZE]))
+        )
+        for user_id, ye, name, count in rows:
+            account = loaded.setdefault(user_id, Account(ye, {}))
+            if name is not None:
+                account.portfolio[name] = count
+    return loaded
+
+
+def insert_users(session: Any, names: List[str]) -> List[int]:
+    # id берутся из самих INSERT, а не из max(id): параллельная регистрация
+    # не подмешает свои строки
+    table = table_of(User)
+    rows = [{'name': name, 'ye': START_YE} for name in names]
+    if session.get_bind().dialect.name == 'postgresql':
+        ids: List[int] = []
+        for start in range(0, len(rows), CHUNK_SIZE):
+            ids.extend(
+                user_id
+                for user_id, in session.execute(
+                    table.insert()
+                    .values(rows[start : start + CHUNK_SIZE])
+                    .returning(table.c.id)
+                )
+            )
+        return ids
+    # sqlite без RETURNING: id каждой строки - lastrowid её INSERT
+    return [
+        session.execute(table.insert(), row).inserted_primary_key[0] for row in rows
+    ]
+
+
+def create_portfolio(session: Any, user_ids: List[int]) -> None:
+    # один INSERT ... SELECT: строка на каждую пару (пользователь, валюта)
+    open_accounts(session, user_ids)
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        session.execute(
+            table_of(UserCurrency)
+            .insert()
+            .from_select(
+                PORTFOLIO_COLUMNS,
+                sa.select(
+                    [User.id, ExchangeRate.name, sa.literal(Decimal(0), FixedDecimal)]
+                ).where(User.id.in_(user_ids[start : start + CHUNK_SIZE])),
+            )
+        )
+
+
+def add_currency_portfolio(session: Any, name_currency: str) -> None:
+    mark_changed(session)
+    session.execute(
+        table_of(UserCurrency)
+        .insert()
+        .from_select(
+            PORTFOLIO_COLUMNS,
+            sa.select(
+                [
+                    User.id,
+                    sa.literal(name_currency, sa.String),
+                    sa.literal(Decimal(0), FixedDecimal),
+                ]
+            ),
+        )
+    )
+
+
+@accounts.route('/registration/bulk', methods=['POST'])
+def registration_bulk() -> Any:
+    names = request.json.get('names') if request.json else None
+    if (
+        not isinstance(names, list)
+        or not 0 < len(names) <= MAX_USERS
+        or not all(isinstance(name, str) for name in names)
+    ):
+        return (
+            jsonify(
+                {
+                    'ERROR': 'Invalid data, please give from 1 to {0} '
+                    'usernames'.format(MAX_USERS)
+                }
+            ),
+            400,
+        )
+
+    with create_session() as session:
+        ids = insert_users(session, names)
+        create_portfolio(session, ids)
+    return jsonify({'REGISTRATION': names, 'IDS': ids})
+
+
+@accounts.route('/balances', methods=['POST'])
+def get_balances() -> Any:
+    user_ids = request.json.get('ids') if request.json else None
+    if (
+        not isinstance(user_ids, list)
+        or not 0 < len(user_ids) <= MAX_USERS
+        or not all(isinstance(user_id, int) for user_id in user_ids)
+    ):
+        return (
+            jsonify({'ERROR': 'Please give from 1 to {0} user ids'.format(MAX_USERS)}),
+            400,
+        )
+    user_ids = list(dict.fromkeys(user_ids))
+    found = hot_accounts.get_many(user_ids)
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        epoch = hot_accounts.epoch
+        with create_session() as session:
+            loaded = read_accounts(session, missing)
+        hot_accounts.fill(loaded, epoch)
+        found.update(loaded)
+    return jsonify(
+        {
+            'BALANCES': {
+                str(user_id): {
+                    'COUNT_YE': str(account.ye),
+                    'PORTFOLIO': {
+                        name: str(count) for name, count in account.portfolio.items()
+                    },
+                }
+                for user_id, account in found.items()
+            },
+            'NOT FOUND': [user_id for user_id in user_ids if user_id not in found],
+        }
+    )
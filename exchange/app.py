@@ -1,61 +1,63 @@
-import time
-from datetime import datetime
 from decimal import Decimal, getcontext
-from random import uniform
-from typing import Any, List, Tuple, Dict
-
-from exchange.db import ExchangeRate, User, UserCurrency, UserOperations, create_session
-from exchange.exception import CurrencyNotFound, UserNotFound
-from flask import Flask, jsonify, request
-
-server = Flask(__name__)
-
-
-@server.errorhandler(UserNotFound)
-def handle_not_found_user(error: str) -> Any:
-    return jsonify({'ERROR': '{0}'.format(error)}), 404
-
-
-@server.errorhandler(CurrencyNotFound)
-def handle_not_found_currency(error: str) -> Any:
-    return jsonify({'ERROR': '{0}'.format(error)}), 404
-
-
-def create_market() -> None:
-    lst = ['btc', 'eth', 'xpr', 'trx', 'ltc']
-    price = 10
-    with create_session() as session:
-        for name in lst:
-            session.add(ExchangeRate(name, Decimal(price + 2), Decimal(price)))
-            price += 10
-
-
-def create_portfolio(id_user: int, all_currencies: Any) -> List[UserCurrency]:
-    portfolios = []
-    for item in all_currencies:
-        portfolios.append(UserCurrency(id_user, item.name))
-    return portfolios
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+from exchange.accounts import (
+    accounts,
+    add_currency_portfolio,
+    create_portfolio,
+    hot_accounts,
+)
+from exchange.batch import batch
+from exchange.broadcast import broadcaster, stream
+from exchange.candles import candles
+from exchange.db import (
+    ExchangeRate,
+    User,
+    UserCurrency,
+    UserOperations,
+    create_session,
+    storage,
+)
+from exchange.errors import errors
+from exchange.exception import UserNotFound
+from exchange.export import export
+from exchange.formats import number, rate_table, respond
+from exchange.history import history
+from exchange.idempotency import idempotency_store, idempotent
+from exchange.limits import install as install_limits
+from exchange.metrics import install as install_metrics
+from exchange.orderbook import matching_engine
+from exchange.orders import orders
+from exchange.quotes import quote_book, quotes
+from exchange.rates import bump_version, cost, rate_cache, unit_price
+from exchange.shards import trade_router
+from exchange.storage import StorageConfig
+from exchange.ticker import rate_ticker
+from exchange.trade import TradeRequest, TradeResult
+from exchange.valuation import valuation, valuation_store
+from flask import Blueprint, Flask, jsonify, request
+
+market = Blueprint('market', __name__)
+BLUEPRINTS = (
+    errors,
+    accounts,
+    orders,
+    batch,
+    history,
+    stream,
+    valuation,
+    candles,
+    export,
+    quotes,
+)
 
 
 def change_exchange_rate() -> None:
-    while True:
-        time.sleep(10)
-        with create_session() as session:
-            percent = Decimal(uniform(0.9, 1.1))
-            for currency in session.query(ExchangeRate):
-                getcontext().prec = 5
-                currency.sold_price = str(Decimal(currency.sold_price) * percent)
-                currency.buy_price = str(Decimal(currency.buy_price) * percent)
-
+    rate_ticker.run()
 
-def check_time(time_now: datetime) -> datetime:
-    if datetime.now().second > time_now.second + 9:
-        time_now = datetime.now()
-        return jsonify({'ATTENTION': 'Exchange rate was changed!'})
-    return time_now
 
-
-@server.route('/market/api/v1.0/registration', methods=['POST'])
+@market.route('/registration', methods=['POST'])
 def registration() -> Any:
     if not request.json or 'name' not in request.json:
         return (
@@ -63,28 +65,24 @@ def registration() -> Any:
             400,
         )
     name: str = request.json.get('name')
-
     with create_session() as session:
-        user: User = User(request.json.get('name'))
+        user: User = User(name)
         session.add(user)
-        session.commit()
-        all_currencies = session.query(ExchangeRate).all()
-        portfolios = create_portfolio(user.id, all_currencies)
-        for item in portfolios:
-            session.add(item)
+        session.flush()
+        create_portfolio(session, [user.id])
     return jsonify({'REGISTRATION': name})
 
 
-@server.route('/market/api/v1.0/<identification>/get_ye', methods=['GET'])
+@market.route('/<identification>/get_ye', methods=['GET'])
 def get_count_ye(identification: str) -> Any:
     with create_session() as session:
         user = session.query(User).filter(User.id == int(identification)).first()
         if user is not None:
-            return jsonify({'COUNT_YE': user.ye})
+            return jsonify({'COUNT_YE': str(user.ye)})
         raise UserNotFound('User not found')
 
 
-@server.route('/market/api/v1.0/<identification>/get_portfolio', methods=['GET'])
+@market.route('/<identification>/get_portfolio', methods=['GET'])
 def get_portfolio(identification: str) -> Any:
     with create_session() as session:
         portfolio = (
@@ -95,12 +93,12 @@ def get_portfolio(identification: str) -> Any:
         if len(portfolio) != 0:
             result = {}
             for item in portfolio:
-                result[item.name_currency] = item.count_currency
+                result[item.name_currency] = str(item.count_currency)
             return jsonify({'PORTFOLIO': result})
         raise UserNotFound('User not found')
 
 
-@server.route('/market/api/v1.0/<identification>/get_operations', methods=['GET'])
+@market.route('/<identification>/get_operations', methods=['GET'])
 def get_operations(identification: str) -> Any:
     with create_session() as session:
         operations = (
@@ -110,23 +108,33 @@ def get_operations(identification: str) -> Any:
         )
         if len(operations) == 0:
             raise UserNotFound('User not found')
-        result = {}
-        for number, item in enumerate(operations):
-            result[str(number)] = 'action: {0}, currency: {1}, count: {2}'.format(
-                item.action, item.currency, item.count
-            )
-        return jsonify({'OPERATIONS': result})
+        return respond(
+            lambda: {
+                'OPERATIONS': {
+                    str(index): 'action: {0}, currency: {1}, count: {2}'.format(
+                        item.action, item.currency, item.count
+                    )
+                    for index, item in enumerate(operations)
+                }
+            },
+            lambda: {
+                'operations': [
+                    {
+                        'action': item.action,
+                        'currency': item.currency,
+                        'count': number(item.count),
+                        'price': None if item.price is None else number(item.price),
+                        'created': item.created.isoformat() if item.created else None,
+                    }
+                    for item in operations
+                ]
+            },
+        )
 
 
-@server.route('/market/api/v1.0/get_exchange_rate_all', methods=['GET'])
+@market.route('/get_exchange_rate_all', methods=['GET'])
 def get_exchange_rate_all() -> Any:
-    result: Dict[str, str] = {}
-    with create_session() as session:
-        for currency in session.query(ExchangeRate):
-            result[currency.name] = 'sold price : {0}, buy price : {1}'.format(
-                currency.sold_price, currency.buy_price
-            )
-    return jsonify({'EXCHANGE RATE': result})
+    return rate_table.response(rate_cache.current())
 
 
 def check_request(rq: Any) -> Any:
@@ -143,38 +151,34 @@ def check_request(rq: Any) -> Any:
     return name_currency, count
 
 
-def prepare_transaction(
-    name_currency: str, count: str, identification: str, action: str
-) -> Tuple[Decimal, Decimal, Decimal]:
-    with create_session(expire_on_commit=False) as session:
-        getcontext().prec = 5
-        price_currency = (
-            session.query(ExchangeRate)
-            .filter(ExchangeRate.name == name_currency)
-            .first()
+def execute(
+    identification: str, name_currency: str, count: str, action: str
+) -> TradeResult:
+    quote = request.json.get('quote')
+    if quote is None:
+        price = unit_price(
+            rate_cache.resolve(request.json.get('version')), name_currency, action
         )
-        if price_currency is None:
-            raise CurrencyNotFound('This currency does not exist')
-        if action == 'buy':
-            price_currency = price_currency.sold_price
-        else:
-            price_currency = price_currency.buy_price
-        price_transaction = Decimal(price_currency) * Decimal(count)
-        user_ye = session.query(User).filter(User.id == int(identification)).first()
-
-        user_currency = (
-            session.query(UserCurrency)
-            .filter(UserCurrency.user_id == int(identification))
-            .filter(UserCurrency.name_currency == name_currency)
-            .first()
-        )
-        if user_currency is None or user_ye is None:
-            raise UserNotFound('User not found')
-        return (
-            price_transaction,
-            Decimal(user_ye.ye),
-            Decimal(user_currency.count_currency),
+    else:
+        # цена берётся из котировки, курс не перечитывается; котировка
+        # гасится до сделки и возвращается, если сделка не прошла
+        price = quote_book.redeem(
+            str(quote), int(identification), name_currency, action, Decimal(count)
         )
+    trade = TradeRequest(
+        int(identification),
+        name_currency,
+        Decimal(count),
+        cost(price, Decimal(count)),
+        action,
+        price,
+    )
+    try:
+        return trade_router.execute(trade)
+    except Exception:
+        if quote is not None:
+            quote_book.release(str(quote))
+        raise
 
 
 def create_json(user_ye: str, name_currency: str, update_user_currency: str) -> Any:
@@ -188,7 +192,8 @@ def create_json(user_ye: str, name_currency: str, update_user_currency: str) ->
     )
 
 
-@server.route('/market/api/v1.0/<identification>/buy', methods=['POST'])
+@market.route('/<identification>/buy', methods=['POST'])
+@idempotent
 def buy_currency(identification: str) -> Any:
     name_currency, count_buy = check_request(request)
     if name_currency is None and count_buy is None:
@@ -201,64 +206,19 @@ def buy_currency(identification: str) -> Any:
             404,
         )
 
-    price_transaction, user_ye, user_currency = prepare_transaction(
-        name_currency, count_buy, identification, 'buy'
-    )
-    with create_session() as session:
-        getcontext().prec = 5
-        # check_time(TIME)
-        if user_ye >= price_transaction:
-            user_ye -= price_transaction
-            session.query(User).filter(User.id == int(identification)).first().ye = str(
-                user_ye
-            )
-            update_user_currency = user_currency + Decimal(count_buy)
-            session.query(UserCurrency).filter(
-                UserCurrency.user_id == int(identification)
-            ).filter(
-                UserCurrency.name_currency == name_currency
-            ).first().count_currency = str(
-                update_user_currency
-            )
-            session.add(
-                UserOperations(int(identification), 'buy', name_currency, count_buy,)
-            )
-            return create_json(str(user_ye), name_currency, str(update_user_currency))
-        return jsonify({'ERROR': 'Not enough ye for this transaction'})
-
-
-@server.route('/market/api/v1.0/<identification>/sold', methods=['POST'])
+    result = execute(identification, name_currency, count_buy, 'buy')
+    return create_json(str(result.ye), name_currency, str(result.count_currency))
+
+
+@market.route('/<identification>/sold', methods=['POST'])
+@idempotent
 def sold_currency(identification: str) -> Any:
     name_currency, count_sold = check_request(request)
-    price_transaction, user_ye, user_currency = prepare_transaction(
-        name_currency, count_sold, identification, 'sold'
-    )
+    result = execute(identification, name_currency, count_sold, 'sold')
+    return create_json(str(result.ye), name_currency, str(result.count_currency))
 
-    with create_session() as session:
-        getcontext().prec = 5
-        # check_time(TIME)
-        if user_currency >= Decimal(count_sold):
-            user_ye += price_transaction
-            session.query(User).filter(User.id == int(identification)).first().ye = str(
-                user_ye
-            )
-            update_user_currency = user_currency - Decimal(count_sold)
-
-            session.query(UserCurrency).filter(
-                UserCurrency.user_id == int(identification)
-            ).filter(
-                UserCurrency.name_currency == name_currency
-            ).first().count_currency = str(
-                update_user_currency
-            )
-            session.add(
-                UserOperations(int(identification), 'sold', name_currency, count_sold,)
-            )
-            return create_json(str(user_ye), name_currency, str(update_user_currency))
-    return jsonify({'ERROR': 'Not enough currency for this transaction'})
-
-
-@server.route('/market/api/v1.0/add', methods=['POST'])
+
+@market.route('/add', methods=['POST'])
 def add_currency() -> Any:
     # изменить портфель валют
     if (
@@ -283,9 +243,9 @@ def add_currency() -> Any:
 
     with create_session() as session:
         session.add(ExchangeRate(name_currency, sold_price, buy_price))
-        all_users = session.query(User).all()
-        for user in all_users:
-            session.add(UserCurrency(user.id, name_currency))
+        add_currency_portfolio(session, name_currency)
+        bump_version(session)
+    broadcaster.publish('add', rate_cache.refresh(), [name_currency])
 
     return jsonify(
         {
@@ -296,3 +256,39 @@ def add_currency() -> Any:
             }
         }
     )
+
+
+STATE: Tuple[Any, ...] = (
+    rate_cache,
+    rate_table,
+    hot_accounts,
+    valuation_store,
+    matching_engine,
+    idempotency_store,
+    broadcaster,
+)
+
+
+def create_app(config: Optional[StorageConfig] = None) -> Flask:
+    if config is not None:
+        storage.configure(config)
+        # кэши и индексы в памяти описывают прежнюю базу
+        for state in STATE:
+            state.clear()
+    app = Flask(__name__)
+    for blueprint in (market,) + BLUEPRINTS:
+        app.register_blueprint(blueprint, url_prefix='/market/api/v1.0')
+    install_metrics(app)
+    install_limits(app)
+    return app
+
+
+# приложение по умолчанию создаётся при первом обращении, а не при импорте
+server: Flask
+
+
+@lru_cache(maxsize=None)
+def __getattr__(name: str) -> Any:
+    if name != 'server':
+        raise AttributeError('module {0} has no attribute {1}'.format(__name__, name))
+    return create_app()
@@ -0,0 +1,269 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import parse_qs
+
+from exchange.app import server
+from exchange.broadcast import KEEPALIVE, broadcaster, event_frames, snapshot_frame
+from exchange.ticker import rate_ticker
+
+STREAM_PATH = '/market/api/v1.0/stream'
+
+T = TypeVar('T')
+
+
+class AsyncSessionFactory:
+    # обработчики Flask с синхронным SQLAlchemy исполняются в ограниченном пуле
+    # потоков: его размер и есть предел одновременно занятых соединений с базой
+    def __init__(self, pool_size: int = 10):
+        self.pool_size = pool_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix='db'
+        )
+
+    async def run_blocking(self, function: Callable[[], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class AsyncNotifier:
+    # будит всех ждущих корутин после каждой публикации брокера
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def notify(self) -> None:
+        self._loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self) -> None:
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def wsgi_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{0}'.format(scope.get('http_version', '1.1')),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_{0}'.format(name)
+            environ[key] = (
+                '{0},{1}'.format(environ[key], value) if key in environ else value
+            )
+    return environ
+
+
+def call_wsgi(
+    environ: Dict[str, Any],
+) -> Tuple[
+    int, List[Tuple[bytes, bytes]], Optional[bytes], Generator[bytes, None, None]
+]:
+    response: Dict[str, Any] = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], *_: Any) -> Any:
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+        return lambda data: None
+
+    result = server.wsgi_app(environ, start_response)
+
+    def chunks() -> Generator[bytes, None, None]:
+        try:
+            yield from result
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    # первый кусок читается сразу: обычный ответ целиком уходит за один
+    # переход в пул потоков
+    body = chunks()
+    return response['status'], response['headers'], next(body, None), body
+
+
+class ExchangeASGI:
+    def __init__(self, pool_size: int = 10, keepalive: float = KEEPALIVE):
+        self.sessions = AsyncSessionFactory(pool_size)
+        self.keepalive = keepalive
+        self.notifier: Optional[AsyncNotifier] = None
+        self.ticker: Optional['asyncio.Task[None]'] = None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+            await self.stream(scope, receive, send)
+        elif scope['type'] == 'http':
+            await self.bridge(scope, receive, send)
+
+    async def lifespan(self, receive: Any, send: Any) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self) -> None:
+        self.notifier = AsyncNotifier(asyncio.get_running_loop())
+        broadcaster.add_listener(self.notifier.notify)
+        self.ticker = asyncio.ensure_future(self.tick_loop())
+
+    def shutdown(self) -> None:
+        if self.ticker is not None:
+            self.ticker.cancel()
+        if self.notifier is not None:
+            broadcaster.remove_listener(self.notifier.notify)
+        self.sessions.shutdown()
+
+    async def tick_loop(self) -> None:
+        while True:
+            await asyncio.sleep(rate_ticker.interval)
+            await self.sessions.run_blocking(rate_ticker.tick)
+
+    async def bridge(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = wsgi_environ(scope, body)
+        status, headers, chunk, chunks = await self.sessions.run_blocking(
+            lambda: call_wsgi(environ)
+        )
+        await send(
+            {'type': 'http.response.start', 'status': status, 'headers': headers}
+        )
+        # тело не собирается целиком: выгрузки уходят клиенту по кускам,
+        # каждый читается в пуле, потому что генератор может ходить в базу
+        try:
+            while chunk is not None:
+                if chunk:
+                    await send(
+                        {'type': 'http.response.body', 'body': chunk, 'more_body': True}
+                    )
+                chunk = await self.sessions.run_blocking(lambda: next(chunks, None))
+        except BaseException:
+            # ответ не дочитан до конца: result.close() вызываем сами
+            await self.sessions.run_blocking(chunks.close)
+            raise
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def stream(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        # подписчик - это корутина, а не поток: тысячи открытых соединений
+        # ждут одного события notifier
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        headers = dict(scope.get('headers', []))
+        after = headers.get(b'last-event-id', query.get('after', [None])[0])
+        currencies = query.get('currencies', [None])[0]
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                ],
+            }
+        )
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            async for frame in self.frames(
+                parse_int(after), currencies.split(',') if currencies else None
+            ):
+                if disconnected.done():
+                    break
+                await send(
+                    {
+                        'type': 'http.response.body',
+                        'body': frame.encode(),
+                        'more_body': True,
+                    }
+                )
+        finally:
+            disconnected.cancel()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def frames(
+        self, after: Optional[int], currencies: Optional[List[str]]
+    ) -> AsyncIterator[str]:
+        if self.notifier is None:
+            self.notifier = AsyncNotifier(asyncio.get_running_loop())
+            broadcaster.add_listener(self.notifier.notify)
+        seq = after or 0
+        events = None if after is None else broadcaster.events_after(after)
+        while True:
+            if events is None:
+                seq, snapshot = snapshot_frame(currencies)
+                yield snapshot
+                events = []
+            for frame in event_frames(events, currencies):
+                yield frame
+            seq = events[-1].seq if events else seq
+            if broadcaster.last_seq <= seq:
+                await self.notifier.wait(self.keepalive)
+            events = broadcaster.events_after(seq)
+            if events == []:
+                yield ': keepalive\n\n'
+
+
+async def wait_disconnect(receive: Any) -> None:
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def parse_int(value: Any) -> Optional[int]:
+    try:
+        return None if value is None else int(value)
+    except ValueError:
+        return None
+
+
+application = ExchangeASGI(int(os.environ.get('EXCHANGE_ASGI_POOL_SIZE', 10)))
@@ -0,0 +1,80 @@
+from decimal import Decimal, InvalidOperation
+from typing import Any, List, Optional, Tuple
+
+from exchange.idempotency import idempotent
+from exchange.rates import cost, rate_cache, unit_price
+from exchange.shards import trade_router
+from exchange.trade import TradeRequest
+from flask import Blueprint, jsonify, request
+
+MAX_LEGS = 100
+
+batch = Blueprint('batch', __name__)
+
+
+def check_leg(leg: Any) -> Optional[Tuple[str, str, Decimal]]:
+    if not isinstance(leg, dict) or leg.get('action') not in ('buy', 'sold'):
+        return None
+    if 'count' not in leg or 'name' not in leg:
+        return None
+    try:
+        count = Decimal(leg['count'])
+        # NaN не сравнивается, бесконечность не записать в баланс
+        if not count.is_finite() or count < 0:
+            return None
+    except (InvalidOperation, TypeError):
+        return None
+    return leg['action'], leg['name'], count
+
+
+def check_legs(rq: Any) -> Optional[List[Tuple[str, str, Decimal]]]:
+    if not rq.json or not isinstance(rq.json.get('legs'), list):
+        return None
+    legs = rq.json.get('legs')
+    if not legs or len(legs) > MAX_LEGS:
+        return None
+    checked = [check_leg(leg) for leg in legs]
+    if any(leg is None for leg in checked):
+        return None
+    return [leg for leg in checked if leg is not None]
+
+
+@batch.route('/<identification>/trades', methods=['POST'])
+@idempotent
+def batch_trades(identification: str) -> Any:
+    legs = check_legs(request)
+    if legs is None:
+        return (
+            jsonify(
+                {
+                    'ERROR': 'Please write legs with action (buy or sold), currency '
+                    'name and count, at most {0} legs'.format(MAX_LEGS)
+                }
+            ),
+            400,
+        )
+    # все ноги оцениваются по одному снимку курсов
+    snapshot = rate_cache.resolve(request.json.get('version'))
+    prices = [unit_price(snapshot, name, action) for action, name, _ in legs]
+    trades = [
+        TradeRequest(
+            int(identification), name, count, cost(price, count), action, price
+        )
+        for (action, name, count), price in zip(legs, prices)
+    ]
+    results = trade_router.execute_batch(trades)
+    return jsonify(
+        {
+            'DO TRANSACTIONS': [
+                {
+                    'action': trade.action,
+                    'name': trade.name_currency,
+                    'count': str(trade.amount),
+                    'YE NOW': str(result.ye),
+                    '{0} NOW'.format(trade.name_currency): str(result.count_currency),
+                }
+                for trade, result in zip(trades, results)
+            ],
+            'VERSION': snapshot.version,
+        }
+    )
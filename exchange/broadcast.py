@@ -0,0 +1,194 @@
+import json
+from collections import deque
+from threading import Condition
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from exchange.rates import RateSnapshot, rate_cache
+from flask import Blueprint, Response, request
+
+KEEPALIVE = 15.0
+
+stream = Blueprint('stream', __name__)
+
+
+class RateEvent(NamedTuple):
+    seq: int
+    kind: str
+    version: int
+    # курс каждой валюты сериализуется один раз на событие, кадры для
+    # подписчиков собираются из готовых кусков
+    parts: Dict[str, str]
+    frame: str
+
+
+def make_frame(seq: int, kind: str, version: int, parts: Iterable[str]) -> str:
+    return 'id: {0}\nevent: {1}\ndata: {{"version": {2}, "rates": {{{3}}}}}\n\n'.format(
+        seq, kind, version, ', '.join(parts)
+    )
+
+
+def serialize(snapshot: RateSnapshot, names: Iterable[str]) -> Dict[str, str]:
+    parts = {}
+    for name in names:
+        sold_price, buy_price = snapshot.prices[name]
+        parts[name] = '{0}: {1}'.format(
+            json.dumps(name),
+            json.dumps({'sold_price': str(sold_price), 'buy_price': str(buy_price)}),
+        )
+    return parts
+
+
+class Broadcaster:
+    def __init__(self, history: int = 256):
+        self._condition = Condition()
+        self._events: Deque[RateEvent] = deque(maxlen=history)
+        self._seq = 0
+        # колбэки вызываются из потока публикации, например чтобы разбудить
+        # подписчиков в asyncio-цикле
+        self._listeners: List[Callable[[], None]] = []
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def clear(self) -> None:
+        with self._condition:
+            self._events.clear()
+            self._seq = 0
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        self._listeners.remove(listener)
+
+    def publish(
+        self, kind: str, snapshot: RateSnapshot, names: Optional[Iterable[str]] = None
+    ) -> Optional[RateEvent]:
+        # номер события - версия курса: он общий для всех воркеров, и клиент
+        # может переподключиться с Last-Event-ID к любому из них
+        parts = serialize(snapshot, snapshot.prices if names is None else names)
+        with self._condition:
+            if snapshot.version == self._seq:
+                return None
+            if snapshot.version != self._seq + 1:
+                # версии между ними этот процесс не видел (или база
+                # пересоздана): история должна идти без пропусков
+                self._events.clear()
+            self._seq = snapshot.version
+            event = RateEvent(
+                self._seq,
+                kind,
+                snapshot.version,
+                parts,
+                make_frame(self._seq, kind, snapshot.version, parts.values()),
+            )
+            self._events.append(event)
+            self._condition.notify_all()
+        for listener in list(self._listeners):
+            listener()
+        return event
+
+    def events_after(self, seq: int) -> Optional[List[RateEvent]]:
+        # None - нужных событий уже нет в истории, клиенту отдаём снимок целиком;
+        # клиент, пришедший из воркера, который раньше получил курс, ждёт
+        # тех же версий здесь
+        with self._condition:
+            known = self._events[0].seq - 1 if self._events else self._seq
+            if seq < known:
+                return None
+            return [event for event in self._events if event.seq > seq]
+
+    def wait(self, seq: int, timeout: float) -> Optional[List[RateEvent]]:
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > seq, timeout)
+        return self.events_after(seq)
+
+    def subscribe(
+        self,
+        after: Optional[int] = None,
+        currencies: Optional[List[str]] = None,
+        timeout: float = KEEPALIVE,
+    ) -> Iterator[str]:
+        seq = after or 0
+        events = None if after is None else self.events_after(after)
+        if events is None:
+            seq, snapshot = snapshot_frame(currencies)
+            yield snapshot
+            events = []
+        while True:
+            yield from event_frames(events, currencies)
+            seq = events[-1].seq if events else seq
+            events = self.wait(seq, timeout)
+            if events is None:
+                # подписчик отстал дальше истории: начинаем заново со снимка
+                yield from self.subscribe(None, currencies, timeout)
+                return
+            if not events:
+                yield ': keepalive\n\n'
+
+
+def snapshot_frame(currencies: Optional[List[str]]) -> Tuple[int, str]:
+    # номер снимка - его версия: дальше подписчику нужны события после неё
+    snapshot = rate_cache.current()
+    names = snapshot.prices if currencies is None else currencies
+    return snapshot.version, make_frame(
+        snapshot.version,
+        'snapshot',
+        snapshot.version,
+        serialize(
+            snapshot, [name for name in names if name in snapshot.prices]
+        ).values(),
+    )
+
+
+def frame_for(event: RateEvent, currencies: Optional[List[str]]) -> Optional[str]:
+    if currencies is None:
+        return event.frame
+    parts = [event.parts[name] for name in currencies if name in event.parts]
+    if not parts:
+        return None
+    return make_frame(event.seq, event.kind, event.version, parts)
+
+
+def event_frames(
+    events: List[RateEvent], currencies: Optional[List[str]]
+) -> Iterator[str]:
+    for event in events:
+        frame = frame_for(event, currencies)
+        if frame is not None:
+            yield frame
+
+
+broadcaster = Broadcaster()
+
+
+def parse_after(rq: Any) -> Optional[int]:
+    after = rq.headers.get('Last-Event-ID', rq.args.get('after'))
+    try:
+        return None if after is None else int(after)
+    except ValueError:
+        return None
+
+
+@stream.route('/stream', methods=['GET'])
+def rate_stream() -> Any:
+    currencies = request.args.get('currencies')
+    return Response(
+        broadcaster.subscribe(
+            parse_after(request), currencies.split(',') if currencies else None
+        ),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
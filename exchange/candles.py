@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from exchange.db import Candle, ExchangeRate, RateTick, create_session
+from exchange.exception import CurrencyNotFound
+from flask import Blueprint, jsonify, request
+
+PERIODS = {
+    '1m': timedelta(minutes=1),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+}
+EPOCH = datetime(1970, 1, 1)
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+candles = Blueprint('candles', __name__)
+
+
+def bucket(created: datetime, period: str) -> datetime:
+    return created - (created - EPOCH) % PERIODS[period]
+
+
+def open_candle(name: str, period: str, start: datetime, sold: Any, buy: Any) -> Candle:
+    return Candle(
+        name=name,
+        period=period,
+        start=start,
+        sold_open=sold,
+        sold_high=sold,
+        sold_low=sold,
+        sold_close=sold,
+        buy_open=buy,
+        buy_high=buy,
+        buy_low=buy,
+        buy_close=buy,
+        ticks=1,
+    )
+
+
+def update_candle(candle: Candle, sold: Any, buy: Any) -> None:
+    candle.sold_high = max(candle.sold_high, sold)
+    candle.sold_low = min(candle.sold_low, sold)
+    candle.sold_close = sold
+    candle.buy_high = max(candle.buy_high, buy)
+    candle.buy_low = min(candle.buy_low, buy)
+    candle.buy_close = buy
+    candle.ticks += 1
+
+
+def record_tick(
+    session: Any, prices: Mapping[str, Tuple[Any, Any]], created: datetime
+) -> None:
+    # тик дописывается в ленту, свечи всех периодов обновляются сразу, так что
+    # запросам по свечам не нужно читать сырые тики
+    session.bulk_insert_mappings(
+        RateTick,
+        [
+            {'name': name, 'created': created, 'sold_price': sold, 'buy_price': buy}
+            for name, (sold, buy) in prices.items()
+        ],
+    )
+    starts = {period: bucket(created, period) for period in PERIODS}
+    current = {
+        (candle.name, candle.period): candle
+        for candle in session.query(Candle).filter(
+            Candle.name.in_(list(prices)), Candle.start.in_(set(starts.values()))
+        )
+        if candle.start == starts[candle.period]
+    }
+    for name, (sold, buy) in prices.items():
+        for period, start in starts.items():
+            candle = current.get((name, period))
+            if candle is None:
+                session.add(open_candle(name, period, start, sold, buy))
+            else:
+                update_candle(candle, sold, buy)
+
+
+def candle_json(candle: Candle) -> Dict[str, Any]:
+    return {
+        'start': candle.start.isoformat(),
+        'sold_price': {
+            'open': str(candle.sold_open),
+            'high': str(candle.sold_high),
+            'low': str(candle.sold_low),
+            'close': str(candle.sold_close),
+        },
+        'buy_price': {
+            'open': str(candle.buy_open),
+            'high': str(candle.buy_high),
+            'low': str(candle.buy_low),
+            'close': str(candle.buy_close),
+        },
+        'ticks': candle.ticks,
+    }
+
+
+def tick_json(tick: RateTick) -> Dict[str, Any]:
+    return {
+        'created': tick.created.isoformat(),
+        'sold_price': str(tick.sold_price),
+        'buy_price': str(tick.buy_price),
+    }
+
+
+def check_range(args: Any) -> Optional[Dict[str, Any]]:
+    try:
+        query = {
+            'period': args.get('period', '1m'),
+            'limit': int(args.get('limit', DEFAULT_LIMIT)),
+            'since': args.get('since'),
+            'until': args.get('until'),
+        }
+        for key in ('since', 'until'):
+            if query[key] is not None:
+                query[key] = datetime.fromisoformat(query[key])
+    except ValueError:
+        return None
+    if query['period'] not in PERIODS and query['period'] != 'tick':
+        return None
+    if not 0 < query['limit'] <= MAX_LIMIT:
+        return None
+    return query
+
+
+def query_history(session: Any, name: str, query: Dict[str, Any]) -> List[Any]:
+    if query['period'] == 'tick':
+        model, column = RateTick, RateTick.created
+        rows = session.query(RateTick).filter(RateTick.name == name)
+    else:
+        model, column = Candle, Candle.start
+        rows = session.query(Candle).filter(
+            Candle.name == name, Candle.period == query['period']
+        )
+    if query['since'] is not None:
+        rows = rows.filter(column >= query['since'])
+    if query['until'] is not None:
+        rows = rows.filter(column < query['until'])
+    items = rows.order_by(column).limit(query['limit']).all()
+    return [
+        tick_json(item) if model is RateTick else candle_json(item) for item in items
+    ]
+
+
+@candles.route('/rates/<name>/history', methods=['GET'])
+def get_rate_history(name: str) -> Any:
+    query = check_range(request.args)
+    if query is None:
+        return (
+            jsonify(
+                {
+                    'ERROR': 'period must be one of 1m, 1h, 1d, tick, limit must be '
+                    'from 1 to {0}, since and until must be ISO dates'.format(MAX_LIMIT)
+                }
+            ),
+            400,
+        )
+    with create_session() as session:
+        if (
+            session.query(ExchangeRate.id).filter(ExchangeRate.name == name).first()
+            is None
+        ):
+            raise CurrencyNotFound('This currency does not exist')
+        return jsonify(
+            {
+                'NAME': name,
+                'PERIOD': query['period'],
+                'HISTORY': query_history(session, name, query),
+            }
+        )
@@ -1,19 +1,82 @@
 from contextlib import contextmanager
-from decimal import Decimal
-from typing import Any
+from datetime import datetime
+from decimal import ROUND_HALF_EVEN, Context, Decimal
+from threading import Lock
+from typing import Any, Optional
 
 import sqlalchemy as sa
+from exchange.storage import StorageConfig, make_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-engine = sa.create_engine('sqlite:///bd.sqlite')
-Session = sessionmaker(bind=engine)
+
+class Storage:
+    # движок создаётся при первом запросе к базе, а не при импорте: импорт
+    # приложения и fork воркеров не открывают соединений
+    def __init__(self, config: Optional[StorageConfig] = None):
+        self.config = config
+        self._engine: Any = None
+        self._lock = Lock()
+
+    @property
+    def engine(self) -> Any:
+        engine = self._engine
+        if engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = make_engine(self.config or StorageConfig.from_env())
+                engine = self._engine
+        return engine
+
+    def configure(self, config: Optional[StorageConfig]) -> None:
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+            self.config, self._engine = config, None
+
+    def dispose(self) -> None:
+        # соединения родителя после fork использовать нельзя
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+storage = Storage()
+Session = sessionmaker()
 Base: Any = declarative_base()
 
+START_YE = Decimal(1000)
+
+# суммы хранятся целым числом минимальных единиц: 1 у.е. = 10 ** 8
+SCALE = Decimal(10) ** 8
+_CONTEXT = Context(prec=38, rounding=ROUND_HALF_EVEN)
+
+
+def to_units(value: Any) -> int:
+    units = _CONTEXT.multiply(Decimal(value), SCALE)
+    return int(units.to_integral_value(context=_CONTEXT))
+
+
+def from_units(value: int) -> Decimal:
+    return _CONTEXT.divide(Decimal(value), SCALE)
+
+
+class FixedDecimal(sa.types.TypeDecorator):
+    impl = sa.BigInteger
+
+    def process_bind_param(self, value: Any, dialect: Any) -> Optional[int]:
+        if value is None:
+            return None
+        return to_units(value)
+
+    def process_result_value(self, value: Any, dialect: Any) -> Optional[Decimal]:
+        if value is None:
+            return None
+        return from_units(value)
+
 
 @contextmanager
 def create_session(**kwargs: Any) -> Any:
-    new_session = Session(**kwargs)
+    new_session = Session(bind=storage.engine, **kwargs)
     try:
         yield new_session
         new_session.commit()
@@ -29,25 +92,30 @@ class User(Base):
 
     id = sa.Column(sa.Integer, primary_key=True, nullable=False)
     name = sa.Column(sa.String(100), nullable=False)
-    ye = sa.Column(sa.String)
+    ye = sa.Column(FixedDecimal)
 
     def __init__(self, name: str):
         self.name = name
-        self.ye = str(Decimal(1000))
+        self.ye = START_YE
 
 
 class UserCurrency(Base):
     __tablename__ = 'user_currency'
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'user_id', 'name_currency', name='uq_user_currency_user_id_name'
+        ),
+    )
 
     id = sa.Column(sa.Integer, primary_key=True, nullable=False)
     user_id = sa.Column(sa.Integer, sa.ForeignKey(User.id), nullable=False)
     name_currency = sa.Column(sa.String)
-    count_currency = sa.Column(sa.String)
+    count_currency = sa.Column(FixedDecimal)
 
     def __init__(self, user_id: int, name: str):
         self.user_id = user_id
         self.name_currency = name
-        self.count_currency = str(0)
+        self.count_currency = Decimal(0)
 
 
 class ExchangeRate(Base):
@@ -55,34 +123,155 @@ class ExchangeRate(Base):
 
     id = sa.Column(sa.Integer, primary_key=True, nullable=False)
     name = sa.Column(sa.String, unique=True)
-    sold_price = sa.Column(sa.String)
-    buy_price = sa.Column(sa.String)
+    sold_price = sa.Column(FixedDecimal)
+    buy_price = sa.Column(FixedDecimal)
 
     def __init__(self, name: str, sold_price: Decimal, buy_price: Decimal):
         self.name = name
-        self.sold_price = str(sold_price)
-        self.buy_price = str(buy_price)
+        self.sold_price = sold_price
+        self.buy_price = buy_price
 
 
 class UserOperations(Base):
     __tablename__ = 'user_operations'
+    __table_args__ = (sa.Index('ix_user_operations_user_id_id', 'user_id', 'id'),)
 
     id = sa.Column(sa.Integer, primary_key=True, nullable=False)
     user_id = sa.Column(sa.Integer, sa.ForeignKey(User.id), nullable=False)
     action = sa.Column(sa.String)
     currency = sa.Column(sa.String)
-    count = sa.Column(sa.String)
-    #    price_transaction = sa.Column(sa.String)
+    count = sa.Column(FixedDecimal)
+    created = sa.Column(sa.DateTime, default=datetime.utcnow)
+    # цена единицы валюты в у.е.; операции пишутся пачкой через record_trades
+    price = sa.Column(FixedDecimal)
 
     def __init__(self, user_id: int, action: str, currency: str, count: Decimal):
-        #   тут линт ругается,что больше 5 аргументов, я уберу один,
-        #   просто по записи будет неясно, что сделал пользователь
         self.user_id = user_id
         self.action = action
         self.currency = currency
-        self.count = str(count)
+        self.count = count
+
+
+class LedgerEntry(Base):
+    __tablename__ = 'ledger'
+    __table_args__ = (
+        sa.Index('ix_ledger_user_id_account_id', 'user_id', 'account', 'id'),
+    )
+
+    # записи только добавляются; у каждой сделки сумма по счёту валюты равна
+    # нулю: что списано у пользователя, зачислено бирже (user_id 0)
+    id = sa.Column(sa.Integer, primary_key=True, nullable=False)
+    user_id = sa.Column(sa.Integer, nullable=False)
+    account = sa.Column(sa.String, nullable=False)
+    amount = sa.Column(FixedDecimal, nullable=False)
+    price = sa.Column(FixedDecimal)
+    kind = sa.Column(sa.String, nullable=False)
+    created = sa.Column(sa.DateTime, default=datetime.utcnow)
+
+
+class BalanceSnapshot(Base):
+    __tablename__ = 'balance_snapshots'
+
+    # баланс счёта после записи леджера entry_id; строка пишется, только
+    # если счёт менялся после прошлого снимка
+    user_id = sa.Column(sa.Integer, primary_key=True)
+    account = sa.Column(sa.String, primary_key=True)
+    entry_id = sa.Column(sa.Integer, primary_key=True)
+    amount = sa.Column(FixedDecimal, nullable=False)
+
+
+class Order(Base):
+    __tablename__ = 'orders'
+
+    id = sa.Column(sa.Integer, primary_key=True, nullable=False)
+    user_id = sa.Column(sa.Integer, sa.ForeignKey(User.id), nullable=False)
+    currency = sa.Column(sa.String, nullable=False)
+    side = sa.Column(sa.String, nullable=False)
+    price = sa.Column(FixedDecimal, nullable=False)
+    count = sa.Column(FixedDecimal, nullable=False)
+    status = sa.Column(sa.String, nullable=False, default='open', index=True)
+
+
+class RateTick(Base):
+    __tablename__ = 'rate_ticks'
+    __table_args__ = (sa.Index('ix_rate_ticks_name_created', 'name', 'created'),)
+
+    id = sa.Column(sa.Integer, primary_key=True, nullable=False)
+    name = sa.Column(sa.String, nullable=False)
+    created = sa.Column(sa.DateTime, nullable=False)
+    sold_price = sa.Column(FixedDecimal, nullable=False)
+    buy_price = sa.Column(FixedDecimal, nullable=False)
+
+
+class Candle(Base):
+    __tablename__ = 'candles'
+
+    # первичный ключ служит и индексом для запросов по диапазону
+    name = sa.Column(sa.String, primary_key=True)
+    period = sa.Column(sa.String, primary_key=True)
+    start = sa.Column(sa.DateTime, primary_key=True)
+    sold_open = sa.Column(FixedDecimal, nullable=False)
+    sold_high = sa.Column(FixedDecimal, nullable=False)
+    sold_low = sa.Column(FixedDecimal, nullable=False)
+    sold_close = sa.Column(FixedDecimal, nullable=False)
+    buy_open = sa.Column(FixedDecimal, nullable=False)
+    buy_high = sa.Column(FixedDecimal, nullable=False)
+    buy_low = sa.Column(FixedDecimal, nullable=False)
+    buy_close = sa.Column(FixedDecimal, nullable=False)
+    ticks = sa.Column(sa.Integer, nullable=False, default=1)
+
+
+class JournalCheckpoint(Base):
+    __tablename__ = 'journal_checkpoint'
+
+    # последняя запись журнала сделок, применённая к базе
+    id = sa.Column(sa.Integer, primary_key=True, nullable=False)
+    seq = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class RateVersion(Base):
+    __tablename__ = 'rate_version'
+
+    # версия курса общая для всех процессов: её меняет каждая запись курса
+    id = sa.Column(sa.Integer, primary_key=True, nullable=False)
+    version = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class Quote(Base):
+    __tablename__ = 'quotes'
+
+    # случайный id: котировку нельзя ни подделать, ни угадать
+    id = sa.Column(sa.String(32), primary_key=True)
+    user_id = sa.Column(sa.Integer, nullable=False)
+    name = sa.Column(sa.String, nullable=False)
+    action = sa.Column(sa.String, nullable=False)
+    price = sa.Column(FixedDecimal, nullable=False)
+    # наибольшее количество, которое можно купить или продать по котировке
+    count = sa.Column(FixedDecimal, nullable=False)
+    expires = sa.Column(sa.Float, nullable=False, index=True)
+    used = sa.Column(sa.Boolean, nullable=False, default=False)
+
+
+def get_engine() -> Any:
+    return storage.engine
+
+
+def table_of(model: Any) -> Any:
+    # __table__ декларативная база добавляет классу при создании, pylint его
+    # не видит
+    return model.__table__
+
+
+def insert_ignore(table: Any, bind: Any) -> Any:
+    # INSERT, пропускающий строки с уже занятым уникальным ключом
+    if bind.dialect.name == 'postgresql':
+        # диалект импортируется, только когда база действительно postgres
+        # pylint: disable=import-outside-toplevel
+        from sqlalchemy.dialects import postgresql
 
-    #   self.price_transaction = str(price)
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('OR IGNORE')
 
 
-Base.metadata.create_all(engine)
+def init_db(bind: Any = None) -> None:
+    Base.metadata.create_all(bind or storage.engine)
@@ -0,0 +1,43 @@
+from typing import Any
+
+from exchange.exception import (
+    CurrencyNotFound,
+    NotEnoughFunds,
+    OrderNotFound,
+    QuoteExpired,
+    RateExpired,
+    TradeConflict,
+    UserNotFound,
+)
+from exchange.metrics import REJECTIONS
+from flask import Blueprint, jsonify
+
+# обработчики ошибок биржи для всего приложения, а не только одного blueprint
+errors = Blueprint('errors', __name__)
+
+
+@errors.app_errorhandler(UserNotFound)
+def handle_not_found_user(error: str) -> Any:
+    REJECTIONS.inc(type(error).__name__)
+    return jsonify({'ERROR': '{0}'.format(error)}), 404
+
+
+@errors.app_errorhandler(CurrencyNotFound)
+@errors.app_errorhandler(OrderNotFound)
+def handle_not_found_currency(error: str) -> Any:
+    REJECTIONS.inc(type(error).__name__)
+    return jsonify({'ERROR': '{0}'.format(error)}), 404
+
+
+@errors.app_errorhandler(RateExpired)
+@errors.app_errorhandler(QuoteExpired)
+@errors.app_errorhandler(TradeConflict)
+def handle_conflict(error: str) -> Any:
+    REJECTIONS.inc(type(error).__name__)
+    return jsonify({'ERROR': '{0}'.format(error)}), 409
+
+
+@errors.app_errorhandler(NotEnoughFunds)
+def handle_not_enough_funds(error: str) -> Any:
+    REJECTIONS.inc(type(error).__name__)
+    return jsonify({'ERROR': '{0}'.format(error)})
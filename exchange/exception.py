@@ -8,3 +8,40 @@ class CurrencyNotFound(Exception):
     def __init__(self, message: str = ''):
         Exception.__init__(self, message)
         self.message = message
+
+
+class RateExpired(Exception):
+    def __init__(self, message: str = ''):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class NotEnoughFunds(Exception):
+    def __init__(self, message: str = ''):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class TradeConflict(Exception):
+    def __init__(self, message: str = ''):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class OrderNotFound(Exception):
+    def __init__(self, message: str = ''):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class TooManyRequests(Exception):
+    def __init__(self, message: str = '', retry_after: float = 1.0):
+        Exception.__init__(self, message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class QuoteExpired(Exception):
+    def __init__(self, message: str = ''):
+        Exception.__init__(self, message)
+        self.message = message
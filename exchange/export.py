@@ -0,0 +1,235 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import IO, Any, Dict, Iterator, List, Tuple
+
+import sqlalchemy as sa
+from exchange.accounts import mark_changed
+from exchange.db import (
+    ExchangeRate,
+    FixedDecimal,
+    LedgerEntry,
+    User,
+    UserCurrency,
+    UserOperations,
+    create_session,
+    storage,
+    table_of,
+)
+from exchange.formats import BINARY, msgpack
+from exchange.ledger import open_ledger
+from exchange.rates import bump_version, rate_cache
+from exchange.valuation import valuation_store
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+CHUNK_SIZE = 1000
+# sqlite ограничивает число параметров в одном запросе
+BATCH_SIZE = 500
+TABLES = {
+    'users': table_of(User),
+    'holdings': table_of(UserCurrency),
+    'operations': table_of(UserOperations),
+    'rates': table_of(ExchangeRate),
+    'ledger': table_of(LedgerEntry),
+}
+# проводки леджера создаются из импортированных балансов, а не загружаются
+IMPORTABLE = [name for name in TABLES if name != 'ledger']
+# таблицы с балансами: для них нужны открывающие проводки и новая оценка
+BALANCES = ('users', 'holdings')
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv', 'msgpack': BINARY}
+
+export = Blueprint('export', __name__)
+
+
+def dump(value: Any) -> Any:
+    # суммы - строками, чтобы не терять точность
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def parse(column: sa.Column, value: Any) -> Any:
+    if value is None or (value == '' and not isinstance(column.type, sa.String)):
+        return None
+    if isinstance(column.type, sa.DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, FixedDecimal):
+        try:
+            amount = Decimal(value)
+        except InvalidOperation as error:
+            raise ValueError('{0} is not a number'.format(value)) from error
+        if not amount.is_finite():
+            raise ValueError('{0} must be finite'.format(column.name))
+        return amount
+    if isinstance(column.type, sa.Integer):
+        return int(value)
+    return value
+
+
+def read_chunks(table: sa.Table) -> Iterator[List[Tuple[Any, ...]]]:
+    # серверный курсор: в памяти одновременно не больше CHUNK_SIZE строк
+    with storage.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            sa.select([table]).order_by(*table.primary_key.columns)
+        )
+        while True:
+            rows = result.fetchmany(CHUNK_SIZE)
+            if not rows:
+                return
+            yield [tuple(dump(value) for value in row) for row in rows]
+
+
+def encode_ndjson(table: sa.Table) -> Iterator[bytes]:
+    names = table.columns.keys()
+    for rows in read_chunks(table):
+        yield ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in rows).encode()
+
+
+def encode_csv(table: sa.Table) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(table.columns.keys())
+    for rows in read_chunks(table):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # у пустой таблицы выгружается только заголовок
+    yield buffer.getvalue().encode()
+
+
+def encode_msgpack(table: sa.Table) -> Iterator[bytes]:
+    # колоночный формат: каждая пачка - словарь колонка -> список значений
+    names = table.columns.keys()
+    for rows in read_chunks(table):
+        yield msgpack.packb(dict(zip(names, map(list, zip(*rows)))), use_bin_type=True)
+
+
+ENCODERS = {'ndjson': encode_ndjson, 'csv': encode_csv, 'msgpack': encode_msgpack}
+
+
+def decode(kind: str, source: IO[bytes]) -> Iterator[Dict[str, Any]]:
+    if kind == 'msgpack':
+        for block in msgpack.Unpacker(source, raw=False):
+            names = list(block)
+            for values in zip(*block.values()):
+                yield dict(zip(names, values))
+        return
+    lines = io.TextIOWrapper(source, encoding='utf-8')
+    if kind == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def import_rows(session: Any, table: sa.Table, rows: Iterator[Dict[str, Any]]) -> int:
+    # пачки по BATCH_SIZE строк в одной транзакции: ошибка откатывает всё
+    count = 0
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        batch.append(
+            {
+                column.name: parse(column, row[column.name])
+                for column in table.columns
+                if column.name in row
+            }
+        )
+        if len(batch) == BATCH_SIZE:
+            session.execute(table.insert(), batch)
+            count, batch = count + len(batch), []
+    if batch:
+        session.execute(table.insert(), batch)
+        count += len(batch)
+    return count
+
+
+def load(name: str, kind: str, source: IO[bytes]) -> int:
+    with create_session() as session:
+        mark_changed(session)
+        count = import_rows(session, TABLES[name], decode(kind, source))
+        if name == 'rates':
+            bump_version(session)
+        if name in BALANCES:
+            open_ledger(session, missing=True)
+    if name == 'rates':
+        rate_cache.refresh()
+    if name in BALANCES:
+        # импортированные id могут быть ниже уже прочитанных оценкой
+        valuation_store.load()
+    return count
+
+
+def check_names(name: str, kind: str) -> Any:
+    if name not in TABLES:
+        return jsonify({'ERROR': 'Unknown table {0}'.format(name)}), 404
+    if kind not in ENCODERS or (kind == 'msgpack' and msgpack is None):
+        return (
+            jsonify({'ERROR': 'format must be one of {0}'.format(', '.join(ENCODERS))}),
+            400,
+        )
+    return None
+
+
+@export.route('/export/<name>', methods=['GET'])
+def export_table(name: str) -> Any:
+    kind = request.args.get('format', 'ndjson')
+    error = check_names(name, kind)
+    if error is not None:
+        return error
+    return Response(
+        stream_with_context(ENCODERS[kind](TABLES[name])), mimetype=MIMETYPES[kind]
+    )
+
+
+@export.route('/import/<name>', methods=['POST'])
+def import_table(name: str) -> Any:
+    kind = request.args.get('format', 'ndjson')
+    error = check_names(name, kind)
+    if error is not None:
+        return error
+    if name not in IMPORTABLE:
+        return jsonify({'ERROR': 'Table {0} cannot be imported'.format(name)}), 400
+    try:
+        count = load(name, kind, request.stream)
+    except (ValueError, KeyError, TypeError) as invalid:
+        return jsonify({'ERROR': 'Invalid row: {0}'.format(invalid)}), 400
+    except sa.exc.IntegrityError:
+        return jsonify({'ERROR': 'Rows conflict with existing data'}), 409
+    return jsonify({'IMPORTED': {name: count}})
+
+
+def run(args: Any, stream: IO[bytes]) -> None:  # pragma: no cover
+    if args.action == 'export':
+        for chunk in ENCODERS[args.format](TABLES[args.table]):
+            stream.write(chunk)
+    else:
+        count = load(args.table, args.format, stream)
+        print('{0}: {1} rows'.format(args.table, count), file=sys.stderr)
+
+
+def main(argv: List[str]) -> None:  # pragma: no cover
+    parser = argparse.ArgumentParser(description='Bulk export and import of tables')
+    parser.add_argument('action', choices=['export', 'import'])
+    parser.add_argument('table', choices=list(TABLES))
+    parser.add_argument('--format', choices=list(ENCODERS), default='ndjson')
+    parser.add_argument('--file', default='-')
+    args = parser.parse_args(argv)
+    if args.action == 'import' and args.table not in IMPORTABLE:
+        parser.error('table {0} cannot be imported'.format(args.table))
+    if args.file == '-':
+        run(args, sys.stdout.buffer if args.action == 'export' else sys.stdin.buffer)
+    else:
+        with open(args.file, 'wb' if args.action == 'export' else 'rb') as stream:
+            run(args, stream)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+import hashlib
+import json
+from decimal import Decimal
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from exchange.rates import RateSnapshot
+from flask import Response, jsonify, request
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+# прежний JSON со строками остаётся ответом по умолчанию
+LEGACY = 'application/json'
+STRUCTURED = 'application/vnd.exchange+json'
+BINARY = 'application/msgpack'
+
+
+def available() -> List[str]:
+    return [LEGACY, STRUCTURED] + ([BINARY] if msgpack is not None else [])
+
+
+def negotiate() -> str:
+    return request.accept_mimetypes.best_match(available(), default=LEGACY)
+
+
+def number(value: Decimal) -> Any:
+    # в структурированных ответах суммы - числа, а не строки
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def encode(mimetype: str, data: Any) -> bytes:
+    if mimetype == BINARY:
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def respond(legacy: Callable[[], Any], structured: Callable[[], Any]) -> Any:
+    # собирается только тот вид ответа, который запросил клиент
+    mimetype = negotiate()
+    if mimetype == LEGACY:
+        response = jsonify(legacy())
+    else:
+        response = Response(encode(mimetype, structured()), mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def rates_legacy(snapshot: RateSnapshot) -> Dict[str, Any]:
+    result = {
+        name: 'sold price : {0}, buy price : {1}'.format(sold_price, buy_price)
+        for name, (sold_price, buy_price) in snapshot.prices.items()
+    }
+    return {'EXCHANGE RATE': result, 'VERSION': snapshot.version}
+
+
+def rates_structured(snapshot: RateSnapshot) -> Dict[str, Any]:
+    return {
+        'version': snapshot.version,
+        'rates': {
+            name: {'sold_price': number(sold_price), 'buy_price': number(buy_price)}
+            for name, (sold_price, buy_price) in snapshot.prices.items()
+        },
+    }
+
+
+class PayloadCache:
+    # тело ответа сериализуется один раз на версию курса и формат; ETag - хеш
+    # тела, поэтому он совпадает у всех воркеров с одинаковыми курсами
+    def __init__(
+        self,
+        legacy: Callable[[RateSnapshot], Any],
+        structured: Callable[[RateSnapshot], Any],
+    ):
+        self._legacy = legacy
+        self._structured = structured
+        self._lock = Lock()
+        self._version: Optional[int] = None
+        self._bodies: Dict[str, Tuple[str, bytes]] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version, self._bodies = None, {}
+
+    def get(self, snapshot: RateSnapshot, mimetype: str) -> Tuple[str, bytes]:
+        with self._lock:
+            if self._version != snapshot.version:
+                self._version, self._bodies = snapshot.version, {}
+            cached = self._bodies.get(mimetype)
+            if cached is None:
+                if mimetype == LEGACY:
+                    body = jsonify(self._legacy(snapshot)).get_data()
+                else:
+                    body = encode(mimetype, self._structured(snapshot))
+                cached = hashlib.sha1(body).hexdigest(), body
+                self._bodies[mimetype] = cached
+            return cached
+
+    def response(self, snapshot: RateSnapshot) -> Any:
+        mimetype = negotiate()
+        etag, body = self.get(snapshot, mimetype)
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        # If-None-Match с тем же ETag получает 304 без тела
+        return response.make_conditional(request)
+
+
+rate_table = PayloadCache(rates_legacy, rates_structured)
@@ -0,0 +1,101 @@
+import json
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterator, Optional
+
+from exchange.db import User, UserOperations, create_session
+from exchange.exception import UserNotFound
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+history = Blueprint('history', __name__)
+
+
+def check_filters(args: Any) -> Optional[Dict[str, Any]]:
+    try:
+        filters = {
+            'limit': int(args.get('limit', DEFAULT_LIMIT)),
+            'after': int(args.get('after', 0)),
+            'since': args.get('since'),
+            'until': args.get('until'),
+        }
+        for key in ('since', 'until'):
+            if filters[key] is not None:
+                filters[key] = datetime.fromisoformat(filters[key])
+    except ValueError:
+        return None
+    if not 0 < filters['limit'] <= MAX_LIMIT:
+        return None
+    filters['currency'] = args.get('currency')
+    filters['action'] = args.get('action')
+    return filters
+
+
+def query_operations(session: Any, user_id: int, filters: Dict[str, Any]) -> Any:
+    # keyset-пагинация по индексу (user_id, id): цена страницы не зависит
+    # от того, сколько операций у пользователя накопилось
+    query = (
+        session.query(UserOperations)
+        .filter(UserOperations.user_id == user_id)
+        .filter(UserOperations.id > filters['after'])
+    )
+    if filters['currency'] is not None:
+        query = query.filter(UserOperations.currency == filters['currency'])
+    if filters['action'] is not None:
+        query = query.filter(UserOperations.action == filters['action'])
+    if filters['since'] is not None:
+        query = query.filter(UserOperations.created >= filters['since'])
+    if filters['until'] is not None:
+        query = query.filter(UserOperations.created < filters['until'])
+    return query.order_by(UserOperations.id).limit(filters['limit'] + 1)
+
+
+def operation_json(item: UserOperations) -> Dict[str, Any]:
+    return {
+        'id': item.id,
+        'action': item.action,
+        'currency': item.currency,
+        'count': str(item.count),
+        'price': None if item.price is None else str(item.price),
+        'created': item.created.isoformat() if item.created else None,
+    }
+
+
+def stream_operations(user_id: int, filters: Dict[str, Any]) -> Iterator[str]:
+    with create_session() as session:
+        if session.query(User.id).filter(User.id == user_id).first() is None:
+            raise UserNotFound('User not found')
+        yield '{"OPERATIONS": ['
+        last_id = None
+        for number, item in enumerate(query_operations(session, user_id, filters)):
+            if number == filters['limit']:
+                break
+            yield (',' if number else '') + json.dumps(operation_json(item))
+            last_id = item.id
+        else:
+            last_id = None
+        yield '], "NEXT": {0}}}'.format(json.dumps(last_id))
+
+
+@history.route('/<identification>/operations', methods=['GET'])
+def get_operations_page(identification: str) -> Any:
+    filters = check_filters(request.args)
+    if filters is None:
+        return (
+            jsonify(
+                {
+                    'ERROR': 'limit must be from 1 to {0}, after must be an operation '
+                    'id, since and until must be ISO dates'.format(MAX_LIMIT)
+                }
+            ),
+            400,
+        )
+    operations = stream_operations(int(identification), filters)
+    # пользователя проверяем до начала ответа, чтобы отдать 404, а не обрывок
+    first = next(operations)
+    return Response(
+        stream_with_context(chain([first], operations)),
+        mimetype='application/json',
+    )
@@ -0,0 +1,179 @@
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Event, Lock
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional, Tuple
+
+from flask import Response, jsonify, make_response, request
+
+HEADER = 'Idempotency-Key'
+DEFAULT_TTL = 3600.0
+DEFAULT_CAPACITY = 100000
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    mimetype: str
+    body: bytes
+
+
+class Entry:
+    def __init__(self, fingerprint: bytes, created: float):
+        self.fingerprint = fingerprint
+        self.created = created
+        self.done = Event()
+        self.response: Optional[StoredResponse] = None
+        self.error: Optional[BaseException] = None
+        # в шарде: дубли из воркеров, которым ответят по завершении
+        self.waiters: List[Any] = []
+
+
+class IdempotencyStore:
+    # ключи хранятся в порядке добавления: при одинаковом TTL это и порядок
+    # истечения, поэтому вытеснение идёт только с головы
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        capacity: int = DEFAULT_CAPACITY,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = Lock()
+        self._entries: 'OrderedDict[Hashable, Entry]' = OrderedDict()
+        # в режиме воркеров ключи хранят шарды, общие для всех процессов
+        self.remote: Optional[Any] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.created < self.ttl and len(self._entries) <= self.capacity:
+                return
+            self._entries.popitem(last=False)
+
+    def claim(self, key: Hashable, fingerprint: bytes) -> Tuple[Entry, bool]:
+        # второе значение - запрос первый с этим ключом и должен исполниться
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = self._entries[key] = Entry(fingerprint, now)
+            self._evict(now)
+            return entry, True
+
+    def finish(
+        self, key: Hashable, entry: Entry, response: Optional[StoredResponse]
+    ) -> None:
+        # неуспешная сделка не сохраняется: повтор с тем же ключом исполнится
+        entry.response = response
+        if response is None:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+        entry.done.set()
+
+    def execute(
+        self,
+        key: Hashable,
+        fingerprint: bytes,
+        operation: Callable[[], StoredResponse],
+        owner: int = 0,
+    ) -> Tuple[Optional[StoredResponse], bool]:
+        # (None, True) - ключ уже использован для другого запроса;
+        # owner - пользователь, по нему выбирается шард
+        if self.remote is not None:
+            return self.remote.execute(key, fingerprint, operation, owner)
+        entry, first = self.claim(key, fingerprint)
+        if entry.fingerprint != fingerprint:
+            return None, True
+        if not first:
+            # параллельный дубль ждёт первое исполнение, а не запускает своё
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.response, True
+        try:
+            response = operation()
+        except BaseException as error:
+            entry.error = error
+            self.finish(key, entry, None)
+            raise
+        self.finish(key, entry, response)
+        return response, False
+
+
+class ShardIdempotency:
+    # ключ захватывается в шарде пользователя, а запрос исполняется в воркере
+    def __init__(self, client: Any):
+        self.client = client
+
+    def execute(
+        self,
+        key: Hashable,
+        fingerprint: bytes,
+        operation: Callable[[], StoredResponse],
+        owner: int,
+    ) -> Tuple[Optional[StoredResponse], bool]:
+        while True:
+            verdict, stored = self.client.submit(owner, 'claim', (key, fingerprint))
+            if verdict == 'mismatch':
+                return None, True
+            if verdict == 'done':
+                return stored, True
+            if verdict == 'run':
+                break
+        try:
+            response = operation()
+        except BaseException:
+            self.client.submit(owner, 'finish', (key, None))
+            raise
+        self.client.submit(owner, 'finish', (key, response))
+        return response, False
+
+
+def freeze(result: Any) -> StoredResponse:
+    response = make_response(result)
+    return StoredResponse(response.status_code, response.mimetype, response.get_data())
+
+
+def idempotent(view: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        identification = kwargs.get('identification', '')
+        stored, replayed = idempotency_store.execute(
+            (request.path, key),
+            request.get_data(),
+            lambda: freeze(view(*args, **kwargs)),
+            int(identification) if identification.isdigit() else 0,
+        )
+        if stored is None:
+            return (
+                jsonify({'ERROR': '{0} was used for another request'.format(HEADER)}),
+                422,
+            )
+        response = Response(stored.body, stored.status, mimetype=stored.mimetype)
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    return wrapper
+
+
+idempotency_store = IdempotencyStore(
+    float(os.environ.get('EXCHANGE_IDEMPOTENCY_TTL', DEFAULT_TTL)),
+    int(os.environ.get('EXCHANGE_IDEMPOTENCY_CAPACITY', DEFAULT_CAPACITY)),
+)
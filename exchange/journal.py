@@ -0,0 +1,262 @@
+import os
+import queue
+from concurrent.futures import Future
+from decimal import Decimal
+from threading import Condition, Lock, Thread
+from typing import IO, Any, Dict, List, Optional, Tuple
+
+from exchange.db import create_session
+from exchange.exception import NotEnoughFunds
+from exchange.pending import PendingBook, Reserved, pending_book
+from exchange.records import (
+    JournalRecord,
+    applied_seq,
+    apply_records,
+    dump_record,
+    load_records,
+)
+from exchange.trade import (
+    TradeRequest,
+    TradeResult,
+    read_balances,
+    settle,
+    trade_deltas,
+)
+
+DEFAULT_WINDOW = 0.005
+DEFAULT_BATCH = 256
+
+
+def leg_deltas(
+    reserved: List[Reserved], trade: TradeRequest
+) -> Tuple[Decimal, Decimal]:
+    # предыдущие ноги пачки ещё не в книге отложенных изменений
+    own = [item for item in reserved if item.user_id == trade.user_id]
+    return (
+        sum((item.ye for item in own), Decimal(0)),
+        sum(
+            (item.amount for item in own if item.name == trade.name_currency),
+            Decimal(0),
+        ),
+    )
+
+
+class JournalFile:
+    # группа записей дописывается с fsync; когда всё записанное уже в базе,
+    # файл обнуляется
+    def __init__(self, path: str):
+        self.path = path
+        self.written = 0
+        self._lock = Lock()
+        self._file: Optional[IO[str]] = None
+
+    def open(self) -> None:
+        # pylint: disable=consider-using-with
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def append(self, records: List[JournalRecord]) -> None:
+        with self._lock:
+            if self._file is None:
+                raise OSError('Trade journal is closed')
+            self._file.write(''.join(dump_record(record) + '\n' for record in records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.written = records[-1].seq
+
+    def truncate(self, applied: int) -> None:
+        with self._lock:
+            if self._file is not None and self.written == applied:
+                self._file.truncate(0)
+
+
+class TradeJournal:
+    # сделка подтверждается, как только её запись попала в журнал на диске;
+    # в базу записи переносит отдельный поток
+    def __init__(
+        self,
+        path: str,
+        window: float = DEFAULT_WINDOW,
+        batch: int = DEFAULT_BATCH,
+        book: Optional[PendingBook] = None,
+    ):
+        self.window = window
+        self.batch = batch
+        # баланс пользователя = значение в базе + изменения из записей журнала
+        # с номером больше отметки, прочитанной вместе с балансом
+        self.book = book or pending_book
+        self.file = JournalFile(path)
+        self._seq = 0
+        self._condition = Condition()
+        self._buffer: List[Tuple[JournalRecord, 'Future[None]']] = []
+        self._closing = False
+        self._applier: 'queue.Queue[Optional[List[JournalRecord]]]' = queue.Queue()
+        self._threads: List[Thread] = []
+
+    @property
+    def path(self) -> str:
+        return self.file.path
+
+    def open(self) -> int:
+        replayed = self.replay()
+        self._closing = False
+        self.file.open()
+        self.book.active = True
+        self._threads = [
+            Thread(target=self._write_loop, daemon=True),
+            Thread(target=self._apply_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return replayed
+
+    def close(self) -> None:
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.book.active = False
+        self.file.close()
+
+    def replay(self) -> int:
+        last = applied_seq()
+        records = [record for record in load_records(self.path) if record.seq > last]
+        if records:
+            with create_session() as session:
+                apply_records(session, records)
+            last = records[-1].seq
+        self._seq = self.file.written = last
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+        return len(records)
+
+    def execute(self, trade: TradeRequest) -> TradeResult:
+        return self._submit([trade], False)[0]
+
+    def execute_batch(self, trades: List[TradeRequest]) -> List[TradeResult]:
+        return self._submit(trades, True)
+
+    def _submit(self, trades: List[TradeRequest], legs: bool) -> List[TradeResult]:
+        future: 'Future[None]' = Future()
+        # под замками только счета этих сделок: проверки других пользователей
+        # и исполнение заявок по ним идут параллельно
+        locks = self.book.locks(trade.user_id for trade in trades)
+        for lock in locks:
+            lock.acquire()
+        try:
+            results, reserved = self._reserve(trades, legs)
+            with self._condition:
+                self._seq += 1
+                self.book.add(self._seq, reserved)
+                self._buffer.append((JournalRecord(self._seq, trades), future))
+                # писатель ждёт первую запись группы без таймаута
+                if len(self._buffer) == 1 or len(self._buffer) >= self.batch:
+                    self._condition.notify_all()
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        # подтверждение ждёт fsync своей группы, но не коммита в базу
+        future.result()
+        return results
+
+    def _reserve(
+        self, trades: List[TradeRequest], legs: bool
+    ) -> Tuple[List[TradeResult], List[Reserved]]:
+        results: List[TradeResult] = []
+        reserved: List[Reserved] = []
+        with create_session() as session:
+            for number, trade in enumerate(trades):
+                user_ye, user_currency, applied = read_balances(session, trade)
+                pending_ye, pending_count = self.book.delta(
+                    trade.user_id, trade.name_currency, applied
+                )
+                legs_ye, legs_count = leg_deltas(reserved, trade)
+                try:
+                    result = settle(
+                        trade,
+                        user_ye + pending_ye + legs_ye,
+                        user_currency + pending_count + legs_count,
+                    )
+                except NotEnoughFunds as error:
+                    if not legs:
+                        raise
+                    raise NotEnoughFunds(
+                        'Leg {0}: {1}'.format(number, error)
+                    ) from error
+                reserved.append(
+                    Reserved(trade.user_id, trade.name_currency, *trade_deltas(trade))
+                )
+                results.append(result)
+        return results, reserved
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._buffer or self._closing)
+                # группа набирается не дольше окна или до batch записей
+                self._condition.wait_for(
+                    lambda: len(self._buffer) >= self.batch or self._closing,
+                    self.window,
+                )
+                group, self._buffer = self._buffer, []
+                closing = self._closing
+            if group:
+                self._commit(group)
+            if closing and not group:
+                self._applier.put(None)
+                return
+
+    def _commit(self, group: List[Tuple[JournalRecord, 'Future[None]']]) -> None:
+        records = [record for record, _ in group]
+        try:
+            self.file.append(records)
+        except OSError as error:
+            failed = {record.seq for record in records}
+            self.book.forget(
+                [trade.user_id for record in records for trade in record.trades],
+                lambda item: item.seq in failed,
+            )
+            for _, future in group:
+                future.set_exception(error)
+            return
+        for _, future in group:
+            future.set_result(None)
+        self._applier.put(records)
+
+    def _apply_loop(self) -> None:
+        while True:
+            records = self._applier.get()
+            if records is None:
+                return
+            # база пишется без замков: проверка средств не учитывает записи,
+            # которые уже вошли в прочитанную ею отметку
+            with create_session() as session:
+                apply_records(session, records)
+            last = records[-1].seq
+            self.book.forget(
+                [trade.user_id for record in records for trade in record.trades],
+                lambda item: item.seq <= last,
+            )
+            # всё записанное уже в базе, журнал можно обнулить
+            self.file.truncate(last)
+
+    def pending(self) -> Tuple[Dict[int, Decimal], Dict[Tuple[int, str], Decimal]]:
+        return self.book.totals()
+
+
+def journal_from_env(environ: Any = os.environ) -> Optional[TradeJournal]:
+    path = environ.get('EXCHANGE_JOURNAL_PATH')
+    if path is None:
+        return None
+    return TradeJournal(
+        path,
+        float(environ.get('EXCHANGE_JOURNAL_WINDOW', DEFAULT_WINDOW)),
+        int(environ.get('EXCHANGE_JOURNAL_BATCH', DEFAULT_BATCH)),
+    )
@@ -0,0 +1,300 @@
+import os
+import sys
+from threading import Event
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+import click
+import sqlalchemy as sa
+from exchange.db import (
+    BalanceSnapshot,
+    LedgerEntry,
+    User,
+    UserCurrency,
+    create_session,
+    table_of,
+)
+
+# счёт биржи: вторая сторона каждой проводки
+HOUSE = 0
+YE = 'ye'
+DEFAULT_INTERVAL = 60.0
+# sqlite ограничивает число параметров в одном запросе
+CHUNK_SIZE = 500
+ENTRY_COLUMNS = ['user_id', 'account', 'amount', 'kind']
+
+
+class Mismatch(NamedTuple):
+    user_id: int
+    account: str
+    # None - счёта нет в балансах или в леджере
+    projected: Any
+    ledger: Any
+
+
+def open_accounts(session: Any, user_ids: List[int]) -> None:
+    # стартовые у.е. новых пользователей: зачисление и списание у биржи
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[start : start + CHUNK_SIZE]
+        for user_id, amount in ((User.id, User.ye), (sa.literal(HOUSE), -User.ye)):
+            session.execute(
+                table_of(LedgerEntry)
+                .insert()
+                .from_select(
+                    ENTRY_COLUMNS,
+                    sa.select(
+                        [user_id, sa.literal(YE), amount, sa.literal('open')]
+                    ).where(User.id.in_(chunk)),
+                )
+            )
+
+
+def projection() -> Any:
+    # балансы, которые читает и меняет торговля: у.е. и портфели
+    return sa.union_all(
+        sa.select(
+            [
+                User.id.label('user_id'),
+                sa.literal(YE).label('account'),
+                User.ye.label('amount'),
+            ]
+        ),
+        sa.select(
+            [
+                UserCurrency.user_id,
+                UserCurrency.name_currency,
+                UserCurrency.count_currency,
+            ]
+        ),
+    ).alias('projection')
+
+
+def latest_snapshots(upto: Optional[int] = None, user_id: Optional[int] = None) -> Any:
+    # по каждому счёту - последний снимок не позже записи upto
+    table = table_of(BalanceSnapshot)
+    current = table.alias('current')
+    latest = (
+        sa.select([sa.func.max(table.c.entry_id)])
+        .where(table.c.user_id == current.c.user_id)
+        .where(table.c.account == current.c.account)
+    )
+    if upto is not None:
+        latest = latest.where(table.c.entry_id <= upto)
+    query = sa.select(
+        [current.c.user_id, current.c.account, current.c.entry_id, current.c.amount]
+    ).where(current.c.entry_id == latest.as_scalar())
+    if user_id is not None:
+        query = query.where(current.c.user_id == user_id)
+    return query
+
+
+def last_entry(session: Any) -> int:
+    return session.query(sa.func.coalesce(sa.func.max(LedgerEntry.id), 0)).scalar()
+
+
+def take_snapshot(session: Any) -> int:
+    # новые снимки - прошлый снимок счёта плюс записи после него, только по
+    # счетам, которые менялись; полного прохода по леджеру нет
+    previous = session.query(
+        sa.func.coalesce(sa.func.max(BalanceSnapshot.entry_id), 0)
+    ).scalar()
+    upto = last_entry(session)
+    if upto <= previous:
+        return previous
+    snapshots = latest_snapshots().alias('snapshots')
+    changes = (
+        sa.select(
+            [
+                LedgerEntry.user_id,
+                LedgerEntry.account,
+                sa.func.sum(LedgerEntry.amount).label('amount'),
+            ]
+        )
+        .where(LedgerEntry.id > previous)
+        .where(LedgerEntry.id <= upto)
+        .group_by(LedgerEntry.user_id, LedgerEntry.account)
+        .alias('changes')
+    )
+    session.execute(
+        table_of(BalanceSnapshot)
+        .insert()
+        .from_select(
+            ['user_id', 'account', 'entry_id', 'amount'],
+            sa.select(
+                [
+                    changes.c.user_id,
+                    changes.c.account,
+                    sa.literal(upto),
+                    changes.c.amount + sa.func.coalesce(snapshots.c.amount, 0),
+                ]
+            ).select_from(
+                changes.outerjoin(
+                    snapshots,
+                    sa.and_(
+                        snapshots.c.user_id == changes.c.user_id,
+                        snapshots.c.account == changes.c.account,
+                    ),
+                )
+            ),
+        )
+    )
+    return upto
+
+
+def balances_at(
+    session: Any, user_id: int, upto: Optional[int] = None
+) -> Dict[str, Any]:
+    # счета пользователя после записи upto: снимок плюс короткий хвост записей
+    if upto is None:
+        upto = last_entry(session)
+    snapshots = latest_snapshots(upto, user_id).alias('snapshots')
+    balances = {
+        row.account: row.amount for row in session.execute(sa.select([snapshots]))
+    }
+    tail = session.execute(
+        sa.select([LedgerEntry.account, sa.func.sum(LedgerEntry.amount)])
+        .select_from(
+            table_of(LedgerEntry).outerjoin(
+                snapshots, snapshots.c.account == LedgerEntry.account
+            )
+        )
+        .where(LedgerEntry.user_id == user_id)
+        .where(LedgerEntry.id <= upto)
+        .where(LedgerEntry.id > sa.func.coalesce(snapshots.c.entry_id, 0))
+        .group_by(LedgerEntry.account)
+    )
+    for account, amount in tail:
+        balances[account] = balances.get(account, 0) + amount
+    return balances
+
+
+def ledger_balances() -> Any:
+    # текущие балансы по леджеру: последние снимки плюс записи после них
+    snapshots = latest_snapshots().alias('snapshots')
+    previous = sa.select(
+        [sa.func.coalesce(sa.func.max(BalanceSnapshot.entry_id), 0)]
+    ).as_scalar()
+    rows = sa.union_all(
+        sa.select([snapshots.c.user_id, snapshots.c.account, snapshots.c.amount]),
+        sa.select([LedgerEntry.user_id, LedgerEntry.account, LedgerEntry.amount]).where(
+            LedgerEntry.id > previous
+        ),
+    ).alias('rows')
+    return (
+        sa.select(
+            [rows.c.user_id, rows.c.account, sa.func.sum(rows.c.amount).label('amount')]
+        )
+        .group_by(rows.c.user_id, rows.c.account)
+        .alias('ledger')
+    )
+
+
+def reconcile(session: Any) -> Iterator[Mismatch]:
+    # сверка - один запрос: база отдаёт только расхождения, потоком и по
+    # согласованному состоянию, даже если сделки идут параллельно
+    projected, ledger = projection(), ledger_balances()
+    same_account = sa.and_(
+        projected.c.user_id == ledger.c.user_id,
+        projected.c.account == ledger.c.account,
+    )
+    statement = sa.union_all(
+        sa.select(
+            [
+                projected.c.user_id.label('user_id'),
+                projected.c.account.label('account'),
+                projected.c.amount.label('projected'),
+                ledger.c.amount.label('ledger'),
+            ]
+        )
+        .select_from(projected.outerjoin(ledger, same_account))
+        .where(
+            sa.or_(
+                sa.and_(ledger.c.amount.is_(None), projected.c.amount != 0),
+                ledger.c.amount != projected.c.amount,
+            )
+        ),
+        sa.select([ledger.c.user_id, ledger.c.account, sa.null(), ledger.c.amount])
+        .select_from(ledger.outerjoin(projected, same_account))
+        .where(projected.c.user_id.is_(None))
+        .where(ledger.c.user_id != HOUSE)
+        .where(ledger.c.amount != 0),
+    ).order_by('user_id', 'account')
+    for row in session.execute(statement.execution_options(stream_results=True)):
+        yield Mismatch(*row)
+
+
+def unbalanced(session: Any) -> Dict[str, Any]:
+    # двойная запись: сумма по каждому счёту вместе с биржей равна нулю
+    ledger = ledger_balances()
+    return dict(
+        session.execute(
+            sa.select([ledger.c.account, sa.func.sum(ledger.c.amount)])
+            .group_by(ledger.c.account)
+            .having(sa.func.sum(ledger.c.amount) != 0)
+        ).fetchall()
+    )
+
+
+def open_ledger(session: Any, missing: bool = False) -> bool:
+    # для базы, заведённой до леджера, и для импортированных балансов:
+    # текущие балансы счетов без проводок становятся открывающими записями
+    if not missing and session.query(LedgerEntry.id).first() is not None:
+        return False
+    projected, house, kind = projection(), sa.literal(HOUSE), sa.literal('open')
+    opened = (
+        sa.exists()
+        .where(LedgerEntry.user_id == projected.c.user_id)
+        .where(LedgerEntry.account == projected.c.account)
+    )
+    unopened = sa.and_(projected.c.amount != 0, ~opened)
+    # встречные записи биржи идут первыми, пока счета пользователей пусты
+    for query in (
+        sa.select([house, projected.c.account, -sa.func.sum(projected.c.amount), kind])
+        .where(unopened)
+        .group_by(projected.c.account),
+        sa.select(
+            [projected.c.user_id, projected.c.account, projected.c.amount, kind]
+        ).where(unopened),
+    ):
+        session.execute(
+            table_of(LedgerEntry).insert().from_select(ENTRY_COLUMNS, query)
+        )
+    return True
+
+
+class SnapshotJob:
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+
+    def run(self, stop: Optional[Event] = None) -> None:
+        stop = stop or Event()
+        while not stop.wait(self.interval):
+            with create_session() as session:
+                take_snapshot(session)
+
+
+snapshot_job = SnapshotJob(
+    float(os.environ.get('EXCHANGE_SNAPSHOT_INTERVAL', DEFAULT_INTERVAL))
+)
+
+
+def main() -> int:  # pragma: no cover
+    command = sys.argv[1] if len(sys.argv) > 1 else 'reconcile'
+    with create_session() as session:
+        if command == 'open':
+            click.echo('opened' if open_ledger(session) else 'ledger is not empty')
+        elif command == 'snapshot':
+            click.echo('snapshot at entry {0}'.format(take_snapshot(session)))
+        else:
+            failed = False
+            for mismatch in reconcile(session):
+                failed = True
+                click.echo('user {0} {1}: balance {2}, ledger {3}'.format(*mismatch))
+            for account, amount in unbalanced(session).items():
+                failed = True
+                click.echo('{0}: ledger is off by {1}'.format(account, amount))
+            return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import math
+import os
+import time
+import zlib
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from exchange.exception import TooManyRequests
+from exchange.metrics import REJECTIONS
+from flask import g, jsonify, request
+
+DEFAULT_CAPACITY = 100000
+DEFAULT_SLOTS = 65536
+KINDS = ('read', 'write')
+# служебные маршруты не ограничиваются
+EXEMPT = frozenset({'metrics.get_metrics', 'static'})
+
+
+class Limit(NamedTuple):
+    # 0 - без ограничения
+    rate: float
+    burst: float
+    concurrency: int
+
+
+def refill(
+    tokens: float, updated: float, now: float, limit: Limit
+) -> Tuple[float, float]:
+    # возвращает остаток токенов и сколько секунд ждать, 0 - запрос пропущен
+    tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / limit.rate
+
+
+class TokenBuckets:
+    # давно не обновлявшееся ведро всё равно полное, поэтому вытеснение
+    # по LRU лимиты не ослабляет
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = Lock()
+        self._buckets: 'OrderedDict[Hashable, Tuple[float, float]]' = OrderedDict()
+
+    def take(self, key: Hashable, limit: Limit) -> float:
+        with self._lock:
+            now = self._clock()
+            tokens, updated = self._buckets.pop(key, (limit.burst, now))
+            tokens, wait = refill(tokens, updated, now, limit)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.capacity:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class SharedBuckets:
+    # вёдра в общей памяти для воркеров после fork: ключ хешируется в слот,
+    # при коллизии два ключа делят ведро, то есть лимит только строже
+    def __init__(
+        self,
+        context: Any,
+        slots: int = DEFAULT_SLOTS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.slots = slots
+        self._clock = clock
+        # пары (токены, время обновления); время 0 - ведро ещё не создано
+        self._values = context.Array('d', slots * 2)
+
+    def take(self, key: Hashable, limit: Limit) -> float:
+        slot = zlib.crc32(repr(key).encode()) % self.slots * 2
+        with self._values.get_lock():
+            now = self._clock()
+            tokens, updated = self._values[slot], self._values[slot + 1]
+            if not updated:
+                tokens, updated = limit.burst, now
+            tokens, wait = refill(tokens, updated, now, limit)
+            self._values[slot], self._values[slot + 1] = tokens, now
+            return wait
+
+
+class AdmissionControl:
+    # чтения и записи ограничиваются отдельно: всплеск опроса курса не
+    # отнимает у сделок ни токены, ни места под одновременные запросы
+    def __init__(self, limits: Dict[str, Limit], buckets: Optional[Any] = None):
+        self.buckets = buckets or TokenBuckets()
+        self.configure(limits)
+
+    def configure(self, limits: Dict[str, Limit]) -> None:
+        self.limits = limits
+        self._slots = {
+            kind: BoundedSemaphore(limit.concurrency)
+            for kind, limit in limits.items()
+            if limit.concurrency
+        }
+
+    def share(self, context: Any, slots: int = DEFAULT_SLOTS) -> None:
+        self.buckets = SharedBuckets(context, slots)
+
+    def admit(self) -> None:
+        # выполняется до обработчика, то есть до открытия сессии с базой
+        if request.endpoint in EXEMPT:
+            return
+        kind = 'read' if request.method in ('GET', 'HEAD') else 'write'
+        limit = self.limits[kind]
+        if limit.rate:
+            user = (request.view_args or {}).get('identification', request.remote_addr)
+            wait = self.buckets.take((request.endpoint, user), limit)
+            if wait:
+                raise TooManyRequests('Rate limit exceeded', wait)
+        slots = self._slots.get(kind)
+        if slots is not None:
+            if not slots.acquire(blocking=False):
+                raise TooManyRequests('Server is busy')
+            g.admission_slots = slots
+
+    def release(self, _: Any = None) -> None:
+        slots = g.pop('admission_slots', None)
+        if slots is not None:
+            slots.release()
+
+
+def handle_too_many_requests(error: TooManyRequests) -> Any:
+    REJECTIONS.inc(type(error).__name__)
+    response = jsonify({'ERROR': '{0}'.format(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+def limits_from_env(environ: Any = os.environ) -> Dict[str, Limit]:
+    return {
+        kind: Limit(
+            float(environ.get('EXCHANGE_LIMIT_{0}_RATE'.format(kind.upper()), 0)),
+            float(environ.get('EXCHANGE_LIMIT_{0}_BURST'.format(kind.upper()), 1)),
+            int(environ.get('EXCHANGE_LIMIT_{0}_CONCURRENCY'.format(kind.upper()), 0)),
+        )
+        for kind in KINDS
+    }
+
+
+admission = AdmissionControl(limits_from_env())
+
+
+def install(app: Any) -> None:
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
+    app.register_error_handler(TooManyRequests, handle_too_many_requests)
@@ -0,0 +1,175 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+from typing import Any, Dict, List, Sequence, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+from flask import Blueprint, Response, g, has_request_context, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+metrics = Blueprint('metrics', __name__)
+
+
+def format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ''
+    return '{{{0}}}'.format(
+        ','.join('{0}="{1}"'.format(name, value) for name, value in zip(names, values))
+    )
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = Lock()
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.help_text),
+            '# TYPE {0} counter'.format(self.name),
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    '{0}{1} {2}'.format(
+                        self.name, format_labels(self.labels, labels), value
+                    )
+                )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        # по каждому набору меток: счётчики корзин (последняя - +Inf), сумма
+        self._values: Dict[Tuple[Any, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: Any) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                labels, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, *labels: Any) -> int:
+        return sum(self._values[labels][0]) if labels in self._values else 0
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.help_text),
+            '# TYPE {0} histogram'.format(self.name),
+        ]
+        names = self.labels + ('le',)
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(
+                        '{0}_bucket{1} {2}'.format(
+                            self.name,
+                            format_labels(names, labels + (bound,)),
+                            cumulative,
+                        )
+                    )
+                suffix = format_labels(self.labels, labels)
+                lines.append('{0}_sum{1} {2}'.format(self.name, suffix, total[0]))
+                lines.append('{0}_count{1} {2}'.format(self.name, suffix, cumulative))
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'exchange_request_duration_seconds',
+    'HTTP request latency',
+    ('route', 'method', 'status'),
+)
+REQUEST_QUERIES = Histogram(
+    'exchange_request_queries',
+    'SQL statements per HTTP request',
+    ('route',),
+    COUNT_BUCKETS,
+)
+SQL_LATENCY = Histogram('exchange_sql_duration_seconds', 'SQL statement latency')
+TRADES = Counter('exchange_trades_total', 'Executed trades', ('action',))
+REJECTIONS = Counter('exchange_rejections_total', 'Rejected requests', ('reason',))
+RATE_TICKS = Counter('exchange_rate_ticks_total', 'Exchange rate ticks')
+
+REGISTRY = (
+    REQUEST_LATENCY,
+    REQUEST_QUERIES,
+    SQL_LATENCY,
+    TRADES,
+    REJECTIONS,
+    RATE_TICKS,
+)
+
+
+def before_cursor_execute(conn: Any, *_: Any) -> None:
+    conn.info['query_start'] = time.perf_counter()
+
+
+def after_cursor_execute(conn: Any, *_: Any) -> None:
+    SQL_LATENCY.observe(time.perf_counter() - conn.info['query_start'])
+    if has_request_context():
+        g.queries = g.get('queries', 0) + 1
+
+
+def before_request() -> None:
+    g.started = time.perf_counter()
+    g.queries = 0
+
+
+def after_request(response: Any) -> Any:
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_LATENCY.observe(
+        time.perf_counter() - g.started, route, request.method, response.status_code
+    )
+    REQUEST_QUERIES.observe(g.queries, route)
+    return response
+
+
+def install(app: Any) -> None:
+    # слушатели вешаются на класс: движок ещё не создан, а фабрика
+    # приложения может вызываться несколько раз
+    for name, listener in (
+        ('before_cursor_execute', before_cursor_execute),
+        ('after_cursor_execute', after_cursor_execute),
+    ):
+        if not sa.event.contains(Engine, name, listener):
+            sa.event.listen(Engine, name, listener)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.register_blueprint(metrics)
+
+
+@metrics.route('/metrics', methods=['GET'])
+def get_metrics() -> Any:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
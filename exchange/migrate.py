@@ -0,0 +1,83 @@
+import sys
+from typing import Any, Dict, List
+
+import sqlalchemy as sa
+from exchange.db import Base, FixedDecimal
+
+BATCH_SIZE = 1000
+
+
+def legacy_columns(connection: Any, table: sa.Table) -> List[str]:
+    info = connection.execute('PRAGMA table_info("{0}")'.format(table.name))
+    types = {row[1]: row[2].upper() for row in info}
+    return [
+        column.name
+        for column in table.columns
+        if isinstance(column.type, FixedDecimal)
+        and types.get(column.name, '').startswith('VARCHAR')
+    ]
+
+
+def migrate_table(connection: Any, table: sa.Table) -> int:
+    legacy = '{0}_legacy'.format(table.name)
+    connection.execute('ALTER TABLE "{0}" RENAME TO "{1}"'.format(table.name, legacy))
+    table.create(connection)
+    rows = connection.execute('SELECT * FROM "{0}"'.format(legacy))
+    count = 0
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        # строковые значения отдаются FixedDecimal, он сам переводит их в единицы
+        connection.execute(table.insert(), [dict(row) for row in batch])
+        count += len(batch)
+    connection.execute('DROP TABLE "{0}"'.format(legacy))
+    return count
+
+
+def add_missing_columns(connection: Any, table: sa.Table) -> None:
+    info = connection.execute('PRAGMA table_info("{0}")'.format(table.name))
+    existing = {row[1] for row in info}
+    for column in table.columns:
+        if column.name not in existing:
+            connection.execute(
+                'ALTER TABLE "{0}" ADD COLUMN "{1}" {2}'.format(
+                    table.name,
+                    column.name,
+                    column.type.compile(dialect=connection.dialect),
+                )
+            )
+    indexes = {
+        row[1]
+        for row in connection.execute('PRAGMA index_list("{0}")'.format(table.name))
+    }
+    for index in table.indexes:
+        if index.name not in indexes:
+            index.create(connection)
+
+
+def migrate(url: str = 'sqlite:///bd.sqlite') -> Dict[str, int]:
+    engine = sa.create_engine(url)
+    migrated = {}
+    with engine.begin() as connection:
+        # не даём sqlite переписывать внешние ключи на переименованные таблицы
+        connection.execute('PRAGMA legacy_alter_table = ON')
+        for table in Base.metadata.sorted_tables:
+            if not connection.dialect.has_table(connection, table.name):
+                continue
+            if legacy_columns(connection, table):
+                migrated[table.name] = migrate_table(connection, table)
+            else:
+                add_missing_columns(connection, table)
+    engine.dispose()
+    return migrated
+
+
+def main() -> None:  # pragma: no cover
+    url = sys.argv[1] if len(sys.argv) > 1 else 'sqlite:///bd.sqlite'
+    for name, count in migrate(url).items():
+        print('{0}: {1} rows'.format(name, count))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
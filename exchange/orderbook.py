@@ -0,0 +1,279 @@
+from decimal import Decimal, getcontext
+from heapq import heappop, heappush
+from threading import RLock
+from typing import Any, Dict, List, Optional, Tuple
+
+from exchange.db import Order, User, create_session
+from exchange.exception import NotEnoughFunds, OrderNotFound, UserNotFound
+from exchange.rates import RateSnapshot, price_for
+from exchange.trade import TradeRequest, apply_trade
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class RestingOrder:
+    __slots__ = ('id', 'user_id', 'currency', 'side', 'price', 'count', 'status')
+
+    def __init__(self, order: Order):
+        self.id = order.id
+        self.user_id = order.user_id
+        self.currency = order.currency
+        self.side = order.side
+        self.price = order.price
+        self.count = order.count
+        self.status = order.status
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.currency,
+            'side': self.side,
+            'price': str(self.price),
+            'count': str(self.count),
+            'status': self.status,
+        }
+
+
+class OrderBook:
+    # цена-время: в кучах лежат (-цена, id) для покупок и (цена, id) для продаж,
+    # отменённые заявки удаляются из кучи лениво, когда оказываются на вершине
+    def __init__(self) -> None:
+        self.orders: Dict[int, RestingOrder] = {}
+        self._bids: List[Tuple[Decimal, int]] = []
+        self._asks: List[Tuple[Decimal, int]] = []
+
+    def add(self, order: RestingOrder) -> None:
+        self.orders[order.id] = order
+        if order.side == 'buy':
+            heappush(self._bids, (-order.price, order.id))
+        else:
+            heappush(self._asks, (order.price, order.id))
+
+    def remove(self, order_id: int) -> Optional[RestingOrder]:
+        return self.orders.pop(order_id, None)
+
+    def best(self, side: str) -> Optional[RestingOrder]:
+        heap = self._bids if side == 'buy' else self._asks
+        while heap and heap[0][1] not in self.orders:
+            heappop(heap)
+        return self.orders[heap[0][1]] if heap else None
+
+
+def crosses(side: str, limit: Decimal, price: Decimal) -> bool:
+    return price <= limit if side == 'buy' else price >= limit
+
+
+def opposite(side: str) -> str:
+    return 'sold' if side == 'buy' else 'buy'
+
+
+def claim(session: Any, order: RestingOrder, count: Decimal) -> bool:
+    # условный UPDATE: заявку, которую уже исполнил или отменил другой процесс,
+    # второй раз исполнить нельзя
+    remaining = order.count - count
+    return bool(
+        session.query(Order)
+        .filter(Order.id == order.id)
+        .filter(Order.status == 'open')
+        .filter(Order.count == order.count)
+        .update(
+            {'count': remaining, 'status': 'open' if remaining else 'filled'},
+            synchronize_session=False,
+        )
+    )
+
+
+def reject(session: Any, order: RestingOrder) -> None:
+    order.status = 'rejected'
+    session.query(Order).filter(Order.id == order.id).filter(
+        Order.status == 'open'
+    ).update({'status': 'rejected'}, synchronize_session=False)
+
+
+def fill(
+    session: Any, sides: List[RestingOrder], count: Decimal, price: Decimal
+) -> Optional[RestingOrder]:
+    # все стороны сделки исполняются в savepoint: если у одной не хватает
+    # средств, откатывается только эта сделка, а заявка снимается
+    getcontext().prec = 5
+    cost = price * count
+    savepoint = session.begin_nested()
+    for order in sides:
+        if not claim(session, order, count):
+            savepoint.rollback()
+            order.status = 'stale'
+            return order
+        try:
+            apply_trade(
+                session,
+                TradeRequest(
+                    order.user_id, order.currency, count, cost, order.side, price
+                ),
+            )
+        except (NotEnoughFunds, UserNotFound):
+            savepoint.rollback()
+            reject(session, order)
+            return order
+    savepoint.commit()
+    for order in sides:
+        order.count -= count
+        if not order.count:
+            order.status = 'filled'
+    return None
+
+
+def refresh(session: Any, book: OrderBook, order: RestingOrder) -> None:
+    # заявку изменил другой процесс: берём её состояние из базы
+    stored = session.query(Order).get(order.id)
+    if stored is None or stored.status != 'open':
+        book.remove(order.id)
+        return
+    order.count, order.status = stored.count, stored.status
+
+
+class MatchingEngine:
+    # заявки, которые другой процесс вставил раньше последней известной,
+    # могут закоммититься позже неё; sync перечитывает это окно
+    RESCAN = 256
+
+    def __init__(self) -> None:
+        self._lock = RLock()
+        self._books: Dict[str, OrderBook] = {}
+        self._last = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._books = {}
+            self._last = 0
+
+    def load(self) -> None:
+        with self._lock:
+            self.clear()
+            self.sync()
+
+    def sync(self) -> int:
+        added = 0
+        with self._lock:
+            with create_session() as session:
+                for order in (
+                    session.query(Order)
+                    .filter(Order.status == 'open')
+                    .filter(Order.id > self._last - self.RESCAN)
+                    .order_by(Order.id)
+                ):
+                    self._last = max(self._last, order.id)
+                    book = self.book(order.currency)
+                    if order.id not in book.orders:
+                        book.add(RestingOrder(order))
+                        added += 1
+        return added
+
+    def book(self, currency: str) -> OrderBook:
+        book = self._books.get(currency)
+        if book is None:
+            book = self._books[currency] = OrderBook()
+        return book
+
+    def place(self, order: Order, snapshot: RateSnapshot) -> RestingOrder:
+        with self._lock:
+            try:
+                return self._place(order, snapshot)
+            except SQLAlchemyError:
+                # память могла разойтись с откаченной транзакцией; ошибки
+                # проверок бросаются до изменений книги и перечитывания не требуют
+                self.load()
+                raise
+
+    def cancel(self, user_id: int, order_id: int) -> RestingOrder:
+        with self._lock:
+            with create_session() as session:
+                cancelled = (
+                    session.query(Order)
+                    .filter(Order.id == order_id)
+                    .filter(Order.user_id == user_id)
+                    .filter(Order.status == 'open')
+                    .update({'status': 'cancelled'}, synchronize_session=False)
+                )
+                if not cancelled:
+                    raise OrderNotFound('Order not found')
+                order = session.query(Order).get(order_id)
+                self.book(order.currency).remove(order.id)
+                return RestingOrder(order)
+
+    def on_rates(self, snapshot: RateSnapshot) -> int:
+        filled = 0
+        with self._lock:
+            try:
+                with create_session() as session:
+                    for currency, book in self._books.items():
+                        for side in ('buy', 'sold'):
+                            filled += self._match_house(
+                                session, book, side, price_for(snapshot, currency, side)
+                            )
+            except SQLAlchemyError:
+                self.load()
+                raise
+        return filled
+
+    def _place(self, order: Order, snapshot: RateSnapshot) -> RestingOrder:
+        book = self.book(order.currency)
+        with create_session() as session:
+            if session.query(User.id).filter(User.id == order.user_id).first() is None:
+                raise UserNotFound('User not found')
+            order.status = 'open'
+            session.add(order)
+            session.flush()
+            self._last = max(self._last, order.id)
+            taker = RestingOrder(order)
+            self._match_book(session, book, taker)
+            house_price = price_for(snapshot, taker.currency, taker.side)
+            if (
+                taker.status == 'open'
+                and taker.count > 0
+                and house_price is not None
+                and crosses(taker.side, taker.price, house_price)
+            ):
+                fill(session, [taker], taker.count, house_price)
+        if taker.status == 'open':
+            book.add(taker)
+        return taker
+
+    def _match_book(self, session: Any, book: OrderBook, taker: RestingOrder) -> None:
+        while taker.count > 0:
+            maker = book.best(opposite(taker.side))
+            if maker is None or not crosses(taker.side, taker.price, maker.price):
+                return
+            count = min(taker.count, maker.count)
+            if fill(session, [taker, maker], count, maker.price) is taker:
+                return
+            if maker.status == 'stale':
+                refresh(session, book, maker)
+            elif maker.status != 'open':
+                book.remove(maker.id)
+
+    def _match_house(
+        self, session: Any, book: OrderBook, side: str, price: Optional[Decimal]
+    ) -> int:
+        filled = 0
+        while price is not None:
+            order = book.best(side)
+            if order is None or not crosses(side, order.price, price):
+                break
+            unfilled = fill(session, [order], order.count, price)
+            if unfilled is None:
+                filled += 1
+                book.remove(order.id)
+            elif unfilled.status == 'stale':
+                refresh(session, book, order)
+            else:
+                book.remove(order.id)
+        return filled
+
+    def orders(self, user_id: int, status: Optional[str] = None) -> List[RestingOrder]:
+        with create_session() as session:
+            query = session.query(Order).filter(Order.user_id == user_id)
+            if status is not None:
+                query = query.filter(Order.status == status)
+            return [RestingOrder(order) for order in query.order_by(Order.id)]
+
+
+matching_engine = MatchingEngine()
@@ -0,0 +1,65 @@
+from decimal import Decimal, InvalidOperation
+from typing import Any
+
+from exchange.db import Order
+from exchange.exception import CurrencyNotFound
+from exchange.orderbook import matching_engine
+from exchange.rates import rate_cache
+from flask import Blueprint, jsonify, request
+
+orders = Blueprint('orders', __name__)
+
+
+def check_order(rq: Any) -> Any:
+    if not rq.json or any(
+        key not in rq.json for key in ('name', 'side', 'price', 'count')
+    ):
+        return None
+    try:
+        price = Decimal(rq.json.get('price'))
+        count = Decimal(rq.json.get('count'))
+    except (InvalidOperation, TypeError):
+        return None
+    # сравнение NaN бросает InvalidOperation, бесконечность не сохранить
+    if not price.is_finite() or not count.is_finite():
+        return None
+    if price <= 0 or count <= 0 or rq.json.get('side') not in ('buy', 'sold'):
+        return None
+    return Order(
+        currency=rq.json.get('name'),
+        side=rq.json.get('side'),
+        price=price,
+        count=count,
+    )
+
+
+@orders.route('/<identification>/orders', methods=['POST'])
+def place_order(identification: str) -> Any:
+    order = check_order(request)
+    if order is None:
+        return (
+            jsonify(
+                {
+                    'ERROR': 'Please write currency name, side (buy or sold), '
+                    'price and count, price and count must be more zero'
+                }
+            ),
+            400,
+        )
+    snapshot = rate_cache.current()
+    if order.currency not in snapshot.prices:
+        raise CurrencyNotFound('This currency does not exist')
+    order.user_id = int(identification)
+    return jsonify({'ORDER': matching_engine.place(order, snapshot).to_json()})
+
+
+@orders.route('/<identification>/orders', methods=['GET'])
+def list_orders(identification: str) -> Any:
+    result = matching_engine.orders(int(identification), request.args.get('status'))
+    return jsonify({'ORDERS': [order.to_json() for order in result]})
+
+
+@orders.route('/<identification>/orders/<int:order_id>', methods=['DELETE'])
+def cancel_order(identification: str, order_id: int) -> Any:
+    order = matching_engine.cancel(int(identification), order_id)
+    return jsonify({'CANCELLED': order.to_json()})
@@ -0,0 +1,102 @@
+from collections import defaultdict
+from decimal import Decimal
+from threading import Lock, RLock
+from typing import Any, Callable, DefaultDict, Dict, Iterable, List, NamedTuple, Tuple
+
+import sqlalchemy as sa
+from exchange.db import Session
+
+STRIPES = 64
+# ключ session.info: замки счетов, которые транзакция держит до своего конца
+HELD = 'held_accounts'
+
+
+class Reserved(NamedTuple):
+    user_id: int
+    name: str
+    ye: Decimal
+    amount: Decimal
+
+
+class Pending(NamedTuple):
+    seq: int
+    name: str
+    ye: Decimal
+    amount: Decimal
+
+
+class PendingBook:
+    # изменения балансов, подтверждённые клиентам, но ещё не записанные в базу:
+    # их держит журнал сделок. Пока книга включена, любая проверка средств, в
+    # том числе при исполнении заявок, идёт под замком счёта и учитывает их
+    def __init__(self, stripes: int = STRIPES):
+        self.active = False
+        self._lock = Lock()
+        self._items: DefaultDict[int, List[Pending]] = defaultdict(list)
+        self._stripes = [RLock() for _ in range(stripes)]
+
+    def locks(self, user_ids: Iterable[int]) -> List[Any]:
+        # замки всегда берутся по возрастанию номера, без ожидания по кругу
+        slots = sorted({user_id % len(self._stripes) for user_id in user_ids})
+        return [self._stripes[slot] for slot in slots]
+
+    def hold(self, session: Any, user_id: int) -> None:
+        # замок отпускается в конце внешней транзакции, то есть после коммита
+        if self.active:
+            lock = self.locks([user_id])[0]
+            lock.acquire()
+            session.info.setdefault(HELD, []).append(lock)
+
+    def delta(self, user_id: int, name: str, applied: int) -> Tuple[Decimal, Decimal]:
+        with self._lock:
+            items = [
+                item for item in self._items.get(user_id, ()) if item.seq > applied
+            ]
+        return (
+            sum((item.ye for item in items), Decimal(0)),
+            sum((item.amount for item in items if item.name == name), Decimal(0)),
+        )
+
+    def add(self, seq: int, reserved: List[Reserved]) -> None:
+        with self._lock:
+            for user_id, name, ye, amount in reserved:
+                self._items[user_id].append(Pending(seq, name, ye, amount))
+
+    def forget(self, user_ids: Iterable[int], drop: Callable[[Pending], bool]) -> None:
+        # под замками счетов: проверка, прочитавшая баланс до коммита записей,
+        # ещё должна найти их в книге
+        user_ids = set(user_ids)
+        locks = self.locks(user_ids)
+        for lock in locks:
+            lock.acquire()
+        try:
+            with self._lock:
+                for user_id in user_ids:
+                    kept = [item for item in self._items[user_id] if not drop(item)]
+                    if kept:
+                        self._items[user_id] = kept
+                    else:
+                        del self._items[user_id]
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def totals(self) -> Tuple[Dict[int, Decimal], Dict[Tuple[int, str], Decimal]]:
+        ye: DefaultDict[int, Decimal] = defaultdict(Decimal)
+        holdings: DefaultDict[Tuple[int, str], Decimal] = defaultdict(Decimal)
+        with self._lock:
+            for user_id, items in self._items.items():
+                for item in items:
+                    ye[user_id] += item.ye
+                    holdings[user_id, item.name] += item.amount
+        return dict(ye), dict(holdings)
+
+
+pending_book = PendingBook()
+
+
+@sa.event.listens_for(Session, 'after_transaction_end')
+def release_held(session: Any, transaction: Any) -> None:
+    if transaction.parent is None:
+        for lock in session.info.pop(HELD, []):
+            lock.release()
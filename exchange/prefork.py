@@ -0,0 +1,74 @@
+import os
+import socket
+from threading import Event
+from typing import Optional
+
+from exchange.accounts import hot_accounts
+from exchange.app import server
+from exchange.db import storage
+from exchange.orderbook import matching_engine
+from exchange.rates import rate_cache
+from exchange.idempotency import ShardIdempotency, idempotency_store
+from exchange.limits import admission
+from exchange.shards import CONTEXT, ShardPool, trade_router
+from exchange.ticker import rate_ticker
+from exchange.valuation import valuation_store
+from werkzeug.serving import make_server
+
+
+def worker_main(pool: ShardPool, worker: int, listener: socket.socket) -> None:
+    # курсы, книга заявок и оценки загружены до fork: воркер сразу
+    # принимает запросы, не читая базу
+    storage.dispose()
+    trade_router.client = pool.client(worker)
+    idempotency_store.remote = ShardIdempotency(trade_router.client)
+    rate_ticker.match_orders = False
+    # балансы меняют шарды и главный процесс, сбросы кэша до воркера не доходят
+    hot_accounts.capacity = 0
+
+    host, port = listener.getsockname()[:2]
+    make_server(host, port, server, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+def serve(
+    host: str = '127.0.0.1',
+    port: int = 5000,
+    workers: Optional[int] = None,
+    stop: Optional[Event] = None,
+) -> None:
+    workers = workers or os.cpu_count() or 1
+    rate_cache.refresh()
+    matching_engine.load()
+    valuation_store.load()
+    pool = ShardPool(workers, workers)
+    pool.start()
+    # вёдра лимитов общие для всех воркеров, места под запросы - свои у каждого
+    admission.share(CONTEXT)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    processes = []
+    for worker in range(workers):
+        process = CONTEXT.Process(
+            target=worker_main, args=(pool, worker, listener), daemon=True
+        )
+        process.start()
+        processes.append(process)
+    stop = stop or Event()
+    try:
+        # главный процесс двигает курс, исполняет по нему заявки и рассылает
+        # курс воркерам; новые заявки воркеров подхватываются на каждом тике,
+        # а изменённые ими перечитываются при попытке исполнения
+        while not stop.wait(rate_ticker.interval):
+            rate_ticker.write()
+            snapshot = rate_cache.refresh()
+            matching_engine.sync()
+            matching_engine.on_rates(snapshot)
+            pool.broadcast_rates()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        pool.stop()
+        listener.close()
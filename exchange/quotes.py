@@ -0,0 +1,130 @@
+import os
+import secrets
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Tuple
+
+from exchange.db import Quote, create_session
+from exchange.exception import CurrencyNotFound, QuoteExpired
+from exchange.rates import price_for, rate_cache
+from flask import Blueprint, jsonify, request
+
+DEFAULT_TTL = 5.0
+ACTIONS = ('buy', 'sold')
+
+quotes = Blueprint('quotes', __name__)
+
+
+class QuoteBook:
+    # котировки лежат в базе: их примет любой воркер, а погасить котировку
+    # можно только один раз - условным UPDATE
+    def __init__(
+        self, ttl: float = DEFAULT_TTL, clock: Callable[[], float] = time.time
+    ):
+        self.ttl = ttl
+        self._clock = clock
+
+    def issue(
+        self, user_id: int, name: str, action: str, price: Decimal, count: Decimal
+    ) -> Tuple[str, float]:
+        now = self._clock()
+        quote_id, expires = secrets.token_hex(16), now + self.ttl
+        with create_session() as session:
+            # просроченная котировка уже не нужна и как отметка о погашении
+            session.query(Quote).filter(Quote.expires < now).delete(
+                synchronize_session=False
+            )
+            session.add(
+                Quote(
+                    id=quote_id,
+                    user_id=user_id,
+                    name=name,
+                    action=action,
+                    price=price,
+                    count=count,
+                    expires=expires,
+                    used=False,
+                )
+            )
+        return quote_id, expires
+
+    def redeem(
+        self, quote_id: str, user_id: int, name: str, action: str, count: Decimal
+    ) -> Decimal:
+        with create_session() as session:
+            quote = session.query(Quote).get(quote_id)
+            if quote is None:
+                raise QuoteExpired('Quote is invalid')
+            if (quote.user_id, quote.name, quote.action) != (user_id, name, action):
+                raise QuoteExpired('Quote was issued for another trade')
+            if count > quote.count:
+                raise QuoteExpired('Quote covers at most {0}'.format(quote.count))
+            claimed = (
+                session.query(Quote)
+                .filter(Quote.id == quote_id)
+                .filter(Quote.used.is_(False))
+                .filter(Quote.expires >= self._clock())
+                .update({'used': True}, synchronize_session=False)
+            )
+            if not claimed:
+                if quote.used:
+                    raise QuoteExpired('Quote was already used')
+                raise QuoteExpired('Quote has expired')
+            return quote.price
+
+    def release(self, quote_id: str) -> None:
+        # сделка не прошла: котировку можно погасить ещё раз, пока она жива
+        with create_session() as session:
+            session.query(Quote).filter(Quote.id == quote_id).update(
+                {'used': False}, synchronize_session=False
+            )
+
+
+quote_book = QuoteBook(float(os.environ.get('EXCHANGE_QUOTE_TTL', DEFAULT_TTL)))
+
+
+def quote_count(value: Any) -> Any:
+    try:
+        count = Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+    return count if count.is_finite() and count > 0 else None
+
+
+@quotes.route('/<identification>/quote', methods=['GET'])
+def get_quote(identification: str) -> Any:
+    name, action = request.args.get('name'), request.args.get('action', 'buy')
+    count = quote_count(request.args.get('count'))
+    if (
+        name is None
+        or action not in ACTIONS
+        or count is None
+        or not identification.isdigit()
+    ):
+        return (
+            jsonify(
+                {
+                    'ERROR': 'Please give currency name, count more zero '
+                    'and action buy or sold'
+                }
+            ),
+            400,
+        )
+    price = price_for(rate_cache.current(), name, action)
+    if price is None:
+        raise CurrencyNotFound('This currency does not exist')
+    quote_id, expires = quote_book.issue(
+        int(identification), name, action, price, count
+    )
+    return jsonify(
+        {
+            'QUOTE': {
+                'id': quote_id,
+                'name': name,
+                'action': action,
+                'price': str(price),
+                'count': str(count),
+                'expires': expires,
+            }
+        }
+    )
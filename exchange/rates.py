@@ -0,0 +1,167 @@
+from collections import deque
+from decimal import Decimal, getcontext
+from threading import Lock
+from types import MappingProxyType
+from typing import Any, Deque, Dict, Mapping, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+from exchange.db import (
+    ExchangeRate,
+    RateVersion,
+    create_session,
+    insert_ignore,
+    table_of,
+)
+from exchange.exception import CurrencyNotFound, RateExpired
+
+
+class RateSnapshot(NamedTuple):
+    version: int
+    # name -> (sold price, buy price)
+    prices: Mapping[str, Tuple[Decimal, Decimal]]
+
+
+class RateCache:
+    def __init__(self, history: int = 16):
+        self._lock = Lock()
+        self._snapshot: Optional[RateSnapshot] = None
+        self._history: Deque[RateSnapshot] = deque(maxlen=history)
+
+    def refresh(self) -> RateSnapshot:
+        # перечитываем курсы под локом, чтобы снимки шли в порядке коммитов;
+        # версия читается тем же запросом, что и курсы, и у всех процессов
+        # одинаковым курсам соответствует одна версия
+        version = sa.func.coalesce(
+            sa.select([RateVersion.version]).where(RateVersion.id == 1).as_scalar(), 0
+        )
+        with self._lock:
+            with create_session() as session:
+                rows = session.execute(
+                    sa.select(
+                        [
+                            ExchangeRate.name,
+                            ExchangeRate.sold_price,
+                            ExchangeRate.buy_price,
+                            version,
+                        ]
+                    )
+                ).fetchall()
+                if not rows:
+                    return self._publish(
+                        session.execute(sa.select([version])).scalar(), {}
+                    )
+            return self._publish(
+                rows[0][3], {name: (sold, buy) for name, sold, buy, _ in rows}
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshot = None
+            self._history.clear()
+
+    def current(self) -> RateSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
+
+    def resolve(self, version: Optional[int] = None) -> RateSnapshot:
+        snapshot = self.current() if version is None else self.get(version)
+        if (
+            snapshot is None
+            and version is not None
+            and version > self.current().version
+        ):
+            # версию уже выдал другой процесс, а сюда курс ещё не дошёл
+            self.refresh()
+            snapshot = self.get(version)
+        if snapshot is None:
+            raise RateExpired('Exchange rate version is out of date')
+        return snapshot
+
+    def get(self, version: int) -> Optional[RateSnapshot]:
+        for snapshot in self._history:
+            if snapshot.version == version:
+                return snapshot
+        return None
+
+    def _publish(
+        self, version: int, prices: Dict[str, Tuple[Decimal, Decimal]]
+    ) -> RateSnapshot:
+        current = self._snapshot
+        if current is not None and current.version == version:
+            return current
+        if current is not None and current.version > version:
+            # база пересоздана, прежние версии больше ничего не значат
+            self._history.clear()
+        snapshot = RateSnapshot(version, MappingProxyType(dict(prices)))
+        self._history.append(snapshot)
+        self._snapshot = snapshot
+        return snapshot
+
+
+rate_cache = RateCache()
+
+# начальный курс покупки, продажа на 2 у.е. дороже
+MARKET = {'btc': 10, 'eth': 20, 'xpr': 30, 'trx': 40, 'ltc': 50}
+
+
+def bump_version(session: Any) -> None:
+    # версию меняет та же транзакция, что пишет курс; UPDATE одной строки
+    # заодно выстраивает пишущих курс по очереди
+    table = table_of(RateVersion)
+    session.execute(insert_ignore(table, session.get_bind()), [{'id': 1, 'version': 0}])
+    session.execute(
+        table.update().where(table.c.id == 1).values(version=table.c.version + 1)
+    )
+
+
+def create_market() -> None:
+    # повторный запуск на заполненной базе ничего не вставляет
+    with create_session() as session:
+        inserted = session.execute(
+            insert_ignore(table_of(ExchangeRate), session.get_bind()),
+            [
+                {'name': name, 'sold_price': price + 2, 'buy_price': price}
+                for name, price in MARKET.items()
+            ],
+        ).rowcount
+        if inserted:
+            bump_version(session)
+    rate_cache.refresh()
+
+
+def price_for(
+    snapshot: RateSnapshot, name_currency: str, action: str
+) -> Optional[Decimal]:
+    prices = snapshot.prices.get(name_currency)
+    if prices is None:
+        return None
+    sold_price, buy_price = prices
+    return sold_price if action == 'buy' else buy_price
+
+
+def unit_price(snapshot: RateSnapshot, name_currency: str, action: str) -> Decimal:
+    price_currency = price_for(snapshot, name_currency, action)
+    if price_currency is None:
+        raise CurrencyNotFound('This currency does not exist')
+    return price_currency
+
+
+def price_transaction(
+    snapshot: RateSnapshot, name_currency: str, count: Decimal, action: str
+) -> Decimal:
+    return cost(unit_price(snapshot, name_currency, action), count)
+
+
+def prepare_transaction(
+    name_currency: str, count: str, action: str, version: Optional[int] = None
+) -> Decimal:
+    return price_transaction(
+        rate_cache.resolve(version), name_currency, Decimal(count), action
+    )
+
+
+def cost(price_currency: Decimal, count: Decimal) -> Decimal:
+    getcontext().prec = 5
+    return price_currency * count
@@ -0,0 +1,99 @@
+import json
+import os
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, DefaultDict, Iterator, List, NamedTuple, Tuple
+
+import sqlalchemy as sa
+from exchange.db import JournalCheckpoint, User, UserCurrency, create_session
+from exchange.trade import TradeRequest, record_trades, trade_deltas
+
+
+class JournalRecord(NamedTuple):
+    seq: int
+    trades: List[TradeRequest]
+
+
+def dump_record(record: JournalRecord) -> str:
+    return json.dumps(
+        {
+            'seq': record.seq,
+            'trades': [
+                [trade.user_id, trade.name_currency, str(trade.amount)]
+                + [str(trade.price_transaction), trade.action]
+                + ([] if trade.price is None else [str(trade.price)])
+                for trade in record.trades
+            ],
+        }
+    )
+
+
+def load_records(path: str) -> Iterator[JournalRecord]:
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                # хвост, недописанный при падении, не был подтверждён клиенту
+                return
+            yield JournalRecord(
+                data['seq'],
+                [
+                    # цена единицы есть только у записей новых версий
+                    TradeRequest(
+                        user_id,
+                        name,
+                        Decimal(count),
+                        Decimal(total),
+                        action,
+                        *(Decimal(price) for price in unit),
+                    )
+                    for user_id, name, count, total, action, *unit in data['trades']
+                ],
+            )
+
+
+def apply_records(session: Any, records: List[JournalRecord]) -> None:
+    # изменения группы сливаются: по одному UPDATE на пользователя и валюту
+    ye: DefaultDict[int, Decimal] = defaultdict(Decimal)
+    holdings: DefaultDict[Tuple[int, str], Decimal] = defaultdict(Decimal)
+    trades = [trade for record in records for trade in record.trades]
+    for trade in trades:
+        delta_ye, delta_count = trade_deltas(trade)
+        ye[trade.user_id] += delta_ye
+        holdings[trade.user_id, trade.name_currency] += delta_count
+    session.execute(
+        sa.update(User)
+        .where(User.id == sa.bindparam('b_user'))
+        .values(ye=User.ye + sa.bindparam('b_delta', type_=User.ye.type)),
+        [{'b_user': user_id, 'b_delta': delta} for user_id, delta in ye.items()],
+    )
+    session.execute(
+        sa.update(UserCurrency)
+        .where(UserCurrency.user_id == sa.bindparam('b_user'))
+        .where(UserCurrency.name_currency == sa.bindparam('b_name'))
+        .values(
+            count_currency=UserCurrency.count_currency
+            + sa.bindparam('b_delta', type_=UserCurrency.count_currency.type)
+        ),
+        [
+            {'b_user': user_id, 'b_name': name, 'b_delta': delta}
+            for (user_id, name), delta in holdings.items()
+        ],
+    )
+    record_trades(session, trades)
+    # отметка о применении коммитится вместе с изменениями: при повторе
+    # журнала после падения ни одна запись не применится дважды
+    checkpoint = session.query(JournalCheckpoint).get(1)
+    if checkpoint is None:
+        session.add(JournalCheckpoint(id=1, seq=records[-1].seq))
+    else:
+        checkpoint.seq = records[-1].seq
+
+
+def applied_seq() -> int:
+    with create_session() as session:
+        checkpoint = session.query(JournalCheckpoint).get(1)
+        return 0 if checkpoint is None else checkpoint.seq
@@ -0,0 +1,269 @@
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future
+from decimal import Decimal
+from itertools import count
+from threading import Lock, Thread
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from exchange.db import create_session, storage
+from exchange.exception import (
+    CurrencyNotFound,
+    NotEnoughFunds,
+    RateExpired,
+    TradeConflict,
+    UserNotFound,
+)
+from exchange.idempotency import (
+    Entry,
+    IdempotencyStore,
+    StoredResponse,
+    idempotency_store,
+)
+from exchange.journal import TradeJournal
+from exchange.metrics import TRADES
+from exchange.rates import rate_cache
+from exchange.ticker import rate_ticker
+from exchange.trade import (
+    TradeRequest,
+    TradeResult,
+    execute_batch,
+    execute_trade,
+    record_trades,
+    write_balances,
+)
+
+# воркеры наследуют очереди и слушающий сокет от главного процесса
+CONTEXT = multiprocessing.get_context('fork')
+ACCOUNT_CACHE_SIZE = 100000
+EXCHANGE_ERRORS = (
+    CurrencyNotFound,
+    NotEnoughFunds,
+    RateExpired,
+    TradeConflict,
+    UserNotFound,
+)
+
+
+class AccountCache:
+    # балансы пользователей шарда в памяти: средства проверяются без чтения
+    # из базы, а записи остаются условными UPDATE
+    def __init__(self, capacity: int = ACCOUNT_CACHE_SIZE):
+        self.capacity = capacity
+        self._accounts: 'OrderedDict[int, Tuple[Decimal, Dict[str, Decimal]]]' = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def get(self, user_id: int, name: str) -> Optional[Tuple[Decimal, Decimal]]:
+        account = self._accounts.get(user_id)
+        if account is None or name not in account[1]:
+            return None
+        self._accounts.move_to_end(user_id)
+        return account[0], account[1][name]
+
+    def put(self, user_id: int, name: str, result: TradeResult) -> None:
+        _, holdings = self._accounts.pop(user_id, (None, {}))
+        holdings[name] = result.count_currency
+        self._accounts[user_id] = (result.ye, holdings)
+        if len(self._accounts) > self.capacity:
+            self._accounts.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._accounts.pop(user_id, None)
+
+
+# ответ шарда: (воркер, номер запроса, результат)
+Reply = Tuple[int, int, Any]
+
+
+class Shard:
+    # все сделки пользователя исполняет один шард, по очереди; он же хранит
+    # ключи идемпотентности пользователя для всех воркеров
+    def __init__(self, capacity: int = ACCOUNT_CACHE_SIZE):
+        self.cache = AccountCache(capacity)
+        self.keys = IdempotencyStore(idempotency_store.ttl, idempotency_store.capacity)
+        self._running: Dict[Hashable, Entry] = {}
+
+    def trade(self, trade: TradeRequest) -> TradeResult:
+        balances = self.cache.get(trade.user_id, trade.name_currency)
+        result = None
+        if balances is not None:
+            try:
+                with create_session() as session:
+                    result = write_balances(session, trade, *balances)
+                    record_trades(session, [trade])
+            except (NotEnoughFunds, TradeConflict):
+                # кэш устарел: балансы меняет ещё и исполнение заявок
+                self.cache.invalidate(trade.user_id)
+        if result is None:
+            result = execute_trade(trade)
+        self.cache.put(trade.user_id, trade.name_currency, result)
+        return result
+
+    def batch(self, trades: List[TradeRequest]) -> List[TradeResult]:
+        self.cache.invalidate(trades[0].user_id)
+        return execute_batch(trades)
+
+    def claim(
+        self, worker: int, request_id: int, payload: Tuple[Hashable, bytes]
+    ) -> List[Reply]:
+        key, fingerprint = payload
+        entry, first = self.keys.claim(key, fingerprint)
+        if entry.fingerprint != fingerprint:
+            return [(worker, request_id, ('mismatch', None))]
+        if first:
+            self._running[key] = entry
+            return [(worker, request_id, ('run', None))]
+        if entry.done.is_set():
+            return [(worker, request_id, ('done', entry.response))]
+        # шард не блокируется: дубль получит ответ, когда первый завершится
+        entry.waiters.append((worker, request_id))
+        return []
+
+    def finish(
+        self,
+        worker: int,
+        request_id: int,
+        payload: Tuple[Hashable, Optional[StoredResponse]],
+    ) -> List[Reply]:
+        key, response = payload
+        entry = self._running.pop(key)
+        self.keys.finish(key, entry, response)
+        # после неудачи дубли повторяют захват ключа
+        verdict = ('retry', None) if response is None else ('done', response)
+        return [(worker, request_id, None)] + [
+            (waiter, waiter_request, verdict)
+            for waiter, waiter_request in entry.waiters
+        ]
+
+    def handle(
+        self, worker: int, request_id: int, kind: str, payload: Any
+    ) -> List[Reply]:
+        if kind == 'claim':
+            return self.claim(worker, request_id, payload)
+        if kind == 'finish':
+            return self.finish(worker, request_id, payload)
+        result = self.trade(payload) if kind == 'trade' else self.batch(payload)
+        return [(worker, request_id, result)]
+
+
+def shard_main(inbox: Any, outboxes: List[Any]) -> None:
+    storage.dispose()
+    shard = Shard()
+    while True:
+        message = inbox.get()
+        if message is None:
+            return
+        worker, request_id, kind, payload = message
+        try:
+            for target, reply_id, result in shard.handle(
+                worker, request_id, kind, payload
+            ):
+                outboxes[target].put(('reply', reply_id, result, None))
+        except Exception as error:  # pylint: disable=broad-except
+            if not isinstance(error, EXCHANGE_ERRORS):
+                error = RuntimeError(repr(error))
+            outboxes[worker].put(('reply', request_id, None, error))
+
+
+class ShardClient:
+    def __init__(self, worker: int, inboxes: List[Any], outbox: Any):
+        self.worker = worker
+        self._inboxes = inboxes
+        self._outbox = outbox
+        self._ids = count()
+        self._lock = Lock()
+        self._futures: Dict[int, 'Future[Any]'] = {}
+        Thread(target=self._dispatch, daemon=True).start()
+
+    def submit(self, user_id: int, kind: str, payload: Any) -> Any:
+        future: 'Future[Any]' = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+        self._inboxes[user_id % len(self._inboxes)].put(
+            (self.worker, request_id, kind, payload)
+        )
+        return future.result()
+
+    def _dispatch(self) -> None:
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                return
+            if message[0] == 'rates':
+                # курс пишет главный процесс, воркер перечитывает его из базы
+                rate_ticker.apply(rate_cache.refresh())
+                continue
+            _, request_id, result, error = message
+            with self._lock:
+                future = self._futures.pop(request_id)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class TradeRouter:
+    # без пула шардов и журнала сделки исполняются в текущем процессе
+    def __init__(self) -> None:
+        self.client: Optional[ShardClient] = None
+        self.journal: Optional[TradeJournal] = None
+
+    def execute(self, trade: TradeRequest) -> TradeResult:
+        if self.journal is not None:
+            result = self.journal.execute(trade)
+        elif self.client is not None:
+            result = self.client.submit(trade.user_id, 'trade', trade)
+        else:
+            return execute_trade(trade)
+        TRADES.inc(trade.action)
+        return result
+
+    def execute_batch(self, trades: List[TradeRequest]) -> List[TradeResult]:
+        if self.journal is not None:
+            results = self.journal.execute_batch(trades)
+        elif self.client is not None:
+            results = self.client.submit(trades[0].user_id, 'batch', trades)
+        else:
+            return execute_batch(trades)
+        for trade in trades:
+            TRADES.inc(trade.action)
+        return results
+
+
+trade_router = TradeRouter()
+
+
+class ShardPool:
+    def __init__(self, shards: int, workers: int):
+        self.inboxes = [CONTEXT.Queue() for _ in range(shards)]
+        self.outboxes = [CONTEXT.Queue() for _ in range(workers)]
+        self.processes: List[Any] = []
+
+    def start(self) -> None:
+        for inbox in self.inboxes:
+            process = CONTEXT.Process(
+                target=shard_main, args=(inbox, self.outboxes), daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+    def client(self, worker: int) -> ShardClient:
+        return ShardClient(worker, self.inboxes, self.outboxes[worker])
+
+    def broadcast_rates(self) -> None:
+        for outbox in self.outboxes:
+            outbox.put(('rates',))
+
+    def stop(self) -> None:
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        for outbox in self.outboxes:
+            outbox.put(None)
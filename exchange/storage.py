@@ -0,0 +1,90 @@
+import os
+from typing import Any, Dict, Mapping, NamedTuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+class StorageConfig(NamedTuple):
+    url: str = 'sqlite:///bd.sqlite'
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    # настройки ниже применяются только к sqlite
+    busy_timeout: int = 5000
+    synchronous: str = 'NORMAL'
+    cache_size: int = -65536
+    mmap_size: int = 268435456
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> 'StorageConfig':
+        defaults = cls()
+        values: Dict[str, Any] = {}
+        for field in cls._fields:
+            name = 'EXCHANGE_DB_{0}'.format(field.upper())
+            if name in environ:
+                values[field] = type(getattr(defaults, field))(environ[name])
+        return cls(**values)
+
+    @property
+    def is_sqlite(self) -> bool:
+        return make_url(self.url).get_backend_name() == 'sqlite'
+
+    @property
+    def is_memory(self) -> bool:
+        return self.is_sqlite and make_url(self.url).database in (None, '', ':memory:')
+
+
+def engine_options(config: StorageConfig) -> Dict[str, Any]:
+    if config.is_memory:
+        # одна база в памяти на весь процесс
+        return {
+            'poolclass': StaticPool,
+            'connect_args': {'check_same_thread': False},
+        }
+    options: Dict[str, Any] = {
+        'pool_size': config.pool_size,
+        'max_overflow': config.max_overflow,
+        'pool_timeout': config.pool_timeout,
+        'pool_recycle': config.pool_recycle,
+    }
+    if config.is_sqlite:
+        # по умолчанию sqlite-файл открывается заново на каждый запрос
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': config.busy_timeout / 1000,
+        }
+    else:
+        options['pool_pre_ping'] = True
+    return options
+
+
+def sqlite_pragmas(config: StorageConfig) -> Dict[str, Any]:
+    pragmas: Dict[str, Any] = {
+        'synchronous': config.synchronous,
+        'cache_size': config.cache_size,
+        'busy_timeout': config.busy_timeout,
+    }
+    if not config.is_memory:
+        # WAL: читатели не блокируют писателя и наоборот
+        pragmas['journal_mode'] = 'WAL'
+        pragmas['mmap_size'] = config.mmap_size
+    return pragmas
+
+
+def make_engine(config: StorageConfig) -> Any:
+    engine = sa.create_engine(config.url, **engine_options(config))
+    if config.is_sqlite:
+        pragmas = sqlite_pragmas(config)
+
+        @sa.event.listens_for(engine, 'connect')
+        def set_pragmas(connection: Any, _: Any) -> None:
+            cursor = connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+            cursor.close()
+
+    return engine
@@ -0,0 +1,176 @@
+import json
+import math
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from decimal import Decimal, getcontext
+from random import Random
+from threading import Event
+from typing import Dict, List, Optional, Tuple, Union
+
+import sqlalchemy as sa
+from exchange.broadcast import broadcaster
+from exchange.candles import record_tick
+from exchange.db import ExchangeRate, FixedDecimal, create_session, table_of
+from exchange.metrics import RATE_TICKS
+from exchange.orderbook import matching_engine
+from exchange.rates import RateSnapshot, bump_version, rate_cache
+from exchange.valuation import valuation_store
+
+DEFAULT_INTERVAL = 10.0
+MODELS = ('uniform', 'walk', 'gbm', 'replay:<path>')
+
+
+class PriceModel(ABC):
+    # модель за один вызов считает множители цен сразу для всех валют
+    def __init__(self, rng: Optional[Random] = None):
+        self.rng = rng or Random()
+
+    @abstractmethod
+    def factors(self, names: List[str]) -> List[float]:
+        pass
+
+
+class UniformModel(PriceModel):
+    # один общий множитель на все валюты, как было раньше
+    def __init__(
+        self, low: float = 0.9, high: float = 1.1, rng: Optional[Random] = None
+    ):
+        super().__init__(rng)
+        self.low = low
+        self.high = high
+
+    def factors(self, names: List[str]) -> List[float]:
+        return [self.rng.uniform(self.low, self.high)] * len(names)
+
+
+class RandomWalk(UniformModel):
+    def factors(self, names: List[str]) -> List[float]:
+        return [self.rng.uniform(self.low, self.high) for _ in names]
+
+
+class CorrelatedGBM(PriceModel):
+    # геометрическое броуновское движение с общим для рынка шоком:
+    # corr = 0 - независимые валюты, corr = 1 - все движутся одинаково
+    def __init__(
+        self,
+        mu: float = 0.0,
+        sigma: float = 0.05,
+        corr: float = 0.5,
+        rng: Optional[Random] = None,
+    ):
+        super().__init__(rng)
+        self.drift = mu - sigma**2 / 2
+        self.sigma = sigma
+        self.common = math.sqrt(corr)
+        self.own = math.sqrt(1 - corr)
+
+    def factors(self, names: List[str]) -> List[float]:
+        market = self.rng.gauss(0, 1)
+        return [
+            math.exp(
+                self.drift
+                + self.sigma * (self.common * market + self.own * self.rng.gauss(0, 1))
+            )
+            for _ in names
+        ]
+
+
+class Replay(PriceModel):
+    # каждая строка файла - json {"btc": 1.01, ...}, в конце файла начинаем сначала
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path, encoding='utf-8') as source:
+            self.ticks: List[Dict[str, float]] = [
+                json.loads(line) for line in source if line.strip()
+            ]
+        self.position = 0
+
+    def factors(self, names: List[str]) -> List[float]:
+        tick = self.ticks[self.position % len(self.ticks)]
+        self.position += 1
+        return [tick.get(name, 1.0) for name in names]
+
+
+def model_from_name(name: str) -> PriceModel:
+    if name.startswith('replay:'):
+        return Replay(name[len('replay:') :])
+    models = {'uniform': UniformModel, 'walk': RandomWalk, 'gbm': CorrelatedGBM}
+    if name not in models:
+        raise ValueError(
+            'Unknown price model {0!r}, expected one of: {1}'.format(
+                name, ', '.join(MODELS)
+            )
+        )
+    return models[name]()
+
+
+class RateTicker:
+    def __init__(
+        self, model: Union[PriceModel, str], interval: float = DEFAULT_INTERVAL
+    ):
+        # модель по имени создаётся при первом тике: ошибка в переменной
+        # окружения не ломает импорт приложения
+        self._model = model
+        self.interval = interval
+        # заявки по курсу биржи исполняет только один процесс
+        self.match_orders = True
+
+    @property
+    def model(self) -> PriceModel:
+        if isinstance(self._model, str):
+            self._model = model_from_name(self._model)
+        return self._model
+
+    def tick(self) -> RateSnapshot:
+        self.write()
+        return self.apply(rate_cache.refresh())
+
+    def write(self) -> None:
+        prices = rate_cache.current().prices
+        names = list(prices)
+        getcontext().prec = 5
+        ticked: Dict[str, Tuple[Decimal, Decimal]] = {}
+        for name, factor in zip(names, self.model.factors(names)):
+            sold_price, buy_price = prices[name]
+            percent = Decimal(factor)
+            ticked[name] = (sold_price * percent, buy_price * percent)
+        rows = [
+            {'b_name': name, 'b_sold': sold, 'b_buy': buy}
+            for name, (sold, buy) in ticked.items()
+        ]
+        if rows:
+            with create_session() as session:
+                # один UPDATE, исполняемый через executemany
+                session.execute(
+                    table_of(ExchangeRate)
+                    .update()
+                    .where(ExchangeRate.name == sa.bindparam('b_name'))
+                    .values(
+                        sold_price=sa.bindparam('b_sold', type_=FixedDecimal),
+                        buy_price=sa.bindparam('b_buy', type_=FixedDecimal),
+                    ),
+                    rows,
+                )
+                record_tick(session, ticked, datetime.utcnow())
+                bump_version(session)
+
+    def apply(self, snapshot: RateSnapshot) -> RateSnapshot:
+        # в многопроцессном режиме write делает главный процесс, apply - воркеры
+        RATE_TICKS.inc()
+        broadcaster.publish('tick', snapshot)
+        if self.match_orders:
+            matching_engine.on_rates(snapshot)
+        valuation_store.on_rates(snapshot)
+        return snapshot
+
+    def run(self, stop: Optional[Event] = None) -> None:
+        stop = stop or Event()
+        while not stop.wait(self.interval):
+            self.tick()
+
+
+rate_ticker = RateTicker(
+    os.environ.get('EXCHANGE_PRICE_MODEL', 'uniform'),
+    float(os.environ.get('EXCHANGE_TICK_INTERVAL', DEFAULT_INTERVAL)),
+)
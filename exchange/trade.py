@@ -0,0 +1,203 @@
+from decimal import Decimal, getcontext
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+
+import sqlalchemy as sa
+from exchange.accounts import mark_changed
+from exchange.db import (
+    JournalCheckpoint,
+    LedgerEntry,
+    User,
+    UserCurrency,
+    UserOperations,
+    create_session,
+    table_of,
+)
+from exchange.exception import NotEnoughFunds, TradeConflict, UserNotFound
+from exchange.ledger import HOUSE, YE
+from exchange.metrics import TRADES
+from exchange.pending import pending_book
+
+MAX_ATTEMPTS = 5
+
+T = TypeVar('T')
+
+
+class TradeRequest(NamedTuple):
+    user_id: int
+    name_currency: str
+    amount: Decimal
+    # сумма сделки в у.е.
+    price_transaction: Decimal
+    action: str
+    # цена единицы валюты, она же пишется в операции и леджер
+    price: Optional[Decimal] = None
+
+
+class TradeResult(NamedTuple):
+    ye: Decimal
+    count_currency: Decimal
+
+
+def read_balances(session: Any, trade: TradeRequest) -> Tuple[Decimal, Decimal, int]:
+    # балансы читаются одним запросом вместе с отметкой журнала: по ней видно,
+    # какие отложенные изменения уже вошли в прочитанные значения
+    checkpoint = (
+        sa.select([JournalCheckpoint.seq]).where(JournalCheckpoint.id == 1).as_scalar()
+    )
+    row = session.execute(
+        sa.select(
+            [User.ye, UserCurrency.count_currency, sa.func.coalesce(checkpoint, 0)]
+        )
+        .select_from(sa.join(User, UserCurrency, User.id == UserCurrency.user_id))
+        .where(User.id == trade.user_id)
+        .where(UserCurrency.name_currency == trade.name_currency)
+    ).first()
+    if row is None:
+        raise UserNotFound('User not found')
+    return row[0], row[1], row[2]
+
+
+def trade_deltas(trade: TradeRequest) -> Tuple[Decimal, Decimal]:
+    if trade.action == 'buy':
+        return -trade.price_transaction, trade.amount
+    return trade.price_transaction, -trade.amount
+
+
+def ledger_entries(trade: TradeRequest) -> List[Dict[str, Any]]:
+    delta_ye, delta_count = trade_deltas(trade)
+    return [
+        {
+            'user_id': user_id,
+            'account': account,
+            'amount': amount,
+            'price': trade.price,
+            'kind': trade.action,
+        }
+        for user_id, account, amount in (
+            (trade.user_id, YE, delta_ye),
+            (HOUSE, YE, -delta_ye),
+            (trade.user_id, trade.name_currency, delta_count),
+            (HOUSE, trade.name_currency, -delta_count),
+        )
+    ]
+
+
+def record_trades(session: Any, trades: List[TradeRequest]) -> None:
+    # операции и проводки леджера пишутся в транзакции сделки, одной пачкой
+    mark_changed(session, [trade.user_id for trade in trades])
+    session.bulk_insert_mappings(
+        UserOperations,
+        [
+            {
+                'user_id': trade.user_id,
+                'action': trade.action,
+                'currency': trade.name_currency,
+                'count': trade.amount,
+                'price': trade.price,
+            }
+            for trade in trades
+        ],
+    )
+    session.execute(
+        table_of(LedgerEntry).insert(),
+        [entry for trade in trades for entry in ledger_entries(trade)],
+    )
+
+
+def settle(
+    trade: TradeRequest, user_ye: Decimal, user_currency: Decimal
+) -> TradeResult:
+    getcontext().prec = 5
+    if trade.action == 'buy':
+        if user_ye < trade.price_transaction:
+            raise NotEnoughFunds('Not enough ye for this transaction')
+        return TradeResult(
+            user_ye - trade.price_transaction, user_currency + trade.amount
+        )
+    if user_currency < trade.amount:
+        raise NotEnoughFunds('Not enough currency for this transaction')
+    return TradeResult(user_ye + trade.price_transaction, user_currency - trade.amount)
+
+
+def write_balances(
+    session: Any,
+    trade: TradeRequest,
+    user_ye: Decimal,
+    user_currency: Decimal,
+    pending: Tuple[Decimal, Decimal] = (Decimal(0), Decimal(0)),
+) -> TradeResult:
+    # средства проверяются с учётом отложенных изменений, а в базу пишется
+    # только изменение от этой сделки
+    user_id, name_currency = trade.user_id, trade.name_currency
+    pending_ye, pending_count = pending
+    result = settle(trade, user_ye + pending_ye, user_currency + pending_count)
+    new_ye, new_currency = result.ye - pending_ye, result.count_currency - pending_count
+
+    # условные UPDATE: если строку успел поменять параллельный запрос,
+    # rowcount будет 0
+    updated = session.execute(
+        sa.update(User)
+        .where(User.id == user_id)
+        .where(User.ye == user_ye)
+        .values(ye=new_ye)
+    ).rowcount
+    updated += session.execute(
+        sa.update(UserCurrency)
+        .where(UserCurrency.user_id == user_id)
+        .where(UserCurrency.name_currency == name_currency)
+        .where(UserCurrency.count_currency == user_currency)
+        .values(count_currency=new_currency)
+    ).rowcount
+    if updated != 2:
+        raise TradeConflict('Balance was changed by a concurrent trade')
+    return result
+
+
+def update_balances(session: Any, trade: TradeRequest) -> TradeResult:
+    pending_book.hold(session, trade.user_id)
+    user_ye, user_currency, applied = read_balances(session, trade)
+    pending = pending_book.delta(trade.user_id, trade.name_currency, applied)
+    return write_balances(session, trade, user_ye, user_currency, pending)
+
+
+def apply_trade(session: Any, trade: TradeRequest) -> TradeResult:
+    result = update_balances(session, trade)
+    record_trades(session, [trade])
+    return result
+
+
+def apply_batch(session: Any, trades: List[TradeRequest]) -> List[TradeResult]:
+    results = []
+    for number, trade in enumerate(trades):
+        try:
+            results.append(update_balances(session, trade))
+        except NotEnoughFunds as error:
+            raise NotEnoughFunds('Leg {0}: {1}'.format(number, error)) from error
+    record_trades(session, trades)
+    return results
+
+
+def with_retries(operation: Callable[[Any], T]) -> T:
+    # при конфликте вся транзакция повторяется с новым чтением балансов
+    attempt = 1
+    while True:
+        try:
+            with create_session() as session:
+                return operation(session)
+        except TradeConflict:
+            if attempt >= MAX_ATTEMPTS:
+                raise
+            attempt += 1
+
+
+def execute_trade(trade: TradeRequest) -> TradeResult:
+    result = with_retries(lambda session: apply_trade(session, trade))
+    TRADES.inc(trade.action)
+    return result
+
+
+def execute_batch(trades: List[TradeRequest]) -> List[TradeResult]:
+    results = with_retries(lambda session: apply_batch(session, trades))
+    for trade in trades:
+        TRADES.inc(trade.action)
+    return results
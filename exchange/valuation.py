@@ -0,0 +1,203 @@
+import heapq
+from decimal import Context, Decimal, localcontext
+from threading import RLock
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+from exchange.db import User, UserCurrency, UserOperations, create_session
+from exchange.exception import UserNotFound
+from exchange.rates import RateSnapshot, rate_cache
+from flask import Blueprint, jsonify, request
+
+CHUNK = 500
+TOP = 100
+# id выдаются до коммита: строки из этого окна перед отметкой
+# перечитываются, чтобы не пропустить закоммиченные не по порядку
+RESCAN = 256
+
+# суммы по всем пользователям не должны округляться до 5 знаков
+_CONTEXT = Context(prec=38)
+
+valuation = Blueprint('valuation', __name__)
+
+
+def liquidation_prices(snapshot: RateSnapshot) -> Dict[str, Decimal]:
+    # портфель оценивается по цене, по которой биржа покупает валюту
+    # у продающего пользователя (см. price_for)
+    return {name: prices[1] for name, prices in snapshot.prices.items()}
+
+
+class Watermark(NamedTuple):
+    user: int
+    operation: int
+
+
+class ValuationStore:
+    # балансы всех пользователей в памяти; после сделок перечитываются только
+    # пользователи из новых записей user_operations
+    def __init__(self, top: int = TOP):
+        self.top = top
+        self._lock = RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._ye: Dict[int, Decimal] = {}
+        self._holdings: Dict[int, Dict[str, Decimal]] = {}
+        # суммарные остатки по каждой валюте
+        self._totals: Dict[str, Decimal] = {}
+        self._total_ye = Decimal(0)
+        self._seen = Watermark(0, 0)
+        self._leaders: List[Tuple[Decimal, int]] = []
+        self._market = Decimal(0)
+        self._version: Optional[int] = None
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def load(self) -> None:
+        with self._lock:
+            self.clear()
+            self.sync()
+
+    def sync(self) -> None:
+        with self._lock, create_session() as session:
+            seen = Watermark(
+                session.query(sa.func.max(User.id)).scalar() or 0,
+                session.query(sa.func.max(UserOperations.id)).scalar() or 0,
+            )
+            changed = {
+                user_id
+                for (user_id,) in session.query(UserOperations.user_id)
+                .filter(
+                    UserOperations.id > self._seen.operation - RESCAN,
+                    UserOperations.id <= seen.operation,
+                )
+                .distinct()
+            }
+            changed.update(
+                user_id
+                for user_id in range(self._seen.user - RESCAN + 1, seen.user + 1)
+                if user_id > 0 and user_id not in self._ye
+            )
+            self._reload(session, sorted(changed))
+            self._seen = Watermark(
+                max(self._seen.user, seen.user),
+                max(self._seen.operation, seen.operation),
+            )
+
+    def _reload(self, session: Any, user_ids: List[int]) -> None:
+        for start in range(0, len(user_ids), CHUNK):
+            chunk = user_ids[start : start + CHUNK]
+            balances = dict(
+                session.query(User.id, User.ye).filter(User.id.in_(chunk)).all()
+            )
+            holdings: Dict[int, Dict[str, Decimal]] = {}
+            for user_id, name, count in session.query(
+                UserCurrency.user_id,
+                UserCurrency.name_currency,
+                UserCurrency.count_currency,
+            ).filter(UserCurrency.user_id.in_(chunk), UserCurrency.count_currency != 0):
+                holdings.setdefault(user_id, {})[name] = count
+            with localcontext(_CONTEXT):
+                for user_id in chunk:
+                    self._replace(
+                        user_id, balances.get(user_id), holdings.get(user_id, {})
+                    )
+
+    def _replace(
+        self, user_id: int, ye: Optional[Decimal], holdings: Dict[str, Decimal]
+    ) -> None:
+        self._total_ye -= self._ye.pop(user_id, 0)
+        for name, count in self._holdings.pop(user_id, {}).items():
+            self._totals[name] -= count
+        if ye is None:
+            return
+        self._ye[user_id] = ye
+        self._holdings[user_id] = holdings
+        self._total_ye += ye
+        for name, count in holdings.items():
+            self._totals[name] = self._totals.get(name, Decimal(0)) + count
+
+    def _value(self, user_id: int, prices: Mapping[str, Decimal]) -> Decimal:
+        return self._ye[user_id] + sum(
+            (
+                count * prices.get(name, 0)
+                for name, count in self._holdings[user_id].items()
+            ),
+            Decimal(0),
+        )
+
+    def revalue(self, snapshot: RateSnapshot) -> None:
+        prices = liquidation_prices(snapshot)
+        with self._lock, localcontext(_CONTEXT):
+            # стоимость рынка считается по агрегатам валют, без обхода портфелей
+            self._market = self._total_ye + sum(
+                (count * prices.get(name, 0) for name, count in self._totals.items()),
+                Decimal(0),
+            )
+            self._leaders = heapq.nlargest(
+                self.top,
+                ((self._value(user_id, prices), user_id) for user_id in self._ye),
+            )
+            self._version = snapshot.version
+
+    def on_rates(self, snapshot: RateSnapshot) -> None:
+        self.sync()
+        self.revalue(snapshot)
+
+    def value(self, user_id: int, snapshot: RateSnapshot) -> Dict[str, Any]:
+        prices = liquidation_prices(snapshot)
+        with self._lock, localcontext(_CONTEXT):
+            if user_id not in self._ye:
+                raise UserNotFound('User not found')
+            result = {
+                name: count * prices.get(name, 0)
+                for name, count in self._holdings[user_id].items()
+            }
+            total = self._value(user_id, prices)
+            ye = self._ye[user_id]
+        return {
+            'VALUATION': {name: str(value) for name, value in result.items()},
+            'YE': str(ye),
+            'TOTAL': str(total),
+            'VERSION': snapshot.version,
+        }
+
+    def leaders(self, limit: int) -> Dict[str, Any]:
+        return {
+            'LEADERBOARD': [
+                {'user_id': user_id, 'total': str(total)}
+                for total, user_id in self._leaders[:limit]
+            ],
+            'MARKET': str(self._market),
+            'VERSION': self._version,
+        }
+
+
+valuation_store = ValuationStore()
+
+
+@valuation.route('/<identification>/valuation', methods=['GET'])
+def get_valuation(identification: str) -> Any:
+    valuation_store.sync()
+    return jsonify(valuation_store.value(int(identification), rate_cache.current()))
+
+
+@valuation.route('/leaderboard', methods=['GET'])
+def get_leaderboard() -> Any:
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= valuation_store.top:
+        return jsonify({'ERROR': 'Invalid limit'}), 400
+    snapshot = rate_cache.current()
+    if valuation_store.version != snapshot.version:
+        # обычно рейтинг уже пересчитан тиком курса
+        valuation_store.on_rates(snapshot)
+    return jsonify(valuation_store.leaders(limit))
@@ -1,16 +1,57 @@
-from exchange.app import server, change_exchange_rate, create_market
-from exchange.db import ExchangeRate, create_session, Decimal
+from exchange.app import server, change_exchange_rate
+from exchange.db import ExchangeRate, create_session, Decimal, init_db
+from exchange.journal import journal_from_env
+from exchange.ledger import snapshot_job
+from exchange.orderbook import matching_engine
+from exchange.rates import create_market
+from exchange.shards import trade_router
+from exchange.valuation import valuation_store
 from threading import Thread
+import sys
 
 
 def start():
     server.run()
 
 
+def open_journal():
+    # журнал сделок: при открытии повторяются записи, не дошедшие до базы.
+    # его потоки живут в одном процессе, поэтому с воркерами он не включается
+    journal = journal_from_env()
+    if journal is not None:
+        journal.open()
+        trade_router.journal = journal
+
+
+def start_workers(workers):
+    from exchange.prefork import serve
+
+    serve(workers=workers)
+
+
+def start_asgi():
+    import uvicorn
+
+    uvicorn.run('exchange.asgi:application', lifespan='on')
+
+
 if __name__ == '__main__':
+    init_db()
     create_market()
-    th1 = Thread(target=start)
-    th2 = Thread(target=change_exchange_rate)
-    th1.start()
-    th2.start()
-
+    matching_engine.load()
+    valuation_store.load()
+    # снимки балансов леджера пишет один процесс
+    Thread(target=snapshot_job.run, daemon=True).start()
+    if sys.argv[1:] == ['asgi']:
+        # тики курса идут asyncio-задачей внутри приложения
+        open_journal()
+        start_asgi()
+    elif sys.argv[1:2] == ['workers']:
+        # процессы-воркеры и шарды, сделки пользователя исполняет один шард
+        start_workers(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        open_journal()
+        th1 = Thread(target=start)
+        th2 = Thread(target=change_exchange_rate)
+        th1.start()
+        th2.start()
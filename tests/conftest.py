@@ -0,0 +1,33 @@
+import pytest
+from exchange.db import Base, get_engine, storage
+from exchange.rates import create_market
+from exchange.storage import StorageConfig
+from exchange.ticker import PriceModel
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _storage(tmp_path_factory):
+    # тесты работают на своей базе, bd.sqlite не трогаем
+    path = tmp_path_factory.mktemp('db') / 'test.sqlite'
+    storage.configure(StorageConfig(url='sqlite:///{0}'.format(path)))
+    yield
+    storage.configure(None)
+
+
+@pytest.fixture(autouse=True)
+def _init_db(_storage):
+    Base.metadata.create_all(get_engine())
+    create_market()
+    yield
+    Base.metadata.drop_all(get_engine())
+
+
+class FixedModel(PriceModel):
+    # каждый тик удваивает все курсы
+    def factors(self, names):
+        return [2.0] * len(names)
+
+
+@pytest.fixture()
+def fixed_model():
+    return FixedModel()
@@ -2,16 +2,12 @@ import json
 from decimal import Decimal
 
 import pytest
-from exchange.app import create_market, server
-from exchange.db import Base, UserCurrency, create_session, engine
-
-
-@pytest.fixture(autouse=True)
-def _init_db():
-    Base.metadata.create_all(engine)
-    create_market()
-    yield
-    Base.metadata.drop_all(engine)
+from exchange import app as app_module
+from exchange.app import create_app, server
+from exchange.db import ExchangeRate, UserCurrency, create_session, init_db, storage
+from exchange.rates import create_market
+from exchange.storage import StorageConfig
+from sqlalchemy.exc import IntegrityError
 
 
 @pytest.fixture()
@@ -59,7 +55,7 @@ def test_registration_portfolio(client):
     with create_session() as session:
         portfolio = session.query(UserCurrency).all()
         for item in portfolio:
-            assert item.count_currency == '0'
+            assert item.count_currency == Decimal(0)
 
 
 @pytest.mark.parametrize('url', ('get_ye', 'get_portfolio', 'get_operations'))
@@ -212,3 +208,136 @@ def test_get_operations(client):
     data = json.loads(response.get_data())
     assert len(data['OPERATIONS']) == 1
     assert data['OPERATIONS']['0'] == 'action: buy, currency: btc, count: 10'
+
+
+def test_get_exchange_rate_version(client):
+    response = client.get('/market/api/v1.0/get_exchange_rate_all')
+    version = json.loads(response.get_data())['VERSION']
+    client.post(
+        '/market/api/v1.0/add',
+        data=json.dumps({'name': 'new', 'sold_price': 1, 'buy_price': 1}),
+        content_type='application/json',
+    )
+    response = client.get('/market/api/v1.0/get_exchange_rate_all')
+    data = json.loads(response.get_data())
+    assert data['VERSION'] > version
+    assert 'new' in data['EXCHANGE RATE']
+
+
+def test_buy_with_rate_version(client):
+    registration(client)
+    response = client.get('/market/api/v1.0/get_exchange_rate_all')
+    version = json.loads(response.get_data())['VERSION']
+    response = client.post(
+        '/market/api/v1.0/1/buy',
+        data=json.dumps({'name': 'btc', 'count': '1', 'version': version}),
+        content_type='application/json',
+    )
+    data = json.loads(response.get_data())
+    assert Decimal(data['DO TRANSACTION']['YE NOW']) == Decimal('988')
+
+
+def test_buy_with_expired_rate_version(client):
+    registration(client)
+    response = client.post(
+        '/market/api/v1.0/1/buy',
+        data=json.dumps({'name': 'btc', 'count': '1', 'version': -1}),
+        content_type='application/json',
+    )
+    assert response.status_code == 409
+    assert (
+        json.loads(response.get_data())['ERROR']
+        == 'Exchange rate version is out of date'
+    )
+
+
+def test_buy_unknown_currency(client):
+    registration(client)
+    response = client.post(
+        '/market/api/v1.0/1/buy',
+        data=json.dumps({'name': 'unknown', 'count': '1'}),
+        content_type='application/json',
+    )
+    assert response.status_code == 404
+    assert json.loads(response.get_data())['ERROR'] == 'This currency does not exist'
+
+
+def test_add_currency_portfolio(client):
+    registration(client)
+    client.post(
+        '/market/api/v1.0/add',
+        data=json.dumps({'name': 'new', 'sold_price': 1, 'buy_price': 1}),
+        content_type='application/json',
+    )
+    response = client.get('/market/api/v1.0/1/get_portfolio')
+    data = json.loads(response.get_data())
+    assert len(data['PORTFOLIO']) == 6
+    assert data['PORTFOLIO']['new'] == '0'
+
+
+def test_registration_bulk(client):
+    response = client.post(
+        '/market/api/v1.0/registration/bulk',
+        data=json.dumps({'names': ['first', 'second']}),
+        content_type='application/json',
+    )
+    data = json.loads(response.get_data())
+    assert data['REGISTRATION'] == ['first', 'second']
+    assert data['IDS'] == [1, 2]
+    response = client.get('/market/api/v1.0/2/get_portfolio')
+    assert len(json.loads(response.get_data())['PORTFOLIO']) == 5
+    data = client.get('/market/api/v1.0/2/get_ye')
+    assert json.loads(data.get_data())['COUNT_YE'] == '1000'
+
+
+def test_portfolio_row_unique(client):
+    registration(client)
+    with pytest.raises(IntegrityError):
+        with create_session() as session:
+            session.add(UserCurrency(1, 'btc'))
+
+
+@pytest.mark.parametrize('body', ({}, {'names': []}, {'names': [1]}))
+def test_registration_bulk_bad_request(client, body):
+    response = client.post(
+        '/market/api/v1.0/registration/bulk',
+        data=json.dumps(body),
+        content_type='application/json',
+    )
+    assert response.status_code == 400
+
+
+def test_create_market_twice():
+    create_market()
+    with create_session() as session:
+        assert session.query(ExchangeRate).count() == 5
+
+
+def test_create_app_in_memory(client):
+    config = storage.config
+    registration(client)
+    client.post(
+        '/market/api/v1.0/1/buy',
+        data=json.dumps({'name': 'btc', 'count': '1'}),
+        content_type='application/json',
+    )
+    # счёт пользователя 1 этой базы попадает в кэш процесса
+    client.post('/market/api/v1.0/balances', json={'ids': [1]})
+    app = create_app(StorageConfig(url='sqlite://'))
+    try:
+        init_db()
+        create_market()
+        with app.test_client() as other:
+            registration(other)
+            response = other.get('/market/api/v1.0/1/get_ye')
+            assert json.loads(response.get_data()) == {'COUNT_YE': '1000'}
+            response = other.post('/market/api/v1.0/balances', json={'ids': [1]})
+            balance = json.loads(response.get_data())['BALANCES']['1']
+            assert balance['COUNT_YE'] == '1000'
+    finally:
+        create_app(config)
+
+
+def test_unknown_module_attribute():
+    with pytest.raises(AttributeError):
+        getattr(app_module, 'missing')
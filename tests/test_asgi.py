@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+from exchange import export as export_module
+from exchange.asgi import ExchangeASGI, parse_int
+from exchange.broadcast import broadcaster
+from exchange.db import User, create_session
+from exchange.rates import RateSnapshot, rate_cache
+
+
+async def send_request(app, method, path, body=b'', query=b''):
+    messages = []
+    chunks = [{'type': 'http.request', 'body': body[:5], 'more_body': True}]
+    chunks.append({'type': 'http.request', 'body': body[5:]})
+
+    async def receive():
+        return chunks.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'x-test', b'1'),
+            (b'x-test', b'2'),
+        ],
+    }
+    await app(scope, receive, send)
+    # последний кусок тела закрывает ответ
+    assert [message.get('more_body', False) for message in messages[1:]][-1:] == [False]
+    return (
+        messages[0]['status'],
+        b''.join(message['body'] for message in messages[1:]),
+        len(messages) - 1,
+    )
+
+
+async def request(app, method, path, body=b'', query=b''):
+    status, content, _ = await send_request(app, method, path, body, query)
+    return status, json.loads(content)
+
+
+def count_users():
+    with create_session() as session:
+        return session.query(User).count()
+
+
+def test_bridge_routes():
+    app = ExchangeASGI(pool_size=2)
+
+    async def scenario():
+        status, data = await request(
+            app,
+            'POST',
+            '/market/api/v1.0/registration',
+            json.dumps({'name': 'username'}).encode(),
+        )
+        assert (status, data) == (200, {'REGISTRATION': 'username'})
+        status, data = await request(app, 'GET', '/market/api/v1.0/1/get_ye')
+        assert data == {'COUNT_YE': '1000'}
+        status, _ = await request(app, 'GET', '/market/api/v1.0/2/get_ye')
+        assert status == 404
+        return await app.sessions.run_blocking(count_users)
+
+    assert asyncio.run(scenario()) == 1
+    app.sessions.shutdown()
+
+
+def test_bridge_streams_body_in_chunks(monkeypatch):
+    monkeypatch.setattr(export_module, 'CHUNK_SIZE', 1)
+    app = ExchangeASGI(pool_size=1)
+
+    async def scenario():
+        for name in ('first', 'second'):
+            await request(
+                app,
+                'POST',
+                '/market/api/v1.0/registration',
+                json.dumps({'name': name}).encode(),
+            )
+        return await send_request(
+            app, 'GET', '/market/api/v1.0/export/users', query=b'format=csv'
+        )
+
+    status, content, messages = asyncio.run(scenario())
+    assert status == 200
+    assert content.decode().splitlines()[0] == 'id,name,ye'
+    # заголовок с первым пользователем, второй пользователь и завершающий кусок
+    assert messages == 3
+    app.sessions.shutdown()
+
+
+def test_lifespan_starts_and_stops_ticker():
+    app = ExchangeASGI(pool_size=1)
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(0)
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert app.ticker.cancelled() or app.ticker.done()
+
+
+def test_stream_pushes_events_until_disconnect():
+    app = ExchangeASGI(pool_size=1, keepalive=0.01)
+    frames = []
+    snapshot = rate_cache.current()
+    ticked = RateSnapshot(
+        max(snapshot.version, broadcaster.last_seq) + 1, snapshot.prices
+    )
+
+    async def scenario():
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message.get('body'):
+                frames.append(message['body'].decode())
+            if len(frames) == 1:
+                # публикация из другого потока, как это делает тикер
+                await asyncio.get_running_loop().run_in_executor(
+                    None, broadcaster.publish, 'tick', ticked, ['btc']
+                )
+            if any(frame.startswith(': keepalive') for frame in frames):
+                disconnect.set()
+                await asyncio.sleep(0)
+
+        scope = {
+            'type': 'http',
+            'path': '/market/api/v1.0/stream',
+            'query_string': b'currencies=btc',
+            'headers': [],
+        }
+        await asyncio.wait_for(app(scope, receive, send), 5)
+
+    asyncio.run(scenario())
+    assert 'event: snapshot' in frames[0]
+    assert 'event: tick' in frames[1]
+    broadcaster.remove_listener(app.notifier.notify)
+    app.sessions.shutdown()
+
+
+def test_parse_int():
+    assert parse_int(b'3') == 3
+    assert parse_int('abc') is None
+    assert parse_int(None) is None
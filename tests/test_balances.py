@@ -0,0 +1,115 @@
+import json
+from decimal import Decimal
+
+import pytest
+from exchange import accounts as accounts_module
+from exchange.accounts import Account, HotAccounts, hot_accounts
+from exchange.app import server
+
+PREFIX = '/market/api/v1.0'
+
+
+@pytest.fixture()
+def client(_init_db):
+    hot_accounts.clear()
+    with server.test_client() as client:
+        client.post(
+            PREFIX + '/registration/bulk',
+            data=json.dumps({'names': ['first', 'second']}),
+            content_type='application/json',
+        )
+        yield client
+
+
+@pytest.fixture()
+def reads(monkeypatch):
+    calls = []
+    read_accounts = accounts_module.read_accounts
+
+    def counting(session, user_ids):
+        calls.append(list(user_ids))
+        return read_accounts(session, user_ids)
+
+    monkeypatch.setattr(accounts_module, 'read_accounts', counting)
+    return calls
+
+
+def balances(client, ids):
+    response = client.post(
+        PREFIX + '/balances',
+        data=json.dumps({'ids': ids}),
+        content_type='application/json',
+    )
+    return json.loads(response.get_data())
+
+
+def test_batch_read_from_cache(client, reads):
+    data = balances(client, [1, 2, 7, 1])
+    assert data['BALANCES']['1']['COUNT_YE'] == '1000'
+    assert data['BALANCES']['2']['PORTFOLIO']['btc'] == '0'
+    assert data['NOT FOUND'] == [7]
+    assert balances(client, [2, 1]) == {
+        'BALANCES': {'2': data['BALANCES']['2'], '1': data['BALANCES']['1']},
+        'NOT FOUND': [],
+    }
+    assert reads == [[1, 2, 7]]
+
+
+def test_trade_invalidates_account(client, reads):
+    balances(client, [1, 2])
+    client.post(
+        PREFIX + '/1/buy',
+        data=json.dumps({'name': 'btc', 'count': '1'}),
+        content_type='application/json',
+    )
+    data = balances(client, [1, 2])
+    assert data['BALANCES']['1'] == {
+        'COUNT_YE': '988',
+        'PORTFOLIO': {'btc': '1', 'eth': '0', 'xpr': '0', 'trx': '0', 'ltc': '0'},
+    }
+    assert reads == [[1, 2], [1]]
+
+
+def test_new_currency_invalidates_all(client, reads):
+    balances(client, [1, 2])
+    client.post(
+        PREFIX + '/add',
+        data=json.dumps({'name': 'doge', 'sold_price': '2', 'buy_price': '1'}),
+        content_type='application/json',
+    )
+    assert balances(client, [1])['BALANCES']['1']['PORTFOLIO']['doge'] == '0'
+    assert len(reads) == 2
+
+
+@pytest.mark.parametrize('ids', [[], 'all', ['1'], list(range(10001))])
+def test_batch_read_bad_request(client, ids):
+    response = client.post(
+        PREFIX + '/balances',
+        data=json.dumps({'ids': ids}),
+        content_type='application/json',
+    )
+    assert response.status_code == 400
+
+
+def test_fill_skips_accounts_changed_during_read():
+    cache = HotAccounts(capacity=2)
+    account = Account(Decimal(1), {})
+    epoch = cache.epoch
+    cache.invalidate([1])
+    cache.fill({1: account, 2: account}, epoch)
+    assert cache.get_many([1, 2]) == {2: account}
+    epoch = cache.epoch
+    cache.clear()
+    cache.fill({3: account}, epoch)
+    assert len(cache) == 0
+    cache.fill({1: account, 2: account, 3: account}, cache.epoch)
+    assert list(cache.get_many([1, 2, 3])) == [2, 3]
+
+
+def test_fill_rejected_when_recent_overflows(monkeypatch):
+    monkeypatch.setattr(accounts_module, 'RECENT_SIZE', 2)
+    cache = HotAccounts()
+    epoch = cache.epoch
+    cache.invalidate([5, 6, 7])
+    cache.fill({1: Account(Decimal(1), {})}, epoch)
+    assert len(cache) == 0
@@ -0,0 +1,89 @@
+import json
+from decimal import Decimal
+
+import pytest
+from exchange.app import server
+from exchange.db import UserOperations, create_session
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        yield client
+
+
+def trades(client, body):
+    response = client.post(
+        '/market/api/v1.0/1/trades',
+        data=json.dumps(body),
+        content_type='application/json',
+    )
+    return response.status_code, json.loads(response.get_data())
+
+
+def test_batch_trades_success(client):
+    status, data = trades(
+        client,
+        {
+            'legs': [
+                {'action': 'buy', 'name': 'btc', 'count': '10'},
+                {'action': 'buy', 'name': 'eth', 'count': '1'},
+                {'action': 'sold', 'name': 'btc', 'count': '4'},
+            ]
+        },
+    )
+    assert status == 200
+    legs = data['DO TRANSACTIONS']
+    assert Decimal(legs[0]['YE NOW']) == Decimal(880)
+    assert Decimal(legs[1]['YE NOW']) == Decimal(858)
+    assert Decimal(legs[2]['YE NOW']) == Decimal(898)
+    assert Decimal(legs[2]['btc NOW']) == Decimal(6)
+    with create_session() as session:
+        assert session.query(UserOperations).count() == 3
+
+
+def test_batch_trades_all_or_nothing(client):
+    _, data = trades(
+        client,
+        {
+            'legs': [
+                {'action': 'buy', 'name': 'btc', 'count': '10'},
+                {'action': 'sold', 'name': 'eth', 'count': '1'},
+            ]
+        },
+    )
+    assert data['ERROR'] == 'Leg 1: Not enough currency for this transaction'
+    response = client.get('/market/api/v1.0/1/get_ye')
+    assert json.loads(response.get_data())['COUNT_YE'] == '1000'
+    with create_session() as session:
+        assert session.query(UserOperations).count() == 0
+
+
+@pytest.mark.parametrize(
+    'body',
+    (
+        {},
+        {'legs': []},
+        {'legs': [{'action': 'hold', 'name': 'btc', 'count': '1'}]},
+        {'legs': [{'action': 'buy', 'name': 'btc', 'count': 'abc'}]},
+        {'legs': [{'action': 'buy', 'name': 'btc', 'count': 'NaN'}]},
+        {'legs': [{'action': 'buy', 'name': 'btc', 'count': 'Infinity'}]},
+        {'legs': [{'action': 'buy', 'count': '1'}]},
+    ),
+)
+def test_batch_trades_bad_request(client, body):
+    status, _ = trades(client, body)
+    assert status == 400
+
+
+def test_batch_trades_unknown_currency(client):
+    status, data = trades(
+        client, {'legs': [{'action': 'buy', 'name': 'unknown', 'count': '1'}]}
+    )
+    assert status == 404
+    assert data['ERROR'] == 'This currency does not exist'
@@ -0,0 +1,95 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from exchange.app import server
+from exchange.candles import bucket, record_tick
+from exchange.db import Candle, RateTick, create_session
+from exchange.orderbook import matching_engine
+from exchange.ticker import RateTicker
+
+URL = '/market/api/v1.0/rates/btc/history'
+
+
+@pytest.fixture(autouse=True)
+def _load_orders(_init_db):
+    matching_engine.load()
+
+
+def record(created, sold, buy):
+    with create_session() as session:
+        record_tick(session, {'btc': (Decimal(sold), Decimal(buy))}, created)
+
+
+def test_bucket():
+    created = datetime(2020, 5, 17, 13, 42, 31, 500)
+    assert bucket(created, '1m') == datetime(2020, 5, 17, 13, 42)
+    assert bucket(created, '1h') == datetime(2020, 5, 17, 13)
+    assert bucket(created, '1d') == datetime(2020, 5, 17)
+
+
+def test_candles_incremental():
+    record(datetime(2020, 5, 17, 13, 42, 1), 12, 10)
+    record(datetime(2020, 5, 17, 13, 42, 11), 15, 13)
+    record(datetime(2020, 5, 17, 13, 42, 21), 9, 8)
+    record(datetime(2020, 5, 17, 13, 43, 1), 11, 10)
+    with create_session() as session:
+        assert session.query(RateTick).count() == 4
+        minutes = (
+            session.query(Candle)
+            .filter(Candle.period == '1m')
+            .order_by(Candle.start)
+            .all()
+        )
+        assert [candle.ticks for candle in minutes] == [3, 1]
+        first = minutes[0]
+        assert (first.sold_open, first.sold_high, first.sold_low, first.sold_close) == (
+            12,
+            15,
+            9,
+            9,
+        )
+        hour = session.query(Candle).filter(Candle.period == '1h').one()
+        assert (hour.buy_open, hour.buy_low, hour.buy_close, hour.ticks) == (
+            10,
+            8,
+            10,
+            4,
+        )
+
+
+def test_history_endpoint():
+    record(datetime(2020, 5, 17, 13, 42, 1), 12, 10)
+    record(datetime(2020, 5, 17, 14, 2, 1), 14, 12)
+    with server.test_client() as client:
+        data = json.loads(client.get(URL + '?period=1h').get_data())
+        assert [item['start'] for item in data['HISTORY']] == [
+            '2020-05-17T13:00:00',
+            '2020-05-17T14:00:00',
+        ]
+        assert data['HISTORY'][1]['sold_price']['close'] == '14'
+        data = json.loads(
+            client.get(URL + '?period=tick&since=2020-05-17T14:00:00').get_data()
+        )
+        assert data['HISTORY'] == [
+            {'created': '2020-05-17T14:02:01', 'sold_price': '14', 'buy_price': '12'}
+        ]
+        data = json.loads(client.get(URL + '?period=1d&until=2020-05-17').get_data())
+        assert data['HISTORY'] == []
+
+
+def test_history_errors():
+    with server.test_client() as client:
+        assert client.get(URL + '?period=5m').status_code == 400
+        assert client.get(URL + '?since=yesterday').status_code == 400
+        assert client.get(URL + '?limit=0').status_code == 400
+        response = client.get('/market/api/v1.0/rates/abc/history')
+        assert response.status_code == 404
+
+
+def test_tick_records_history(fixed_model):
+    RateTicker(fixed_model).tick()
+    with server.test_client() as client:
+        data = json.loads(client.get(URL + '?period=1d').get_data())
+    assert data['HISTORY'][0]['sold_price']['open'] == '24'
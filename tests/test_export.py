@@ -0,0 +1,153 @@
+import csv
+import io
+import json
+
+import pytest
+from exchange import export as export_module
+from exchange.app import server
+from exchange.db import LedgerEntry, User, UserCurrency, UserOperations, create_session
+from exchange.ledger import reconcile, unbalanced
+from exchange.valuation import valuation_store
+
+PREFIX = '/market/api/v1.0'
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        for name in ('first', 'second', 'third'):
+            client.post(
+                PREFIX + '/registration',
+                data=json.dumps({'name': name}),
+                content_type='application/json',
+            )
+        client.post(
+            PREFIX + '/1/buy',
+            data=json.dumps({'name': 'btc', 'count': '1.5'}),
+            content_type='application/json',
+        )
+        yield client
+
+
+def test_export_ndjson_in_chunks(client, monkeypatch):
+    monkeypatch.setattr(export_module, 'CHUNK_SIZE', 2)
+    response = client.get(PREFIX + '/export/users')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['name'] for row in rows] == ['first', 'second', 'third']
+    assert rows[0] == {'id': 1, 'name': 'first', 'ye': '982'}
+
+
+def test_export_csv(client):
+    response = client.get(PREFIX + '/export/operations?format=csv')
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert (rows[0]['action'], rows[0]['count'], rows[0]['price']) == (
+        'buy',
+        '1.5',
+        '12',
+    )
+
+
+def test_export_empty_csv_has_header(client):
+    response = client.get(PREFIX + '/export/users?format=csv')
+    assert response.get_data(as_text=True).startswith('id,name,ye\r\n')
+    with create_session() as session:
+        session.query(UserOperations).delete()
+    response = client.get(PREFIX + '/export/operations?format=csv')
+    assert response.get_data(as_text=True).count('\n') == 1
+
+
+@pytest.mark.parametrize('kind', ['ndjson', 'csv', 'msgpack'])
+def test_export_import_round_trip(client, kind):
+    if kind == 'msgpack':
+        pytest.importorskip('msgpack')
+    exported = client.get(PREFIX + '/export/operations?format=' + kind).get_data()
+    with create_session() as session:
+        before = [
+            (item.id, item.count, item.price, item.created)
+            for item in session.query(UserOperations)
+        ]
+        session.query(UserOperations).delete()
+    response = client.post(PREFIX + '/import/operations?format=' + kind, data=exported)
+    assert json.loads(response.get_data()) == {'IMPORTED': {'operations': 1}}
+    with create_session() as session:
+        after = [
+            (item.id, item.count, item.price, item.created)
+            for item in session.query(UserOperations)
+        ]
+    assert after == before
+
+
+def test_import_is_one_transaction(client, monkeypatch):
+    monkeypatch.setattr(export_module, 'BATCH_SIZE', 1)
+    rows = [
+        {'id': 10, 'name': 'imported', 'ye': '5'},
+        {'id': 1, 'name': 'duplicate', 'ye': '5'},
+    ]
+    response = client.post(
+        PREFIX + '/import/users',
+        data=''.join(json.dumps(row) + '\n' for row in rows),
+    )
+    assert response.status_code == 409
+    response = client.get(PREFIX + '/10/get_ye')
+    assert response.status_code == 404
+
+
+def test_import_rates_refreshes_cache(client):
+    response = client.post(
+        PREFIX + '/import/rates?format=csv',
+        data='name,sold_price,buy_price\ndoge,2,1\n',
+    )
+    assert response.status_code == 200
+    rates = json.loads(client.get(PREFIX + '/get_exchange_rate_all').get_data())
+    assert 'doge' in rates['EXCHANGE RATE']
+
+
+def test_imported_balances_opened_and_valued(client):
+    with create_session() as session:
+        # пользователь 2 удаляется вместе со своими проводками и встречной
+        # проводкой биржи
+        house = (
+            session.query(LedgerEntry.id)
+            .filter(LedgerEntry.user_id == 0, LedgerEntry.kind == 'open')
+            .first()
+        )
+        session.query(LedgerEntry).filter(
+            (LedgerEntry.user_id == 2) | (LedgerEntry.id == house.id)
+        ).delete(synchronize_session=False)
+        session.query(UserCurrency).filter(UserCurrency.user_id == 2).delete()
+        session.query(User).filter(User.id == 2).delete()
+    # оценка уже видела пользователя 3, импортируемый id 2 ниже этой отметки
+    valuation_store.load()
+    client.post(PREFIX + '/import/users', data='{"id": 2, "name": "back", "ye": "5"}\n')
+    client.post(
+        PREFIX + '/import/holdings?format=csv',
+        data='user_id,name_currency,count_currency\n2,btc,1\n',
+    )
+    with create_session() as session:
+        assert list(reconcile(session)) == []
+        assert unbalanced(session) == {}
+    data = json.loads(client.get(PREFIX + '/2/valuation').get_data())
+    assert (data['YE'], data['VALUATION']) == ('5', {'btc': '10'})
+
+
+@pytest.mark.parametrize(
+    'url, data, status',
+    [
+        ('/export/secrets', None, 404),
+        ('/export/users?format=xml', None, 400),
+        ('/import/users', '{"id": "x", "name": "a", "ye": "1"}\n', 400),
+        ('/import/users', 'not json\n', 400),
+        ('/import/users', '{"id": 9, "name": "a", "ye": "abc"}\n', 400),
+        ('/import/users', '{"id": 9, "name": "a", "ye": "NaN"}\n', 400),
+        ('/import/users', '{"id": 9, "name": "a", "ye": "-Infinity"}\n', 400),
+        ('/import/ledger', '', 400),
+    ],
+)
+def test_bad_requests(client, url, data, status):
+    if data is None:
+        response = client.get(PREFIX + url)
+    else:
+        response = client.post(PREFIX + url, data=data)
+    assert response.status_code == status
@@ -0,0 +1,100 @@
+import json
+from decimal import Decimal
+
+import pytest
+from exchange.app import server
+from exchange.db import UserOperations, create_session
+from exchange.formats import STRUCTURED, number, rate_table
+from exchange.rates import RateSnapshot, rate_cache
+from exchange.ticker import RateTicker
+
+URL = '/market/api/v1.0/get_exchange_rate_all'
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        yield client
+
+
+def test_number():
+    assert number(Decimal('12.00')) == 12
+    assert isinstance(number(Decimal('12.00')), int)
+    assert number(Decimal('0.5')) == 0.5
+
+
+def test_rates_default_form_unchanged(client):
+    response = client.get(URL)
+    assert response.mimetype == 'application/json'
+    data = json.loads(response.get_data())
+    assert data['EXCHANGE RATE']['btc'] == 'sold price : 12, buy price : 10'
+    assert 'Accept' in response.headers['Vary']
+
+
+def test_rates_structured(client):
+    response = client.get(URL, headers={'Accept': STRUCTURED})
+    assert response.mimetype == STRUCTURED
+    data = json.loads(response.get_data())
+    assert data['rates']['btc'] == {'sold_price': 12, 'buy_price': 10}
+    assert data['version'] == rate_cache.current().version
+
+
+def test_rates_not_modified(client, fixed_model):
+    response = client.get(URL)
+    etag = response.headers['ETag']
+    response = client.get(URL, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    # у другого формата свой ETag
+    response = client.get(URL, headers={'Accept': STRUCTURED, 'If-None-Match': etag})
+    assert response.status_code == 200
+    # перечитанный без изменений курс сохраняет версию и ETag, как в любом
+    # другом воркере
+    rate_cache.refresh()
+    assert client.get(URL, headers={'If-None-Match': etag}).status_code == 304
+    RateTicker(fixed_model).tick()
+    response = client.get(URL, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_rate_table_serialized_once_per_version(client):
+    snapshot = RateSnapshot(-1, {'btc': (Decimal(2), Decimal(1))})
+    with server.test_request_context():
+        etag, body = rate_table.get(snapshot, STRUCTURED)
+        assert rate_table.get(snapshot, STRUCTURED)[1] is body
+        changed = RateSnapshot(-2, {'btc': (Decimal(3), Decimal(1))})
+        assert rate_table.get(changed, STRUCTURED)[0] != etag
+
+
+def test_operations_structured(client):
+    client.post(
+        '/market/api/v1.0/registration',
+        data=json.dumps({'name': 'username'}),
+        content_type='application/json',
+    )
+    client.post(
+        '/market/api/v1.0/1/buy',
+        data=json.dumps({'name': 'btc', 'count': '1.5'}),
+        content_type='application/json',
+    )
+    response = client.get(
+        '/market/api/v1.0/1/get_operations', headers={'Accept': STRUCTURED}
+    )
+    operation = json.loads(response.get_data())['operations'][0]
+    assert (operation['action'], operation['currency']) == ('buy', 'btc')
+    assert operation['count'] == 1.5
+    # у операций, записанных до появления колонки, времени нет
+    with create_session() as session:
+        session.query(UserOperations).update({'created': None})
+    response = client.get(
+        '/market/api/v1.0/1/get_operations', headers={'Accept': STRUCTURED}
+    )
+    assert json.loads(response.get_data())['operations'][0]['created'] is None
+
+
+def test_rates_msgpack(client):
+    msgpack = pytest.importorskip('msgpack')
+    response = client.get(URL, headers={'Accept': 'application/msgpack'})
+    assert response.mimetype == 'application/msgpack'
+    data = msgpack.unpackb(response.get_data(), raw=False)
+    assert data['rates']['btc'] == {'sold_price': 12, 'buy_price': 10}
@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from exchange.app import server
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        for action, name in (('buy', 'btc'), ('buy', 'eth'), ('sold', 'btc')):
+            client.post(
+                '/market/api/v1.0/1/{0}'.format(action),
+                data=json.dumps({'name': name, 'count': '1'}),
+                content_type='application/json',
+            )
+        yield client
+
+
+def get_page(client, query=''):
+    response = client.get('/market/api/v1.0/1/operations{0}'.format(query))
+    return response.status_code, json.loads(response.get_data())
+
+
+def test_operations_pages(client):
+    _, first = get_page(client, '?limit=2')
+    assert [item['currency'] for item in first['OPERATIONS']] == ['btc', 'eth']
+    assert first['NEXT'] == first['OPERATIONS'][-1]['id']
+    _, second = get_page(client, '?limit=2&after={0}'.format(first['NEXT']))
+    assert [item['action'] for item in second['OPERATIONS']] == ['sold']
+    assert second['NEXT'] is None
+
+
+def test_operations_filters(client):
+    _, data = get_page(client, '?currency=btc&action=sold')
+    assert len(data['OPERATIONS']) == 1
+    assert data['OPERATIONS'][0]['count'] == '1'
+    since = (datetime.utcnow() + timedelta(hours=1)).isoformat()
+    _, data = get_page(client, '?since={0}'.format(since))
+    assert data == {'OPERATIONS': [], 'NEXT': None}
+    _, data = get_page(client, '?until={0}'.format(since))
+    assert len(data['OPERATIONS']) == 3
+
+
+@pytest.mark.parametrize('query', ('?limit=0', '?after=abc', '?since=yesterday'))
+def test_operations_bad_request(client, query):
+    status, _ = get_page(client, query)
+    assert status == 400
+
+
+def test_operations_user_not_found(client):
+    response = client.get('/market/api/v1.0/2/operations')
+    assert response.status_code == 404
+    assert json.loads(response.get_data())['ERROR'] == 'User not found'
@@ -0,0 +1,99 @@
+import json
+from threading import Event, Thread
+
+import pytest
+from exchange.app import server
+from exchange.db import UserOperations, create_session
+from exchange.idempotency import IdempotencyStore, StoredResponse, idempotency_store
+
+URL = '/market/api/v1.0/1/buy'
+
+
+@pytest.fixture(autouse=True)
+def _clear_store(_init_db):
+    idempotency_store.clear()
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        yield client
+
+
+def buy(client, key, count='1'):
+    return client.post(
+        URL,
+        data=json.dumps({'name': 'btc', 'count': count}),
+        content_type='application/json',
+        headers={'Idempotency-Key': key},
+    )
+
+
+def count_operations():
+    with create_session() as session:
+        return session.query(UserOperations).count()
+
+
+def test_retry_replays_response(client):
+    first = buy(client, 'key-1')
+    second = buy(client, 'key-1')
+    assert second.get_data() == first.get_data()
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert count_operations() == 1
+    buy(client, 'key-2')
+    assert count_operations() == 2
+
+
+def test_key_reused_for_other_request(client):
+    buy(client, 'key-1')
+    assert buy(client, 'key-1', count='2').status_code == 422
+
+
+def test_failed_trade_not_stored(client):
+    response = buy(client, 'key-1', count='1000')
+    assert response.status_code == 200
+    assert 'ERROR' in json.loads(response.get_data())
+    buy(client, 'key-1', count='1000')
+    assert count_operations() == 0
+
+
+def test_concurrent_duplicates_coalesce():
+    store = IdempotencyStore()
+    started, release = Event(), Event()
+    calls = []
+
+    def operation():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return StoredResponse(200, 'application/json', b'{}')
+
+    results = []
+    first = Thread(target=lambda: results.append(store.execute('k', b'', operation)))
+    first.start()
+    started.wait()
+    second = Thread(target=lambda: results.append(store.execute('k', b'', operation)))
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+    assert len(calls) == 1
+    assert sorted(replayed for _, replayed in results) == [False, True]
+
+
+def test_ttl_and_capacity():
+    now = [0.0]
+    store = IdempotencyStore(ttl=10, capacity=2, clock=lambda: now[0])
+    stored = StoredResponse(200, 'application/json', b'{}')
+    for key in ('a', 'b', 'c'):
+        store.execute(key, b'', lambda: stored)
+    assert len(store) == 2
+    now[0] = 20
+    assert store.execute('b', b'', lambda: stored) == (stored, False)
+    assert len(store) == 1
@@ -0,0 +1,190 @@
+import json
+from decimal import Decimal
+from threading import Thread
+
+import pytest
+from exchange.app import server
+from exchange.db import (
+    JournalCheckpoint,
+    User,
+    UserCurrency,
+    UserOperations,
+    create_session,
+)
+from exchange.exception import NotEnoughFunds
+from exchange.journal import TradeJournal, journal_from_env
+from exchange.pending import PendingBook, Reserved, pending_book
+from exchange.records import JournalRecord, apply_records, dump_record, load_records
+from exchange.shards import trade_router
+from exchange.trade import TradeRequest, execute_trade
+
+
+@pytest.fixture(autouse=True)
+def _register(_init_db):
+    with server.test_client() as client:
+        client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+
+
+@pytest.fixture()
+def journal(tmp_path):
+    trade_journal = TradeJournal(str(tmp_path / 'trades.journal'), window=0.001)
+    trade_journal.open()
+    yield trade_journal
+    trade_journal.close()
+
+
+def buy(count, price):
+    return TradeRequest(1, 'btc', Decimal(count), Decimal(price), 'buy')
+
+
+def balances():
+    with create_session() as session:
+        ye = session.query(User.ye).filter(User.id == 1).scalar()
+        count = (
+            session.query(UserCurrency.count_currency)
+            .filter(UserCurrency.user_id == 1, UserCurrency.name_currency == 'btc')
+            .scalar()
+        )
+        return ye, count, session.query(UserOperations).count()
+
+
+def test_trades_applied_after_ack(journal):
+    assert journal.execute(buy(1, 12)) == (988, 1)
+    assert journal.execute(buy(2, 24)) == (964, 3)
+    journal.close()
+    assert balances() == (964, 3, 2)
+    assert journal.pending() == ({}, {})
+    with create_session() as session:
+        assert session.query(JournalCheckpoint).get(1).seq == 2
+    with open(journal.path) as journal_file:
+        assert journal_file.read() == ''
+
+
+def test_funds_checked_against_pending(journal):
+    journal.execute(buy(50, 600))
+    with pytest.raises(NotEnoughFunds):
+        journal.execute(buy(50, 600))
+    with pytest.raises(NotEnoughFunds, match='Leg 1'):
+        journal.execute_batch([buy(1, 12), buy(50, 600)])
+    journal.close()
+    assert balances() == (400, 50, 1)
+
+
+def test_applied_records_not_counted_twice(tmp_path):
+    journal = TradeJournal(str(tmp_path / 'trades.journal'), book=PendingBook())
+    journal.replay()
+    journal.book.add(1, journal._reserve([buy(50, 600)], False)[1])
+    with create_session() as session:
+        apply_records(session, [JournalRecord(1, [buy(50, 600)])])
+    # запись уже в базе, но ещё не снята с отложенных
+    with pytest.raises(NotEnoughFunds):
+        journal._reserve([buy(50, 600)], False)
+    assert journal._reserve([buy(1, 12)], False)[0] == [(388, 51)]
+
+
+def test_direct_trades_see_pending():
+    # исполнение заявок пишет балансы мимо журнала, но учитывает его записи
+    pending_book.active = True
+    pending_book.add(10**6, [Reserved(1, 'btc', Decimal(-600), Decimal(50))])
+    try:
+        with pytest.raises(NotEnoughFunds):
+            execute_trade(buy(50, 600))
+        assert execute_trade(buy(1, 12)) == (388, 51)
+        # замок счёта отпущен вместе с концом транзакции
+        free = []
+        lock = pending_book.locks([1])[0]
+
+        def try_lock():
+            free.append(lock.acquire(blocking=False))
+            lock.release()
+
+        thread = Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        assert free == [True]
+    finally:
+        pending_book.active = False
+        pending_book.forget([1], lambda item: True)
+    assert balances() == (988, 1, 1)
+
+
+def test_forget_waits_for_account_check():
+    book = PendingBook()
+    book.add(1, [Reserved(1, 'btc', Decimal(-12), Decimal(1))])
+    # проверка средств прочитала баланс до коммита записи и держит замок
+    lock = book.locks([1])[0]
+    lock.acquire()
+    thread = Thread(target=book.forget, args=([1], lambda item: True))
+    thread.start()
+    thread.join(0.05)
+    assert thread.is_alive()
+    assert book.delta(1, 'btc', 0) == (Decimal(-12), Decimal(1))
+    lock.release()
+    thread.join()
+    assert book.totals() == ({}, {})
+
+
+def test_replay_after_crash(tmp_path):
+    path = str(tmp_path / 'trades.journal')
+    with open(path, 'w') as journal_file:
+        for seq in (1, 2):
+            journal_file.write(dump_record(JournalRecord(seq, [buy(1, 12)])) + '\n')
+        # запись, оборванная при падении
+        journal_file.write('{"seq": 3, "tra')
+    assert len(list(load_records(path))) == 2
+    journal = TradeJournal(path)
+    assert journal.replay() == 2
+    assert balances() == (976, 2, 2)
+    with open(path, 'w') as journal_file:
+        journal_file.write(dump_record(JournalRecord(2, [buy(1, 12)])) + '\n')
+    assert journal.replay() == 0
+    assert balances() == (976, 2, 2)
+
+
+def test_records_keep_unit_price(tmp_path):
+    path = str(tmp_path / 'trades.journal')
+    trade = TradeRequest(1, 'btc', Decimal(2), Decimal(24), 'buy', Decimal(12))
+    with open(path, 'w') as journal_file:
+        journal_file.write(dump_record(JournalRecord(1, [trade])) + '\n')
+        # запись без цены единицы, как их писали раньше
+        journal_file.write(dump_record(JournalRecord(2, [buy(1, 12)])) + '\n')
+    assert [record.trades[0] for record in load_records(path)] == [
+        trade,
+        buy(1, 12),
+    ]
+
+
+def test_router_uses_journal(journal):
+    trade_router.journal = journal
+    try:
+        with server.test_client() as client:
+            response = client.post(
+                '/market/api/v1.0/1/buy',
+                data=json.dumps({'name': 'btc', 'count': '1'}),
+                content_type='application/json',
+            )
+            assert json.loads(response.get_data())['DO TRANSACTION']['YE NOW'] == '988'
+            response = client.post(
+                '/market/api/v1.0/1/trades',
+                data=json.dumps(
+                    {'legs': [{'action': 'sold', 'name': 'btc', 'count': '1'}]}
+                ),
+                content_type='application/json',
+            )
+            assert response.status_code == 200
+    finally:
+        trade_router.journal = None
+    journal.close()
+    assert balances() == (998, 0, 2)
+
+
+def test_journal_from_env():
+    assert journal_from_env({}) is None
+    journal = journal_from_env(
+        {'EXCHANGE_JOURNAL_PATH': 'trades.journal', 'EXCHANGE_JOURNAL_BATCH': '8'}
+    )
+    assert (journal.path, journal.batch) == ('trades.journal', 8)
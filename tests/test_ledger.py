@@ -0,0 +1,125 @@
+import json
+from decimal import Decimal
+from threading import Event, Thread
+
+import pytest
+from exchange.app import server
+from exchange.db import (
+    BalanceSnapshot,
+    LedgerEntry,
+    User,
+    UserOperations,
+    create_session,
+)
+from exchange.ledger import (
+    HOUSE,
+    Mismatch,
+    SnapshotJob,
+    balances_at,
+    last_entry,
+    open_ledger,
+    reconcile,
+    take_snapshot,
+    unbalanced,
+)
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        yield client
+
+
+def trade(client, action, count):
+    return client.post(
+        '/market/api/v1.0/1/{0}'.format(action),
+        data=json.dumps({'name': 'btc', 'count': count}),
+        content_type='application/json',
+    )
+
+
+def check(session):
+    assert list(reconcile(session)) == []
+    assert unbalanced(session) == {}
+
+
+def test_trades_post_balanced_entries(client):
+    trade(client, 'buy', '2')
+    trade(client, 'sold', '1')
+    with create_session() as session:
+        entries = session.query(LedgerEntry).order_by(LedgerEntry.id).all()
+        assert [(entry.user_id, entry.kind) for entry in entries[:2]] == [
+            (1, 'open'),
+            (HOUSE, 'open'),
+        ]
+        assert [entry.amount for entry in entries[2:6]] == [-24, 24, 2, -2]
+        assert entries[2].price == 12
+        operation = session.query(UserOperations).first()
+        assert (operation.count, operation.price) == (2, 12)
+        check(session)
+
+
+def test_balances_from_snapshot_and_tail(client):
+    trade(client, 'buy', '2')
+    with create_session() as session:
+        first = take_snapshot(session)
+        assert take_snapshot(session) == first
+    trade(client, 'buy', '1')
+    with create_session() as session:
+        second = take_snapshot(session)
+        assert session.query(BalanceSnapshot).filter_by(entry_id=second).count() == 4
+    trade(client, 'sold', '3')
+    with create_session() as session:
+        assert balances_at(session, 1, first) == {'ye': 976, 'btc': 2}
+        assert balances_at(session, 1, second) == {'ye': 964, 'btc': 3}
+        assert balances_at(session, 1) == {'ye': 994, 'btc': 0}
+        assert balances_at(session, 1, 1) == {'ye': 1000}
+        check(session)
+
+
+def test_reconcile_finds_drift(client):
+    trade(client, 'buy', '2')
+    with create_session() as session:
+        take_snapshot(session)
+        session.query(User).filter(User.id == 1).update({'ye': Decimal(1)})
+    with create_session() as session:
+        assert list(reconcile(session)) == [Mismatch(1, 'ye', 1, 976)]
+        session.add(LedgerEntry(user_id=HOUSE, account='btc', amount=5, kind='open'))
+    with create_session() as session:
+        assert unbalanced(session) == {'btc': 5}
+
+
+def test_open_ledger_for_existing_balances(client):
+    trade(client, 'buy', '2')
+    with create_session() as session:
+        session.query(LedgerEntry).delete()
+    with create_session() as session:
+        assert list(reconcile(session)) == [
+            Mismatch(1, 'btc', 2, None),
+            Mismatch(1, 'ye', 976, None),
+        ]
+        assert open_ledger(session)
+        assert not open_ledger(session)
+        check(session)
+
+
+def test_snapshot_job(client):
+    stop = Event()
+    thread = Thread(target=SnapshotJob(0.01).run, args=(stop,))
+    thread.start()
+    try:
+        for _ in range(100):
+            with create_session() as session:
+                if session.query(BalanceSnapshot).count():
+                    break
+            stop.wait(0.01)
+    finally:
+        stop.set()
+        thread.join()
+    with create_session() as session:
+        assert balances_at(session, 1, last_entry(session)) == {'ye': 1000}
@@ -0,0 +1,124 @@
+import json
+from threading import Event, Thread
+
+import pytest
+from exchange.app import server
+from exchange.limits import (
+    Limit,
+    SharedBuckets,
+    TokenBuckets,
+    admission,
+    install,
+    limits_from_env,
+)
+from exchange.shards import CONTEXT
+from flask import Flask
+
+OFF = Limit(0, 1, 0)
+
+app = Flask(__name__)
+install(app)
+entered, release = Event(), Event()
+
+
+@app.route('/blocking', methods=['GET'])
+def block():
+    entered.set()
+    release.wait(5)
+    return 'done'
+
+
+@app.route('/ping', methods=['GET'])
+def ping():
+    return 'pong'
+
+
+@pytest.fixture()
+def limits():
+    yield admission.configure
+    admission.configure({'read': OFF, 'write': OFF})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize(
+    'factory', (TokenBuckets, lambda clock: SharedBuckets(CONTEXT, 8, clock))
+)
+def test_token_bucket(factory):
+    clock = Clock()
+    buckets = factory(clock=clock)
+    limit = Limit(2, 2, 0)
+    assert buckets.take('a', limit) == 0
+    assert buckets.take('a', limit) == 0
+    assert buckets.take('a', limit) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert buckets.take('a', limit) == 0
+    assert buckets.take('b', limit) == 0
+
+
+def test_bucket_eviction():
+    buckets = TokenBuckets(capacity=1)
+    limit = Limit(1, 1, 0)
+    buckets.take('a', limit)
+    buckets.take('b', limit)
+    # вытесненное ведро снова полное
+    assert buckets.take('a', limit) == 0
+
+
+def test_rate_limited_per_user_and_route(limits):
+    limits({'read': Limit(1, 2, 0), 'write': OFF})
+    with server.test_client() as client:
+        for _ in range(2):
+            assert client.get('/market/api/v1.0/1/get_ye').status_code == 404
+        response = client.get('/market/api/v1.0/1/get_ye')
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+        assert client.get('/market/api/v1.0/2/get_ye').status_code == 404
+        assert client.get('/market/api/v1.0/1/get_portfolio').status_code == 404
+        # записи ограничиваются отдельно
+        response = client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        assert response.status_code == 200
+        assert client.get('/metrics').status_code == 200
+
+
+def test_concurrency_limit_sheds_load(limits):
+    limits({'read': Limit(0, 1, 1), 'write': OFF})
+    entered.clear()
+    release.clear()
+    statuses = []
+
+    def first():
+        with app.test_client() as client:
+            statuses.append(client.get('/blocking').status_code)
+
+    thread = Thread(target=first)
+    thread.start()
+    try:
+        entered.wait(5)
+        with app.test_client() as client:
+            response = client.get('/ping')
+            assert response.status_code == 429
+            assert 'Retry-After' in response.headers
+    finally:
+        release.set()
+        thread.join()
+    assert statuses == [200]
+    with app.test_client() as client:
+        assert client.get('/ping').status_code == 200
+
+
+def test_limits_from_env():
+    limits = limits_from_env(
+        {'EXCHANGE_LIMIT_WRITE_RATE': '5', 'EXCHANGE_LIMIT_WRITE_CONCURRENCY': '8'}
+    )
+    assert limits == {'read': OFF, 'write': Limit(5, 1, 8)}
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+from exchange.app import server
+from exchange.metrics import (
+    REJECTIONS,
+    REQUEST_QUERIES,
+    TRADES,
+    Counter,
+    Histogram,
+)
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        client.post(
+            '/market/api/v1.0/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        yield client
+
+
+def test_histogram_render():
+    histogram = Histogram('latency', 'help', ('route',), (0.1, 1.0))
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    histogram.observe(5, '/a')
+    lines = histogram.render()
+    assert 'latency_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'latency_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_count{route="/a"} 3' in lines
+    assert histogram.count('/a') == 3
+    assert histogram.count('/b') == 0
+
+
+def test_counter_render():
+    counter = Counter('ticks', 'help')
+    counter.inc()
+    counter.inc(amount=2)
+    assert counter.render()[-1] == 'ticks 3'
+
+
+def test_trade_and_queries_counted(client):
+    route = '/market/api/v1.0/<identification>/buy'
+    trades = TRADES.value('buy')
+    requests = REQUEST_QUERIES.count(route)
+    client.post(
+        '/market/api/v1.0/1/buy',
+        data=json.dumps({'name': 'btc', 'count': '1'}),
+        content_type='application/json',
+    )
+    assert TRADES.value('buy') == trades + 1
+    assert REQUEST_QUERIES.count(route) == requests + 1
+
+
+def test_rejection_counted(client):
+    rejections = REJECTIONS.value('UserNotFound')
+    client.get('/market/api/v1.0/100/get_ye')
+    assert REJECTIONS.value('UserNotFound') == rejections + 1
+
+
+def test_metrics_endpoint(client):
+    client.get('/market/api/v1.0/1/get_ye')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert '# TYPE exchange_request_duration_seconds histogram' in body
+    assert 'exchange_sql_duration_seconds_count' in body
@@ -0,0 +1,84 @@
+import sqlite3
+from decimal import Decimal
+
+import sqlalchemy as sa
+from exchange.db import ExchangeRate, User, UserCurrency, UserOperations
+from exchange.migrate import migrate
+
+
+def create_legacy_db(path):
+    connection = sqlite3.connect(str(path))
+    connection.executescript('''
+        CREATE TABLE user (id INTEGER PRIMARY KEY, name VARCHAR(100), ye VARCHAR);
+        CREATE TABLE user_currency (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER REFERENCES user (id),
+            name_currency VARCHAR,
+            count_currency VARCHAR
+        );
+        CREATE TABLE exchange_rate (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR UNIQUE,
+            sold_price VARCHAR,
+            buy_price VARCHAR
+        );
+        CREATE TABLE user_operations (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER REFERENCES user (id),
+            action VARCHAR,
+            currency VARCHAR,
+            count VARCHAR
+        );
+        INSERT INTO user VALUES (1, 'username', '879.87654');
+        INSERT INTO user_currency VALUES (1, 1, 'btc', '10');
+        INSERT INTO exchange_rate VALUES (1, 'btc', '12.012', '10.01');
+        INSERT INTO user_operations VALUES (1, 1, 'buy', 'btc', '10');
+        ''')
+    connection.commit()
+    connection.close()
+
+
+def test_migrate_legacy_db(tmp_path):
+    path = tmp_path / 'legacy.sqlite'
+    create_legacy_db(path)
+    url = 'sqlite:///{0}'.format(path)
+
+    assert migrate(url) == {
+        'user': 1,
+        'exchange_rate': 1,
+        'user_currency': 1,
+        'user_operations': 1,
+    }
+
+    engine = sa.create_engine(url)
+    with engine.connect() as connection:
+        assert connection.execute(sa.select([User.ye])).scalar() == Decimal('879.87654')
+        assert connection.execute(
+            sa.select([UserCurrency.count_currency])
+        ).scalar() == Decimal(10)
+        assert connection.execute(
+            sa.select([ExchangeRate.sold_price, ExchangeRate.buy_price])
+        ).first() == (Decimal('12.012'), Decimal('10.01'))
+        assert connection.execute(sa.select([UserOperations.count])).scalar() == 10
+    # повторный запуск ничего не делает
+    assert migrate(url) == {}
+
+
+def test_migrate_adds_missing_columns(tmp_path):
+    path = tmp_path / 'old.sqlite'
+    connection = sqlite3.connect(str(path))
+    connection.execute(
+        'CREATE TABLE user_operations (id INTEGER PRIMARY KEY, user_id INTEGER, '
+        'action VARCHAR, currency VARCHAR, count BIGINT)'
+    )
+    connection.commit()
+    connection.close()
+    url = 'sqlite:///{0}'.format(path)
+
+    assert migrate(url) == {}
+    inspector = sa.inspect(sa.create_engine(url))
+    columns = {column['name'] for column in inspector.get_columns('user_operations')}
+    assert 'created' in columns
+    assert [index['name'] for index in inspector.get_indexes('user_operations')] == [
+        'ix_user_operations_user_id_id'
+    ]
@@ -0,0 +1,180 @@
+import json
+from decimal import Decimal
+
+import pytest
+from exchange.app import server
+from exchange.db import Order, create_session
+from exchange.orderbook import MatchingEngine, matching_engine
+from exchange.rates import RateSnapshot
+
+
+@pytest.fixture(autouse=True)
+def _load_orders(_init_db):
+    matching_engine.load()
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        for name in ('first', 'second'):
+            client.post(
+                '/market/api/v1.0/registration',
+                data=json.dumps({'name': name}),
+                content_type='application/json',
+            )
+        yield client
+
+
+def post(client, url, body):
+    response = client.post(
+        '/market/api/v1.0/{0}'.format(url),
+        data=json.dumps(body),
+        content_type='application/json',
+    )
+    return response.status_code, json.loads(response.get_data())
+
+
+def place(client, user, side, price, count='1'):
+    return post(
+        client,
+        '{0}/orders'.format(user),
+        {'name': 'btc', 'side': side, 'price': price, 'count': count},
+    )
+
+
+def get_ye(client, user):
+    response = client.get('/market/api/v1.0/{0}/get_ye'.format(user))
+    return Decimal(json.loads(response.get_data())['COUNT_YE'])
+
+
+def test_place_order_rests(client):
+    status, data = place(client, 1, 'buy', '11')
+    assert status == 200
+    assert data['ORDER']['status'] == 'open'
+    response = client.get('/market/api/v1.0/1/orders?status=open')
+    orders = json.loads(response.get_data())['ORDERS']
+    assert [order['id'] for order in orders] == [data['ORDER']['id']]
+
+
+def test_place_marketable_order_fills_at_house_price(client):
+    _, data = place(client, 1, 'buy', '15')
+    assert data['ORDER']['status'] == 'filled'
+    assert get_ye(client, 1) == Decimal(988)
+
+
+def test_place_order_rejected(client):
+    _, data = place(client, 1, 'buy', '15', '1000')
+    assert data['ORDER']['status'] == 'rejected'
+    assert get_ye(client, 1) == Decimal(1000)
+
+
+def test_orders_match_each_other(client):
+    post(client, '1/buy', {'name': 'btc', 'count': '2'})
+    _, sell = place(client, 1, 'sold', '11', '2')
+    assert sell['ORDER']['status'] == 'open'
+    _, buy = place(client, 2, 'buy', '11.5')
+    assert buy['ORDER']['status'] == 'filled'
+    assert get_ye(client, 2) == Decimal(989)
+    orders = matching_engine.orders(1)
+    assert orders[0].count == Decimal(1)
+    assert orders[0].status == 'open'
+
+
+def test_maker_without_funds_is_rejected(client):
+    _, sell = place(client, 1, 'sold', '11')
+    _, buy = place(client, 2, 'buy', '11.5')
+    assert buy['ORDER']['status'] == 'open'
+    assert matching_engine.orders(1)[0].status == 'rejected'
+    assert get_ye(client, 2) == Decimal(1000)
+
+
+def test_rate_change_fills_resting_orders(client):
+    place(client, 1, 'buy', '11')
+    snapshot = RateSnapshot(0, {'btc': (Decimal('10.5'), Decimal('9'))})
+    assert matching_engine.on_rates(snapshot) == 1
+    assert matching_engine.orders(1)[0].status == 'filled'
+    assert get_ye(client, 1) == Decimal('989.5')
+
+
+def test_order_filled_once_across_engines(client):
+    place(client, 1, 'buy', '11')
+    # второй процесс со своей копией книги заявок
+    other = MatchingEngine()
+    other.load()
+    snapshot = RateSnapshot(0, {'btc': (Decimal('10.5'), Decimal('9'))})
+    assert matching_engine.on_rates(snapshot) == 1
+    assert other.on_rates(snapshot) == 0
+    assert get_ye(client, 1) == Decimal('989.5')
+
+
+def test_sync_adds_orders_of_other_engines(client):
+    other = MatchingEngine()
+    other.load()
+    place(client, 1, 'buy', '11')
+    assert other.sync() == 1
+    assert other.sync() == 0
+    snapshot = RateSnapshot(0, {'btc': (Decimal('10.5'), Decimal('9'))})
+    assert other.on_rates(snapshot) == 1
+    assert matching_engine.on_rates(snapshot) == 0
+
+
+def test_changed_order_reread_before_fill(client):
+    place(client, 1, 'buy', '11', '2')
+    # заявку частично исполнил другой процесс
+    with create_session() as session:
+        session.query(Order).update({'count': 1})
+    snapshot = RateSnapshot(0, {'btc': (Decimal('10.5'), Decimal('9'))})
+    assert matching_engine.on_rates(snapshot) == 1
+    assert get_ye(client, 1) == Decimal('989.5')
+
+
+def test_cancel_order(client):
+    _, data = place(client, 1, 'buy', '11')
+    order_id = data['ORDER']['id']
+    response = client.delete('/market/api/v1.0/1/orders/{0}'.format(order_id))
+    assert json.loads(response.get_data())['CANCELLED']['status'] == 'cancelled'
+    snapshot = RateSnapshot(0, {'btc': (Decimal('10.5'), Decimal('9'))})
+    assert matching_engine.on_rates(snapshot) == 0
+    response = client.delete('/market/api/v1.0/1/orders/{0}'.format(order_id))
+    assert response.status_code == 404
+
+
+def test_orders_recovered_on_load(client):
+    place(client, 1, 'buy', '11')
+    matching_engine.load()
+    snapshot = RateSnapshot(0, {'btc': (Decimal('10.5'), Decimal('9'))})
+    assert matching_engine.on_rates(snapshot) == 1
+
+
+@pytest.mark.parametrize(
+    'body',
+    (
+        {'name': 'btc', 'side': 'buy', 'price': '1'},
+        {'name': 'btc', 'side': 'hold', 'price': '1', 'count': '1'},
+        {'name': 'btc', 'side': 'buy', 'price': '-1', 'count': '1'},
+        {'name': 'btc', 'side': 'buy', 'price': 'abc', 'count': '1'},
+        {'name': 'btc', 'side': 'buy', 'price': 'NaN', 'count': '1'},
+        {'name': 'btc', 'side': 'buy', 'price': '1', 'count': 'Infinity'},
+    ),
+)
+def test_place_order_bad_request(client, body):
+    status, _ = post(client, '1/orders', body)
+    assert status == 400
+
+
+def test_place_order_unknown_currency(client):
+    status, data = post(
+        client,
+        '1/orders',
+        {'name': 'unknown', 'side': 'buy', 'price': '1', 'count': '1'},
+    )
+    assert status == 404
+    assert data['ERROR'] == 'This currency does not exist'
+
+
+def test_place_order_unknown_user(client, monkeypatch):
+    # ошибка проверки не требует перечитывать всю книгу
+    monkeypatch.setattr(matching_engine, 'load', pytest.fail)
+    status, data = place(client, 3, 'buy', '11')
+    assert status == 404
+    assert data['ERROR'] == 'User not found'
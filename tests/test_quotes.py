@@ -0,0 +1,133 @@
+import json
+from decimal import Decimal
+
+import pytest
+from exchange.app import server
+from exchange.exception import QuoteExpired
+from exchange.orderbook import matching_engine
+from exchange.quotes import QuoteBook
+from exchange.ticker import RateTicker
+
+PREFIX = '/market/api/v1.0'
+
+
+@pytest.fixture()
+def client(_init_db):
+    matching_engine.load()
+    with server.test_client() as client:
+        client.post(
+            PREFIX + '/registration',
+            data=json.dumps({'name': 'username'}),
+            content_type='application/json',
+        )
+        yield client
+
+
+def quote(client, name='btc', action='buy', count='2'):
+    response = client.get(
+        PREFIX + '/1/quote',
+        query_string={'name': name, 'action': action, 'count': count},
+    )
+    return json.loads(response.get_data())['QUOTE']
+
+
+def trade(client, action, body):
+    return client.post(
+        PREFIX + '/1/{0}'.format(action),
+        data=json.dumps(body),
+        content_type='application/json',
+    )
+
+
+def test_trade_at_quoted_price(client, fixed_model):
+    issued = quote(client)
+    assert (issued['price'], issued['action']) == ('12', 'buy')
+    # курс удваивается, а сделка идёт по котировке
+    RateTicker(fixed_model).tick()
+    response = trade(
+        client, 'buy', {'name': 'btc', 'count': '2', 'quote': issued['id']}
+    )
+    assert json.loads(response.get_data())['DO TRANSACTION']['YE NOW'] == '976'
+    sold = quote(client, action='sold')
+    response = trade(client, 'sold', {'name': 'btc', 'count': '1', 'quote': sold['id']})
+    assert json.loads(response.get_data())['DO TRANSACTION']['YE NOW'] == '996'
+
+
+@pytest.mark.parametrize(
+    'action, body',
+    [
+        ('sold', {'name': 'btc', 'count': '1'}),
+        ('buy', {'name': 'eth', 'count': '1'}),
+    ],
+)
+def test_quote_bound_to_trade(client, action, body):
+    body['quote'] = quote(client)['id']
+    response = trade(client, action, body)
+    assert response.status_code == 409
+    assert json.loads(response.get_data())['ERROR'] == (
+        'Quote was issued for another trade'
+    )
+
+
+def test_unknown_quote(client):
+    response = trade(client, 'buy', {'name': 'btc', 'count': '1', 'quote': 'forged'})
+    assert response.status_code == 409
+    assert json.loads(response.get_data())['ERROR'] == 'Quote is invalid'
+
+
+def test_quote_redeemed_once(client):
+    quote_id = quote(client)['id']
+    body = {'name': 'btc', 'count': '1', 'quote': quote_id}
+    assert trade(client, 'buy', body).status_code == 200
+    response = trade(client, 'buy', body)
+    assert response.status_code == 409
+    assert json.loads(response.get_data())['ERROR'] == 'Quote was already used'
+
+
+def test_quote_caps_count(client):
+    body = {'name': 'btc', 'count': '3', 'quote': quote(client)['id']}
+    response = trade(client, 'buy', body)
+    assert response.status_code == 409
+    assert json.loads(response.get_data())['ERROR'].startswith('Quote covers at most')
+
+
+def test_quote_released_when_trade_fails(client):
+    # продать нечего: сделка не прошла, котировка остаётся действительной
+    quote_id = quote(client, action='sold')['id']
+    body = {'name': 'btc', 'count': '1', 'quote': quote_id}
+    assert 'ERROR' in json.loads(trade(client, 'sold', body).get_data())
+    trade(client, 'buy', {'name': 'btc', 'count': '1'})
+    response = trade(client, 'sold', body)
+    assert json.loads(response.get_data())['DO TRANSACTION']['YE NOW'] == '998'
+
+
+def test_quote_expires(_init_db):
+    now = [100.0]
+    book = QuoteBook(ttl=5, clock=lambda: now[0])
+    quote_id, expires = book.issue(1, 'btc', 'buy', Decimal('12.5'), Decimal(1))
+    assert expires == 105
+    assert book.redeem(quote_id, 1, 'btc', 'buy', Decimal(1)) == Decimal('12.5')
+    book.release(quote_id)
+    now[0] = 105.5
+    with pytest.raises(QuoteExpired, match='expired'):
+        book.redeem(quote_id, 1, 'btc', 'buy', Decimal(1))
+    # следующая выдача удаляет просроченные котировки
+    book.issue(1, 'btc', 'buy', Decimal('12.5'), Decimal(1))
+    with pytest.raises(QuoteExpired, match='invalid'):
+        book.redeem(quote_id, 1, 'btc', 'buy', Decimal(1))
+
+
+@pytest.mark.parametrize(
+    'query, status',
+    [
+        ({'action': 'buy', 'count': '1'}, 400),
+        ({'name': 'btc', 'action': 'hold', 'count': '1'}, 400),
+        ({'name': 'btc', 'action': 'buy'}, 400),
+        ({'name': 'btc', 'action': 'buy', 'count': 'NaN'}, 400),
+        ({'name': 'btc', 'action': 'buy', 'count': 'abc'}, 400),
+        ({'name': 'doge', 'action': 'buy', 'count': '1'}, 404),
+    ],
+)
+def test_quote_bad_requests(client, query, status):
+    response = client.get(PREFIX + '/1/quote', query_string=query)
+    assert response.status_code == status
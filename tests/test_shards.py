@@ -0,0 +1,167 @@
+import json
+import socket
+import urllib.request
+from decimal import Decimal
+from threading import Event, Thread
+
+import pytest
+from exchange.app import server
+from exchange.db import User, UserOperations, create_session
+from exchange.exception import NotEnoughFunds
+from exchange.prefork import serve
+from exchange.rates import rate_cache
+from exchange.idempotency import ShardIdempotency, StoredResponse
+from exchange.shards import AccountCache, Shard, ShardPool, trade_router
+from exchange.ticker import RateTicker
+from exchange.trade import TradeRequest, TradeResult
+
+
+@pytest.fixture(autouse=True)
+def _register(_init_db):
+    with server.test_client() as client:
+        for name in ('first', 'second'):
+            client.post(
+                '/market/api/v1.0/registration',
+                data=json.dumps({'name': name}),
+                content_type='application/json',
+            )
+
+
+@pytest.fixture()
+def pool():
+    shard_pool = ShardPool(2, 1)
+    shard_pool.start()
+    trade_router.client = shard_pool.client(0)
+    yield shard_pool
+    trade_router.client = None
+    shard_pool.stop()
+
+
+def buy(user_id, count, price):
+    return TradeRequest(user_id, 'btc', Decimal(count), Decimal(price), 'buy')
+
+
+def test_account_cache():
+    cache = AccountCache(capacity=1)
+    assert cache.get(1, 'btc') is None
+    cache.put(1, 'btc', TradeResult(Decimal(5), Decimal(1)))
+    assert cache.get(1, 'btc') == (5, 1)
+    assert cache.get(1, 'eth') is None
+    cache.put(2, 'btc', TradeResult(Decimal(5), Decimal(1)))
+    assert len(cache) == 1
+    assert cache.get(1, 'btc') is None
+
+
+def test_shard_uses_cache_and_recovers_from_stale():
+    shard = Shard()
+    shard.trade(buy(1, 1, 12))
+    assert shard.cache.get(1, 'btc') == (988, 1)
+    with create_session() as session:
+        # баланс поменялся мимо шарда
+        session.query(User).filter(User.id == 1).update({'ye': Decimal(500)})
+    result = shard.trade(buy(1, 1, 12))
+    assert result == (488, 2)
+    with pytest.raises(NotEnoughFunds):
+        shard.trade(buy(1, 1, 1000))
+    with create_session() as session:
+        assert session.query(UserOperations).count() == 2
+
+
+def test_trades_routed_to_shards(pool):
+    with server.test_client() as client:
+        for user_id in (1, 2):
+            response = client.post(
+                '/market/api/v1.0/{0}/buy'.format(user_id),
+                data=json.dumps({'name': 'btc', 'count': '2'}),
+                content_type='application/json',
+            )
+            data = json.loads(response.get_data())
+            assert data['DO TRANSACTION']['YE NOW'] == '976'
+        response = client.post(
+            '/market/api/v1.0/1/trades',
+            data=json.dumps(
+                {'legs': [{'action': 'sold', 'name': 'btc', 'count': '2'}]}
+            ),
+            content_type='application/json',
+        )
+        assert response.status_code == 200
+        response = client.post(
+            '/market/api/v1.0/1/buy',
+            data=json.dumps({'name': 'btc', 'count': '1000'}),
+            content_type='application/json',
+        )
+        assert 'ERROR' in json.loads(response.get_data())
+
+
+def test_rates_broadcast_to_workers(pool, fixed_model):
+    version = rate_cache.current().version
+    RateTicker(fixed_model).write()
+    pool.broadcast_rates()
+    # ответ шарда идёт через ту же очередь, поэтому курс уже обновлён
+    trade_router.execute(buy(1, 1, 12))
+    # версию курса задаёт база, а не счётчик процесса
+    assert rate_cache.current().version == version + 1
+
+
+def test_idempotency_keys_shared_by_workers():
+    shard_pool = ShardPool(2, 2)
+    shard_pool.start()
+    first, second = (ShardIdempotency(shard_pool.client(worker)) for worker in (0, 1))
+    started, release = Event(), Event()
+    calls = []
+
+    def operation():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return StoredResponse(200, 'application/json', b'{}')
+
+    try:
+        owner = Thread(target=first.execute, args=('key', b'body', operation, 1))
+        owner.start()
+        started.wait(5)
+        results = []
+        # дубль из другого воркера ждёт первое исполнение
+        waiter = Thread(
+            target=lambda: results.append(second.execute('key', b'body', operation, 1))
+        )
+        waiter.start()
+        release.set()
+        owner.join()
+        waiter.join()
+        assert results == [(StoredResponse(200, 'application/json', b'{}'), True)]
+        assert calls == [1]
+        assert second.execute('key', b'other', operation, 1) == (None, True)
+    finally:
+        shard_pool.stop()
+
+
+def test_shard_releases_key_after_failure():
+    shard = Shard()
+    assert shard.claim(0, 1, ('key', b'body')) == [(0, 1, ('run', None))]
+    assert shard.claim(1, 2, ('key', b'body')) == []
+    assert shard.finish(0, 3, ('key', None)) == [(0, 3, None), (1, 2, ('retry', None))]
+    assert shard.claim(1, 4, ('key', b'body')) == [(1, 4, ('run', None))]
+
+
+def test_prefork_serve():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    stop = Event()
+    thread = Thread(target=serve, args=('127.0.0.1', port, 1, stop))
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{0}/market/api/v1.0/1/get_ye'.format(port)
+        for _ in range(50):
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    assert json.loads(response.read()) == {'COUNT_YE': '1000'}
+                break
+            except OSError:
+                stop.wait(0.1)
+        else:
+            pytest.fail('worker did not start')
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,49 @@
+import pytest
+from exchange.storage import (
+    StorageConfig,
+    engine_options,
+    make_engine,
+    sqlite_pragmas,
+)
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+def test_config_from_env():
+    config = StorageConfig.from_env(
+        {
+            'EXCHANGE_DB_URL': 'postgresql://exchange@localhost/exchange',
+            'EXCHANGE_DB_POOL_SIZE': '20',
+            'EXCHANGE_DB_POOL_TIMEOUT': '2.5',
+        }
+    )
+    assert config.url == 'postgresql://exchange@localhost/exchange'
+    assert config.pool_size == 20
+    assert config.pool_timeout == 2.5
+    assert config.max_overflow == StorageConfig().max_overflow
+
+
+def test_server_database_options():
+    options = engine_options(StorageConfig(url='postgresql://localhost/exchange'))
+    assert options['pool_size'] == 5
+    assert options['pool_pre_ping'] is True
+    assert 'poolclass' not in options
+
+
+@pytest.mark.parametrize('url', ('sqlite://', 'sqlite:///:memory:'))
+def test_memory_sqlite(url):
+    config = StorageConfig(url=url)
+    assert engine_options(config)['poolclass'] is StaticPool
+    assert 'journal_mode' not in sqlite_pragmas(config)
+
+
+def test_sqlite_file_engine(tmp_path):
+    config = StorageConfig(
+        url='sqlite:///{0}'.format(tmp_path / 'exchange.sqlite'), synchronous='OFF'
+    )
+    engine = make_engine(config)
+    assert isinstance(engine.pool, QueuePool)
+    with engine.connect() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.execute('PRAGMA synchronous').scalar() == 0
+        assert connection.execute('PRAGMA busy_timeout').scalar() == 5000
+    engine.dispose()
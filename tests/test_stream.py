@@ -0,0 +1,109 @@
+import json
+from itertools import islice
+
+from exchange.app import server
+from exchange import broadcast
+from exchange.broadcast import Broadcaster
+from exchange.rates import RateSnapshot, rate_cache
+
+
+def parse(frame):
+    fields = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+    return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+
+def test_subscribe_starts_with_snapshot():
+    broadcaster = Broadcaster()
+    seq, kind, data = parse(next(broadcaster.subscribe(currencies=['btc', 'nope'])))
+    # номер снимка - версия курса, с которой он снят
+    assert (seq, kind) == (rate_cache.current().version, 'snapshot')
+    assert data['rates'] == {'btc': {'sold_price': '12', 'buy_price': '10'}}
+
+
+def versions(count):
+    prices = rate_cache.current().prices
+    return [RateSnapshot(version, prices) for version in range(1, count + 1)]
+
+
+def test_subscribe_resumes_after_sequence():
+    broadcaster = Broadcaster()
+    first, second = versions(2)
+    broadcaster.publish('tick', first)
+    broadcaster.publish('add', second, ['eth'])
+    frames = list(islice(broadcaster.subscribe(after=1, timeout=0), 2))
+    seq, kind, data = parse(frames[0])
+    assert (seq, kind, list(data['rates'])) == (2, 'add', ['eth'])
+    assert frames[1] == ': keepalive\n\n'
+
+
+def test_subscribe_filters_currencies():
+    broadcaster = Broadcaster()
+    first, second = versions(2)
+    broadcaster.publish('add', first, ['eth'])
+    broadcaster.publish('tick', second)
+    frames = list(islice(broadcaster.subscribe(0, ['btc'], timeout=0), 2))
+    seq, kind, data = parse(frames[0])
+    assert (seq, kind, list(data['rates'])) == (2, 'tick', ['btc'])
+    assert frames[1] == ': keepalive\n\n'
+
+
+def test_subscribe_too_old_sequence_gets_snapshot():
+    broadcaster = Broadcaster(history=1)
+    for snapshot in versions(3):
+        broadcaster.publish('tick', snapshot)
+    assert parse(next(broadcaster.subscribe(after=1)))[1] == 'snapshot'
+    # клиент из воркера, который раньше получил курс, ждёт тех же версий
+    assert broadcaster.events_after(10) == []
+
+
+def test_skipped_versions_drop_history():
+    broadcaster = Broadcaster()
+    first, _, third = versions(3)
+    broadcaster.publish('tick', first)
+    broadcaster.publish('tick', third)
+    assert broadcaster.events_after(1) is None
+    assert [event.seq for event in broadcaster.events_after(2)] == [3]
+
+
+def test_lagging_subscriber_restarts_from_snapshot():
+    broadcaster = Broadcaster(history=1)
+    subscriber = broadcaster.subscribe(timeout=0)
+    next(subscriber)
+    for snapshot in versions(3):
+        broadcaster.publish('tick', snapshot)
+    assert parse(next(subscriber))[1] == 'snapshot'
+
+
+def test_event_ids_are_rate_versions():
+    broadcaster = Broadcaster()
+    first, second = versions(2)
+    assert broadcaster.publish('tick', second).seq == 2
+    # тот же курс второй раз не рассылается, а пересозданная база
+    # начинает нумерацию заново
+    assert broadcaster.publish('tick', second) is None
+    assert broadcaster.publish('tick', first).seq == 1
+    assert broadcaster.events_after(0)[0].seq == 1
+
+
+def test_stream_endpoint_pushes_added_currency():
+    # база пересоздаётся на каждый тест, и версии курса начинаются заново
+    broadcast.broadcaster.publish('tick', rate_cache.current())
+    with server.test_client() as client:
+        response = client.get(
+            '/market/api/v1.0/stream?currencies=new',
+            headers={'Last-Event-ID': 'abc'},
+            buffered=False,
+        )
+        assert response.mimetype == 'text/event-stream'
+        frames = iter(response.response)
+        first = next(frames)
+        assert parse(first.decode())[1] == 'snapshot'
+        client.post(
+            '/market/api/v1.0/add',
+            data=json.dumps({'name': 'new', 'sold_price': 2, 'buy_price': 1}),
+            content_type='application/json',
+        )
+        _, kind, data = parse(next(frames).decode())
+        assert kind == 'add'
+        assert data['rates'] == {'new': {'sold_price': '2', 'buy_price': '1'}}
+        response.close()
@@ -0,0 +1,87 @@
+from decimal import Decimal
+from random import Random
+from threading import Event
+
+import pytest
+from exchange.db import ExchangeRate, create_session
+from exchange.orderbook import matching_engine
+from exchange.rates import rate_cache
+from exchange.ticker import (
+    CorrelatedGBM,
+    RandomWalk,
+    RateTicker,
+    UniformModel,
+    model_from_name,
+)
+
+NAMES = ['btc', 'eth', 'xpr']
+
+
+@pytest.fixture(autouse=True)
+def _load_orders(_init_db):
+    matching_engine.load()
+
+
+def test_uniform_model_shares_factor():
+    factors = UniformModel(rng=Random(1)).factors(NAMES)
+    assert len(set(factors)) == 1
+    assert 0.9 <= factors[0] <= 1.1
+
+
+def test_random_walk_independent():
+    factors = RandomWalk(rng=Random(1)).factors(NAMES)
+    assert len(set(factors)) == 3
+    assert all(0.9 <= factor <= 1.1 for factor in factors)
+
+
+def test_correlated_gbm():
+    factors = CorrelatedGBM(sigma=0.01, corr=1, rng=Random(1)).factors(NAMES)
+    assert factors[0] == pytest.approx(factors[2])
+    assert all(factor > 0 for factor in factors)
+
+
+def test_replay(tmp_path):
+    path = tmp_path / 'ticks.jsonl'
+    path.write_text('{"btc": 1.5}\n\n{"eth": 0.5}\n')
+    model = model_from_name('replay:{0}'.format(path))
+    assert model.factors(NAMES) == [1.5, 1.0, 1.0]
+    assert model.factors(NAMES) == [1.0, 0.5, 1.0]
+    assert model.factors(NAMES) == [1.5, 1.0, 1.0]
+
+
+def test_model_from_name():
+    assert isinstance(model_from_name('gbm'), CorrelatedGBM)
+    with pytest.raises(ValueError, match='Unknown price model'):
+        model_from_name('unknown')
+
+
+def test_model_resolved_on_first_use():
+    ticker = RateTicker('unknown')
+    with pytest.raises(ValueError, match='Unknown price model'):
+        ticker.tick()
+    assert isinstance(RateTicker('walk').model, RandomWalk)
+
+
+def test_tick_updates_all_rates(fixed_model):
+    version = rate_cache.current().version
+    snapshot = RateTicker(fixed_model).tick()
+    assert snapshot.version > version
+    assert snapshot.prices['btc'] == (Decimal(24), Decimal(20))
+    with create_session() as session:
+        rate = session.query(ExchangeRate).filter(ExchangeRate.name == 'ltc').first()
+        assert (rate.sold_price, rate.buy_price) == (Decimal(104), Decimal(100))
+
+
+def test_run_until_stopped(fixed_model):
+    stop = Event()
+    ticker = RateTicker(fixed_model, interval=0)
+    ticks = []
+
+    def tick():
+        ticks.append(1)
+        if len(ticks) == 2:
+            stop.set()
+
+    ticker.tick = tick
+    ticker.run(stop)
+    assert len(ticks) == 2
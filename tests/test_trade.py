@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from exchange.db import User, UserCurrency, create_session, table_of
+from exchange.exception import NotEnoughFunds, TradeConflict
+from exchange.trade import TradeRequest, apply_trade, execute_trade
+
+
+@pytest.fixture(autouse=True)
+def _add_user(_init_db):
+    with create_session() as session:
+        session.add(User('username'))
+        session.flush()
+        session.add(UserCurrency(1, 'btc'))
+
+
+def test_execute_trade_buy():
+    result = execute_trade(TradeRequest(1, 'btc', Decimal(10), Decimal(120), 'buy'))
+    assert result.ye == Decimal(880)
+    assert result.count_currency == Decimal(10)
+
+
+def test_execute_trade_sold_not_enough():
+    with pytest.raises(NotEnoughFunds):
+        execute_trade(TradeRequest(1, 'btc', Decimal(1), Decimal(10), 'sold'))
+
+
+class RacingSession:
+    # после первого чтения баланс меняет "параллельный" запрос
+    def __init__(self, session):
+        self.session = session
+        self.raced = False
+
+    def execute(self, statement):
+        result = self.session.execute(statement)
+        if not self.raced:
+            self.raced = True
+            self.session.execute(table_of(User).update().values(ye=Decimal(500)))
+        return result
+
+    def add(self, item):
+        self.session.add(item)
+
+
+def test_apply_trade_conflict():
+    with pytest.raises(TradeConflict):
+        with create_session() as session:
+            apply_trade(
+                RacingSession(session),
+                TradeRequest(1, 'btc', Decimal(1), Decimal(1), 'buy'),
+            )
+
+
+def test_execute_trade_retries_conflict(monkeypatch):
+    calls = []
+
+    def conflict_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise TradeConflict()
+        return apply_trade(*args)
+
+    monkeypatch.setattr('exchange.trade.apply_trade', conflict_once)
+    result = execute_trade(TradeRequest(1, 'btc', Decimal(1), Decimal(12), 'buy'))
+    assert len(calls) == 2
+    assert result.ye == Decimal(988)
+
+
+def test_parallel_buys_do_not_double_spend():
+    def buy(_: int) -> bool:
+        try:
+            execute_trade(TradeRequest(1, 'btc', Decimal(50), Decimal(600), 'buy'))
+        except NotEnoughFunds:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(buy, range(4)))
+    assert results.count(True) == 1
+    with create_session() as session:
+        assert session.query(User).first().ye == Decimal(400)
+
+
+def test_execute_trade_gives_up_after_conflicts(monkeypatch):
+    def conflict(*args):
+        raise TradeConflict()
+
+    monkeypatch.setattr('exchange.trade.apply_trade', conflict)
+    with pytest.raises(TradeConflict):
+        execute_trade(TradeRequest(1, 'btc', Decimal(1), Decimal(12), 'buy'))
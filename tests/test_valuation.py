@@ -0,0 +1,87 @@
+import json
+from decimal import Decimal
+
+import pytest
+from exchange.app import server
+from exchange.db import User, UserOperations, create_session
+from exchange.orderbook import matching_engine
+from exchange.ticker import RateTicker
+from exchange.valuation import valuation_store
+
+
+@pytest.fixture(autouse=True)
+def _load_state(_init_db):
+    matching_engine.load()
+    valuation_store.load()
+
+
+@pytest.fixture()
+def client():
+    with server.test_client() as client:
+        for name in ('first', 'second'):
+            client.post(
+                '/market/api/v1.0/registration',
+                data=json.dumps({'name': name}),
+                content_type='application/json',
+            )
+        yield client
+
+
+def buy(client, user_id, name, count):
+    client.post(
+        '/market/api/v1.0/{0}/buy'.format(user_id),
+        data=json.dumps({'name': name, 'count': count}),
+        content_type='application/json',
+    )
+
+
+def test_valuation(client):
+    buy(client, 1, 'btc', '1')
+    response = client.get('/market/api/v1.0/1/valuation')
+    data = json.loads(response.get_data())
+    assert data['VALUATION'] == {'btc': '10'}
+    assert Decimal(data['YE']) == 988
+    assert Decimal(data['TOTAL']) == 998
+
+
+def test_valuation_unknown_user(client):
+    response = client.get('/market/api/v1.0/100/valuation')
+    assert response.status_code == 404
+
+
+def test_leaderboard_revalued_on_tick(client, fixed_model):
+    buy(client, 2, 'eth', '2')
+    response = client.get('/market/api/v1.0/leaderboard?limit=1')
+    data = json.loads(response.get_data())
+    assert data['LEADERBOARD'] == [{'user_id': 1, 'total': '1000'}]
+    assert Decimal(data['MARKET']) == 1996
+
+    RateTicker(fixed_model).tick()
+    data = json.loads(client.get('/market/api/v1.0/leaderboard').get_data())
+    assert [item['user_id'] for item in data['LEADERBOARD']] == [2, 1]
+    assert Decimal(data['LEADERBOARD'][0]['total']) == 1036
+    assert Decimal(data['MARKET']) == 2036
+
+
+def test_leaderboard_invalid_limit(client):
+    response = client.get('/market/api/v1.0/leaderboard?limit=abc')
+    assert response.status_code == 400
+
+
+def test_sync_rereads_operations_committed_late(client):
+    buy(client, 1, 'btc', '1')
+    buy(client, 2, 'btc', '1')
+    buy(client, 1, 'btc', '1')
+    with create_session() as session:
+        # вторая сделка ещё не закоммичена, а третья уже видна
+        late = session.query(UserOperations).get(2)
+        session.expunge(late)
+        session.query(UserOperations).filter(UserOperations.id == 2).delete()
+        session.query(User).filter(User.id == 2).update({'ye': 1000})
+    valuation_store.sync()
+    with create_session() as session:
+        session.merge(late)
+        session.query(User).filter(User.id == 2).update({'ye': 988})
+    valuation_store.sync()
+    data = json.loads(client.get('/market/api/v1.0/2/valuation').get_data())
+    assert Decimal(data['YE']) == 988